@@ -9,6 +9,7 @@ setup(
     url="https://github.com/jamespfennell/transiter-nycsubway",
     packages=find_packages(),
     include_package_data=True,
+    package_data={"": ["descriptor_set.pb"]},
     install_requires=["python-dateutil>=2.8.1", "transiter>=0.5.0"],
     license="MIT",
 )
@@ -0,0 +1,153 @@
+import pytest
+from transiter_ny_mta import AlertsParser
+from transiter_ny_mta import alertcache
+from transiter_ny_mta import syntheticfeeds
+from transiter_ny_mta.proto import alerts_pb2 as gtfs
+
+_mercury_alert_key = gtfs.Alert._extensions_by_number[gtfs.MTA_EXTENSION_ID]
+
+
+def build_content(alert_id_to_updated_at, header_text="Delays", timestamp=100):
+    entities = []
+    for alert_id, updated_at in alert_id_to_updated_at.items():
+        alert = gtfs.Alert(
+            header_text=gtfs.TranslatedString(
+                translation=[gtfs.TranslatedString.Translation(text=header_text)]
+            )
+        )
+        if updated_at is not None:
+            mercury_alert = alert.Extensions[_mercury_alert_key]
+            mercury_alert.created_at = 1
+            mercury_alert.updated_at = updated_at
+            mercury_alert.alert_type = "Delays"
+        entities.append(gtfs.FeedEntity(id=alert_id, alert=alert))
+    return gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0", timestamp=timestamp),
+        entity=entities,
+    ).SerializeToString()
+
+
+def parse_alerts(content, options):
+    parser = AlertsParser()
+    parser.load_options(options)
+    parser.load_content(content)
+    return list(parser.get_alerts())
+
+
+@pytest.fixture
+def parser():
+    parser = AlertsParser()
+    parser.load_options({"incremental": True})
+    return parser
+
+
+def ids(alerts):
+    return [alert.id for alert in alerts]
+
+
+def test_changes(parser):
+    parser.load_content(build_content({"alert_1": 1, "alert_2": 1, "alert_3": 1}))
+    changes_1 = parser.get_alert_changes()
+    alerts_1 = list(parser.get_alerts())
+    parser.load_content(build_content({"alert_1": 1, "alert_2": 2, "alert_4": 1}))
+    changes_2 = parser.get_alert_changes()
+    alerts_2 = list(parser.get_alerts())
+
+    assert ["alert_1", "alert_2", "alert_3"] == ids(changes_1.added)
+    assert [] == changes_1.updated == changes_1.removed
+    assert ["alert_4"] == ids(changes_2.added)
+    assert ["alert_2"] == ids(changes_2.updated)
+    assert ["alert_3"] == ids(changes_2.removed)
+    assert alerts_1[2] is changes_2.removed[0]
+    assert ["alert_1", "alert_2", "alert_4"] == ids(alerts_2)
+    # The unchanged alert is not converted again
+    assert alerts_1[0] is alerts_2[0]
+    assert 1 == parser.alert_cache.stats.hits
+    assert 5 == parser.alert_cache.stats.misses
+    assert 1 == parser.alert_cache.stats.evictions
+    assert 3 == len(parser.alert_cache)
+
+
+def test_changes__alert_changed_without_new_update_time(parser):
+    parser.load_content(build_content({"alert_1": 1}, header_text="Delays"))
+    parser.load_content(build_content({"alert_1": 1}, header_text="Suspended"))
+
+    # The update time is trusted
+    assert not parser.get_alert_changes()
+    assert "Delays" == list(parser.get_alerts())[0].messages[0].header
+
+
+def test_changes__no_update_time(parser):
+    parser.load_content(build_content({"alert_1": None}, header_text="Delays"))
+    parser.load_content(build_content({"alert_1": None}, header_text="Delays"))
+    changes_1 = parser.get_alert_changes()
+    parser.load_content(build_content({"alert_1": None}, header_text="Suspended"))
+    changes_2 = parser.get_alert_changes()
+
+    assert not changes_1
+    assert ["alert_1"] == ids(changes_2.updated)
+    assert "Suspended" == list(parser.get_alerts())[0].messages[0].header
+
+
+def test_changes__content_cache():
+    parser = AlertsParser()
+    parser.load_options({"incremental": True, "content_cache": True})
+    content = build_content({"alert_1": 1})
+
+    parser.load_content(content)
+    parser.load_content(content)
+
+    assert not parser.get_alert_changes()
+    assert ["alert_1"] == ids(parser.get_alerts())
+
+
+def test_changes__repeated_alert_id(parser):
+    parser.load_content(build_content({"alert_1": 1}))
+    content = gtfs.FeedMessage.FromString(build_content({"alert_1": 2}))
+    content.entity.append(content.entity[0])
+    parser.load_content(content.SerializeToString())
+
+    assert ["alert_1"] == ids(parser.get_alert_changes().updated)
+    assert ["alert_1", "alert_1"] == ids(parser.get_alerts())
+
+
+def test_changes__require_incremental_option():
+    parser = AlertsParser()
+    parser.load_content(build_content({"alert_1": 1}))
+
+    with pytest.raises(ValueError):
+        parser.get_alert_changes()
+
+
+def test_changes__require_content(parser):
+    with pytest.raises(ValueError):
+        parser.get_alert_changes()
+
+
+def test_timestamp_and_print_decode_lazily(parser, capsys):
+    parser.load_content(build_content({"alert_1": 1}, timestamp=1000))
+
+    assert 1000 == parser.get_timestamp().timestamp()
+    assert parser._gtfs_feed_message is None
+    parser.print()
+    assert "alert_1" in capsys.readouterr().out
+
+
+def test_matches_full_parse(parser):
+    generator = syntheticfeeds.AlertsFeedGenerator(seed=5, num_alerts=40, churn=0.2)
+    previous_ids = set()
+    for content in generator.snapshots(10):
+        parser.load_content(content)
+        alerts = list(parser.get_alerts())
+        changes = parser.get_alert_changes()
+
+        assert parse_alerts(content, {}) == alerts
+        assert set(ids(alerts)) == previous_ids - set(ids(changes.removed)) | set(
+            ids(changes.added)
+        )
+        previous_ids = set(ids(alerts))
+    assert parser.alert_cache.stats.hits > parser.alert_cache.stats.misses
+
+
+def test_alert_changes_is_falsy_when_empty():
+    assert not alertcache.AlertChanges()
@@ -0,0 +1,90 @@
+import pytest
+from transiter_ny_mta import alertfilter
+from transiter_ny_mta.proto import alerts_pb2
+
+
+def _build_feed_message(*headers):
+    return alerts_pb2.FeedMessage(
+        header=alerts_pb2.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            alerts_pb2.FeedEntity(
+                id=str(i),
+                alert=alerts_pb2.Alert(
+                    header_text=alerts_pb2.TranslatedString(
+                        translation=[
+                            alerts_pb2.TranslatedString.Translation(
+                                text=header, language="en"
+                            )
+                        ]
+                    )
+                ),
+            )
+            for i, header in enumerate(headers)
+        ],
+    )
+
+
+def test_filter_content():
+    content = _build_feed_message(
+        "Delays", " Weekend Service", "Part Suspended", "WEEKDAY SERVICE"
+    ).SerializeToString()
+
+    (
+        filtered_content,
+        num_entities,
+        num_removed,
+    ) = alertfilter.NonAlertFilter().filter_content(content)
+
+    assert (4, 2) == (num_entities, num_removed)
+    feed_message = alerts_pb2.FeedMessage.FromString(filtered_content)
+    assert "2.0" == feed_message.header.gtfs_realtime_version
+    assert ["0", "2"] == [entity.id for entity in feed_message.entity]
+
+
+def test_filter_content__nothing_removed():
+    content = _build_feed_message("Delays").SerializeToString()
+
+    (
+        filtered_content,
+        num_entities,
+        num_removed,
+    ) = alertfilter.NonAlertFilter().filter_content(content)
+
+    assert filtered_content is content
+    assert (1, 0) == (num_entities, num_removed)
+
+
+def test_filter_content__entities_without_alerts_are_kept():
+    feed_message = _build_feed_message("Weekend Service")
+    feed_message.entity.add(id="no alert")
+
+    filtered_content, _, _ = alertfilter.NonAlertFilter().filter_content(
+        feed_message.SerializeToString()
+    )
+
+    assert ["no alert"] == [
+        entity.id
+        for entity in alerts_pb2.FeedMessage.FromString(filtered_content).entity
+    ]
+
+
+def test_custom_headers():
+    non_alert_filter = alertfilter.NonAlertFilter(["Planned Work "])
+
+    assert non_alert_filter.is_non_alert_header("planned work")
+    assert not non_alert_filter.is_non_alert_header("Weekend Service")
+
+
+@pytest.mark.parametrize(
+    "translations,expected",
+    [
+        [[], False],
+        [[("en", "Weekend Service")], True],
+        [[("en", "Weekend Service"), ("es", "Servicio")], True],
+        [[("en", "Weekend Service"), ("en", "Delays")], False],
+        [[("en", "Delays"), ("en", "Weekend Service")], True],
+        [[(None, "Weekend Service"), ("en", "Delays")], True],
+    ],
+)
+def test_is_non_alert(translations, expected):
+    assert expected == alertfilter.NonAlertFilter().is_non_alert(translations)
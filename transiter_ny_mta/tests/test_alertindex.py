@@ -0,0 +1,217 @@
+import datetime
+import random
+
+import pytest
+import pytz
+from transiter import parse
+from transiter_ny_mta import AlertsParser
+from transiter_ny_mta import alertindex
+from transiter_ny_mta import syntheticfeeds
+
+
+def time(hour):
+    return datetime.datetime(2020, 9, 1, tzinfo=pytz.UTC) + datetime.timedelta(
+        hours=hour
+    )
+
+
+def build_alert(alert_id, periods, route_ids=(), stop_ids=()):
+    return parse.Alert(
+        id=alert_id,
+        active_periods=[
+            parse.AlertActivePeriod(
+                starts_at=None if start is None else time(start),
+                ends_at=None if end is None else time(end),
+            )
+            for start, end in periods
+        ],
+        route_ids=list(route_ids),
+        stop_ids=list(stop_ids),
+    )
+
+
+def ids(alerts):
+    return sorted(alert.id for alert in alerts)
+
+
+@pytest.fixture
+def index():
+    return alertindex.AlertIndex(
+        [
+            build_alert("alert_1", [(0, 2), (5, 6)], route_ids=["A", "C"]),
+            build_alert("alert_2", [(1, None)], route_ids=["A"], stop_ids=["A02"]),
+            build_alert("alert_3", [], stop_ids=["A02", "A03"]),
+            build_alert("alert_4", [(None, 1)], route_ids=["C", "C"]),
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "hour,route_id,stop_id,expected_ids",
+    [
+        [0, None, None, ["alert_1", "alert_3", "alert_4"]],
+        [1, None, None, ["alert_1", "alert_2", "alert_3", "alert_4"]],
+        [3, None, None, ["alert_2", "alert_3"]],
+        [-100, None, None, ["alert_3", "alert_4"]],
+        [100, None, None, ["alert_2", "alert_3"]],
+        [2, "A", None, ["alert_1", "alert_2"]],
+        [3, "A", None, ["alert_2"]],
+        [5, "C", None, ["alert_1"]],
+        [4, "C", None, []],
+        [0, None, "A02", ["alert_3"]],
+        [1, None, "A02", ["alert_2", "alert_3"]],
+        [1, "B", None, []],
+        [1, None, "B01", []],
+    ],
+)
+def test_active_at(index, hour, route_id, stop_id, expected_ids):
+    alerts = index.active_at(time(hour), route_id=route_id, stop_id=stop_id)
+
+    assert expected_ids == ids(alerts)
+
+
+@pytest.mark.parametrize(
+    "start,end,route_id,expected_ids",
+    [
+        [3, 4, "C", []],
+        [3, 5, "C", ["alert_1"]],
+        [-5, 10, "C", ["alert_1", "alert_4"]],
+        [-5, 0, "A", ["alert_1"]],
+        [2, 2, None, ["alert_1", "alert_2", "alert_3"]],
+    ],
+)
+def test_active_between(index, start, end, route_id, expected_ids):
+    alerts = index.active_between(time(start), time(end), route_id=route_id)
+
+    assert expected_ids == ids(alerts)
+
+
+def test_active_between__start_after_end(index):
+    with pytest.raises(ValueError):
+        index.active_between(time(1), time(0))
+
+
+def test_active_at__route_and_stop(index):
+    with pytest.raises(ValueError):
+        index.active_at(time(1), route_id="A", stop_id="A02")
+
+
+def test_add_and_remove(index):
+    index.add(build_alert("alert_1", [(3, 4)], route_ids=["E"]))
+    removed = index.remove("alert_4")
+
+    assert "alert_4" == removed.id
+    assert None is index.remove("alert_4")
+    assert "alert_4" not in index
+    assert 3 == len(index)
+    assert ["alert_1"] == ids(index.active_at(time(3), route_id="E"))
+    assert [] == ids(index.active_at(time(0), route_id="C"))
+    assert [] == ids(index.active_at(time(0), route_id="A"))
+    assert ["E"] == index.get("alert_1").route_ids
+
+
+def test_set_alerts():
+    alert_1 = build_alert("alert_1", [(0, 2)], route_ids=["A"])
+    alert_2 = build_alert("alert_2", [(0, 2)], route_ids=["A"])
+    index = alertindex.AlertIndex([alert_1, alert_2])
+
+    index.set_alerts([alert_1, build_alert("alert_3", [(0, 2)], route_ids=["C"])])
+
+    assert ["alert_1", "alert_3"] == ids(index.active_at(time(1)))
+    assert ["alert_1"] == ids(index.active_at(time(1), route_id="A"))
+    assert alert_1 is index.get("alert_1")
+
+
+def test_set_alerts__replace_many():
+    index = alertindex.AlertIndex(
+        [build_alert(f"alert_{i}", [(i, i + 1)], route_ids=[str(i)]) for i in range(20)]
+    )
+
+    index.set_alerts(
+        [build_alert(f"alert_{i}", [(i, i + 2)], route_ids=["A"]) for i in range(20)]
+        + [build_alert("alert_0", [(50, 60)], route_ids=["0"])]
+    )
+
+    assert 20 == len(index)
+    assert ["alert_1", "alert_2", "alert_3"] == ids(
+        index.active_at(time(3), route_id="A")
+    )
+    assert ["alert_0"] == ids(index.active_at(time(55), route_id="0"))
+    assert [] == ids(index.active_at(time(1), route_id="1"))
+
+
+def test_is_active_at():
+    alert = build_alert("alert_1", [(0, 2), (5, None)])
+
+    assert [True, True, False, True, True] == [
+        alertindex.is_active_at(alert, time(hour)) for hour in [0, 2, 3, 5, 100]
+    ]
+
+
+def scan(alerts, start, end, route_id=None):
+    unbounded = [parse.AlertActivePeriod(starts_at=None, ends_at=None)]
+    return [
+        alert
+        for alert in alerts
+        if (route_id is None or route_id in alert.route_ids)
+        and any(
+            (period.starts_at is None or period.starts_at <= end)
+            and (period.ends_at is None or period.ends_at >= start)
+            for period in alert.active_periods or unbounded
+        )
+    ]
+
+
+def test_random_updates_match_scan():
+    rng = random.Random(7)
+    index = alertindex.AlertIndex()
+    id_to_alert = {}
+    for step in range(400):
+        alert_id = f"alert_{rng.randint(0, 60)}"
+        if rng.random() < 0.3:
+            index.remove(alert_id)
+            id_to_alert.pop(alert_id, None)
+        else:
+            periods = []
+            for _ in range(rng.randint(0, 3)):
+                start = rng.randint(-50, 50)
+                periods.append(
+                    (
+                        None if rng.random() < 0.1 else start,
+                        None if rng.random() < 0.1 else start + rng.randint(0, 20),
+                    )
+                )
+            alert = build_alert(
+                alert_id, periods, route_ids=rng.sample(["A", "C", "E"], 2)
+            )
+            index.add(alert)
+            id_to_alert[alert_id] = alert
+        if step % 10 != 0:
+            continue
+        for _ in range(5):
+            start = rng.randint(-60, 60)
+            end = start + rng.choice([0, 0, 5, 30])
+            route_id = rng.choice([None, "A", "E"])
+            expected = scan(id_to_alert.values(), time(start), time(end), route_id)
+            actual = index.active_between(time(start), time(end), route_id=route_id)
+            assert ids(expected) == ids(actual)
+
+
+def test_apply_changes_matches_scan():
+    generator = syntheticfeeds.AlertsFeedGenerator(
+        seed=2, num_alerts=60, churn=0.3, poll_interval=3600
+    )
+    parser = AlertsParser()
+    parser.load_options({"incremental": True})
+    index = alertindex.AlertIndex()
+    for _ in range(10):
+        now = datetime.datetime.fromtimestamp(generator.time, pytz.UTC)
+        parser.load_content(generator.next_snapshot())
+        index.apply_changes(parser.get_alert_changes())
+        alerts = list(parser.get_alerts())
+
+        assert len(alerts) == len(index)
+        for route_id in [None, "A", "L"]:
+            assert ids(scan(alerts, now, now, route_id)) == ids(
+                index.active_at(now, route_id=route_id)
+            )
@@ -3,7 +3,8 @@ import datetime
 import pytest
 import pytz
 from transiter import parse
-from transiter_ny_mta import alertsparser
+from transiter_ny_mta import alertsparser, syntheticfeeds
+from transiter_ny_mta.alertsparser import Engine
 from transiter_ny_mta.proto import alerts_pb2 as gtfs_rt_pb2
 
 ALERT_ID = "alert_id"
@@ -11,8 +12,20 @@ TIME_1 = datetime.datetime.utcfromtimestamp(1000).replace(tzinfo=pytz.UTC)
 TIME_2 = datetime.datetime.utcfromtimestamp(2000).replace(tzinfo=pytz.UTC)
 
 
+PARSER_OPTIONS = [{"engine": engine.value} for engine in Engine] + [
+    {"incremental": True}
+]
+
+
+@pytest.fixture(params=PARSER_OPTIONS)
+def parser(request):
+    parser = alertsparser.AlertsParser()
+    parser.load_options(request.param)
+    return parser
+
+
 @pytest.mark.parametrize("priority", iter(alertsparser.NyctBusPriority))
-def test_base_cases(priority):
+def test_base_cases(priority, parser):
     informed_entity = gtfs_rt_pb2.EntitySelector()
     mta_ext_key = informed_entity._extensions_by_number[gtfs_rt_pb2.MTA_EXTENSION_ID]
     informed_entity.Extensions[mta_ext_key].sort_order = "MTA:{}".format(priority.value)
@@ -27,7 +40,6 @@ def test_base_cases(priority):
         header=gtfs_rt_pb2.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[gtfs_rt_pb2.FeedEntity(id=ALERT_ID, alert=alert)],
     )
-    parser = alertsparser.AlertsParser()
     parser.load_content(feed_message.SerializeToString())
 
     expected_alerts = [
@@ -46,14 +58,13 @@ def test_base_cases(priority):
     assert expected_alerts == actual_alerts
 
 
-def test_missing_entity_selector():
+def test_missing_entity_selector(parser):
     alert = gtfs_rt_pb2.Alert()
 
     feed_message = gtfs_rt_pb2.FeedMessage(
         header=gtfs_rt_pb2.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[gtfs_rt_pb2.FeedEntity(id=ALERT_ID, alert=alert)],
     )
-    parser = alertsparser.AlertsParser()
     parser.load_content(feed_message.SerializeToString())
 
     expected_alerts = [
@@ -69,7 +80,7 @@ def test_missing_entity_selector():
     "header_text",
     ["Weekend Service", " Weekend Service ", "weekend service", "Weekday Service"],
 )
-def test_skip_non_alerts(header_text):
+def test_skip_non_alerts(header_text, parser):
     alert = gtfs_rt_pb2.Alert(
         header_text=gtfs_rt_pb2.TranslatedString(
             translation=[
@@ -84,14 +95,13 @@ def test_skip_non_alerts(header_text):
         header=gtfs_rt_pb2.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[gtfs_rt_pb2.FeedEntity(id=ALERT_ID, alert=alert)],
     )
-    parser = alertsparser.AlertsParser()
     parser.load_content(feed_message.SerializeToString())
 
     assert [] == list(parser.get_alerts())
 
 
 @pytest.mark.parametrize("priority_string", ["MTA:1000", "blah"])
-def test_bad_priority_string(priority_string):
+def test_bad_priority_string(priority_string, parser):
     informed_entity = gtfs_rt_pb2.EntitySelector()
     mta_ext_key = informed_entity._extensions_by_number[gtfs_rt_pb2.MTA_EXTENSION_ID]
     informed_entity.Extensions[mta_ext_key].sort_order = priority_string
@@ -102,7 +112,6 @@ def test_bad_priority_string(priority_string):
         header=gtfs_rt_pb2.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[gtfs_rt_pb2.FeedEntity(id=ALERT_ID, alert=alert)],
     )
-    parser = alertsparser.AlertsParser()
     parser.load_content(feed_message.SerializeToString())
 
     expected_alerts = [
@@ -112,3 +121,169 @@ def test_bad_priority_string(priority_string):
     actual_alerts = list(parser.get_alerts())
 
     assert expected_alerts == actual_alerts
+
+
+def _build_feed_message(*alerts):
+    return gtfs_rt_pb2.FeedMessage(
+        header=gtfs_rt_pb2.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            gtfs_rt_pb2.FeedEntity(id=f"{ALERT_ID}_{i}", alert=alert)
+            for i, alert in enumerate(alerts)
+        ],
+    )
+
+
+def _translated_string(*texts_and_languages):
+    return gtfs_rt_pb2.TranslatedString(
+        translation=[
+            gtfs_rt_pb2.TranslatedString.Translation(text=text, language=language)
+            for text, language in texts_and_languages
+        ]
+    )
+
+
+def test_messages_and_informed_entities(parser):
+    alert = gtfs_rt_pb2.Alert(
+        cause=gtfs_rt_pb2.Alert.Cause.WEATHER,
+        active_period=[gtfs_rt_pb2.TimeRange(start=1000, end=2000)],
+        header_text=_translated_string(("Header", "en"), ("Encabezado", "es")),
+        description_text=_translated_string(("Descripción", "es"), ("Other", None)),
+        url=_translated_string(("https://example.com", "en")),
+        informed_entity=[
+            gtfs_rt_pb2.EntitySelector(route_id="A"),
+            gtfs_rt_pb2.EntitySelector(stop_id="A42"),
+            gtfs_rt_pb2.EntitySelector(agency_id="MTA"),
+            gtfs_rt_pb2.EntitySelector(trip=gtfs_rt_pb2.TripDescriptor(trip_id="T")),
+            gtfs_rt_pb2.EntitySelector(trip=gtfs_rt_pb2.TripDescriptor(route_id="C")),
+        ],
+    )
+    transiter_ext_key = alert._extensions_by_number[
+        alertsparser.gtfsrealtime.TRANSITER_EXTENSION_ID
+    ]
+    alert.Extensions[transiter_ext_key].created_at = 1000
+    alert.Extensions[transiter_ext_key].sort_order = 5
+    parser.load_content(_build_feed_message(alert).SerializeToString())
+
+    expected_alerts = [
+        parse.Alert(
+            id=f"{ALERT_ID}_0",
+            effect=parse.Alert.Effect.MODIFIED_SERVICE,
+            created_at=TIME_1,
+            sort_order=5,
+            messages=[
+                parse.AlertMessage(
+                    header="Header",
+                    description="",
+                    url="https://example.com",
+                    language="en",
+                ),
+                parse.AlertMessage(
+                    header="Encabezado", description="Descripción", language="es"
+                ),
+                parse.AlertMessage(header="", description="Other", language=None),
+            ],
+            active_periods=[parse.AlertActivePeriod(starts_at=TIME_1, ends_at=TIME_2)],
+            agency_ids=["MTA"],
+            route_ids=["A", "C"],
+            trip_ids=["T"],
+            stop_ids=["A42"],
+        )
+    ]
+
+    assert expected_alerts == list(parser.get_alerts())
+
+
+@pytest.mark.parametrize(
+    "headers,expected_skipped",
+    [
+        [[("Weekend Service", "en"), ("Servicio", "es")], True],
+        # Only the last header of each language is used
+        [[("Weekend Service", "en"), ("Delays", "en")], False],
+        [[("Delays", "en"), ("Weekend Service", "en")], True],
+        [[("Weekend Service", None), ("Delays", "en")], True],
+    ],
+)
+def test_skip_non_alerts__multiple_headers(headers, expected_skipped, parser):
+    alert = gtfs_rt_pb2.Alert(header_text=_translated_string(*headers))
+    parser.load_content(_build_feed_message(alert).SerializeToString())
+
+    assert expected_skipped == (len(list(parser.get_alerts())) == 0)
+
+
+NON_ALERT_CONTENT = _build_feed_message(
+    gtfs_rt_pb2.Alert(header_text=_translated_string(("Weekend Service", "en"))),
+    gtfs_rt_pb2.Alert(header_text=_translated_string(("Delays", "en"))),
+).SerializeToString()
+
+
+@pytest.mark.parametrize("engine", iter(Engine))
+@pytest.mark.parametrize(
+    "environment_value,keep_non_alerts,expected_num_alerts",
+    [
+        [None, None, 1],
+        ["true", None, 2],
+        ["false", None, 1],
+        ["true", False, 1],
+        [None, True, 2],
+    ],
+)
+def test_keep_non_alerts(
+    monkeypatch, engine, environment_value, keep_non_alerts, expected_num_alerts
+):
+    if environment_value is not None:
+        monkeypatch.setenv(alertsparser.KEEP_NON_ALERTS_ENV_VARIABLE, environment_value)
+    parser = alertsparser.AlertsParser()
+    options = {"engine": engine.value}
+    if keep_non_alerts is not None:
+        options["keep_non_alerts"] = keep_non_alerts
+    parser.load_options(options)
+
+    parser.load_content(NON_ALERT_CONTENT)
+
+    assert expected_num_alerts == len(list(parser.get_alerts()))
+
+
+def test_keep_non_alerts__environment_is_read_once(monkeypatch):
+    monkeypatch.delenv(alertsparser.KEEP_NON_ALERTS_ENV_VARIABLE, raising=False)
+    parser = alertsparser.AlertsParser()
+    monkeypatch.setenv(alertsparser.KEEP_NON_ALERTS_ENV_VARIABLE, "true")
+
+    parser.load_content(NON_ALERT_CONTENT)
+
+    assert 1 == len(list(parser.get_alerts()))
+
+
+def test_non_alert_headers(parser):
+    engine = parser._engine
+    parser.load_options({"non_alert_headers": ["DELAYS "]})
+
+    parser.load_content(NON_ALERT_CONTENT)
+
+    assert [f"{ALERT_ID}_0"] == [alert.id for alert in parser.get_alerts()]
+    assert engine is parser._engine
+
+
+def test_fused_engine_matches_default_engine():
+    content = syntheticfeeds.AlertsFeedGenerator(seed=3).next_snapshot()
+    parsers = []
+    for engine in Engine:
+        parser = alertsparser.AlertsParser()
+        parser.load_options({"engine": engine.value})
+        parser.load_content(content)
+        parsers.append(parser)
+
+    default_alerts, fused_alerts = [list(parser.get_alerts()) for parser in parsers]
+
+    assert len(default_alerts) > 0
+    assert default_alerts == fused_alerts
+
+
+def test_fused_engine_does_not_mutate_the_feed_message():
+    content = syntheticfeeds.AlertsFeedGenerator(seed=3).next_snapshot()
+    parser = alertsparser.AlertsParser()
+    parser.load_options({"engine": Engine.FUSED.value, "keep_non_alerts": True})
+    parser.load_content(content)
+
+    list(parser.get_alerts())
+
+    assert content == parser._gtfs_feed_message.SerializeToString()
@@ -0,0 +1,305 @@
+import asyncio
+
+import pytest
+from transiter_ny_mta import (
+    AlertsParser,
+    SubwayTripsParser,
+    archive,
+    fetcher,
+    standinserver,
+    syntheticfeeds,
+)
+
+
+def _write(path, records, compression=archive.NONE):
+    with archive.ArchiveWriter(str(path), compression) as writer:
+        for feed_id, timestamp, payload in records:
+            writer.append(feed_id, timestamp, payload)
+
+
+RECORDS = [
+    ("ACE", 100, b"ace-1"),
+    ("123456", 101, b"123456-1"),
+    ("ACE", 105, b"ace-2"),
+    ("123456", 106, b""),
+    ("ACE", 110, b"ace-3"),
+]
+
+
+@pytest.mark.parametrize(
+    "compression", [archive.NONE, archive.ZLIB, archive.LZMA],
+)
+def test_round_trip(tmp_path, compression):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS, compression)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        actual = [
+            (record.feed_id, record.timestamp, bytes(record.payload))
+            for record in reader.records()
+        ]
+
+    assert sorted(RECORDS, key=lambda record: record[1]) == actual
+
+
+def test_uncompressed_payloads_are_views_of_the_archive(tmp_path):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS)
+
+    reader = archive.ArchiveReader(str(path))
+    payload = reader.at("ACE", 105).payload
+
+    assert isinstance(payload, memoryview)
+    assert payload.readonly
+    assert b"ace-2" == payload
+    reader.close()
+    assert b"ace-2" == payload
+    payload.release()
+
+
+@pytest.mark.parametrize(
+    "feed_id,start,end,expected",
+    [
+        [None, None, None, [100, 101, 105, 106, 110]],
+        ["ACE", None, None, [100, 105, 110]],
+        ["ACE", 101, None, [105, 110]],
+        ["ACE", None, 105, [100]],
+        ["ACE", 100, 110.5, [100, 105, 110]],
+        [None, 101, 106, [101, 105]],
+        ["L", None, None, []],
+    ],
+)
+def test_records_by_time(tmp_path, feed_id, start, end, expected):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        actual = [record.timestamp for record in reader.records(feed_id, start, end)]
+
+    assert expected == actual
+
+
+@pytest.mark.parametrize(
+    "feed_id,expected",
+    [[None, [100, 101, 105, 106, 110]], ["ACE", [100, 105, 110]], ["L", []]],
+)
+def test_timestamps(tmp_path, monkeypatch, feed_id, expected):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS, archive.LZMA)
+
+    def fail(*args):
+        raise AssertionError("A payload was decompressed")
+
+    monkeypatch.setattr(archive, "_decompress", fail)
+    with archive.ArchiveReader(str(path)) as reader:
+        assert expected == reader.timestamps(feed_id)
+
+
+@pytest.mark.parametrize(
+    "feed_id,timestamp,expected",
+    [
+        ["ACE", 99, None],
+        ["ACE", 100, b"ace-1"],
+        ["ACE", 109.9, b"ace-2"],
+        ["ACE", 1000, b"ace-3"],
+        ["L", 1000, None],
+    ],
+)
+def test_at(tmp_path, feed_id, timestamp, expected):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        record = reader.at(feed_id, timestamp)
+        actual = None if record is None else bytes(record.payload)
+
+    assert expected == actual
+
+
+def test_out_of_order_timestamps(tmp_path):
+    path = tmp_path / "feeds.archive"
+    _write(path, [("ACE", 110, b"c"), ("ACE", 100, b"a"), ("ACE", 105, b"b")])
+
+    with archive.ArchiveReader(str(path)) as reader:
+        assert [b"a", b"b", b"c"] == [
+            bytes(record.payload) for record in reader.records("ACE")
+        ]
+        assert b"b" == bytes(reader.at("ACE", 107).payload)
+
+
+def test_append_to_existing_archive(tmp_path):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS[:2])
+    _write(path, RECORDS[2:], archive.ZLIB)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        assert len(RECORDS) == len(reader)
+        assert ["123456", "ACE"] == reader.feed_ids()
+        assert (100, 110) == reader.time_range("ACE")
+        assert 3 == reader.num_records("ACE")
+
+
+def test_missing_index_is_rebuilt_by_scanning(tmp_path):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS)
+    (tmp_path / ("feeds.archive" + archive.INDEX_SUFFIX)).unlink()
+
+    with archive.ArchiveReader(str(path)) as reader:
+        assert len(RECORDS) == len(reader)
+        assert b"ace-2" == bytes(reader.at("ACE", 105).payload)
+
+
+def test_partial_records_are_ignored(tmp_path):
+    path = tmp_path / "feeds.archive"
+    index_path = tmp_path / ("feeds.archive" + archive.INDEX_SUFFIX)
+    _write(path, RECORDS[:2])
+    index_content = index_path.read_bytes()
+    _write(path, RECORDS[2:3])
+    # Simulate the writer being interrupted midway through the third record,
+    # before it was indexed
+    path.write_bytes(path.read_bytes()[:-2])
+    index_path.write_bytes(index_content)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        assert 2 == len(reader)
+        assert [b"ace-1", b"123456-1"] == [
+            bytes(record.payload) for record in reader.records()
+        ]
+
+
+@pytest.mark.parametrize(
+    "interruption",
+    ["unindexed_record", "partial_record", "partial_index_entry", "partial_magic"],
+)
+def test_append_after_interruption(tmp_path, interruption):
+    path = tmp_path / "feeds.archive"
+    index_path = tmp_path / ("feeds.archive" + archive.INDEX_SUFFIX)
+    _write(path, RECORDS[:2])
+    index_content = index_path.read_bytes()
+    _write(path, RECORDS[2:3])
+    expected = RECORDS
+    if interruption == "unindexed_record":
+        index_path.write_bytes(index_content)
+    elif interruption == "partial_record":
+        path.write_bytes(path.read_bytes()[:-2])
+        index_path.write_bytes(index_content)
+        expected = RECORDS[:2] + RECORDS[3:]
+    elif interruption == "partial_index_entry":
+        index_path.write_bytes(index_path.read_bytes()[:-2])
+    else:
+        path.write_bytes(archive.MAGIC[:3])
+        index_path.write_bytes(archive.INDEX_MAGIC)
+        expected = RECORDS[3:]
+
+    _write(path, RECORDS[3:])
+
+    with archive.ArchiveReader(str(path)) as reader:
+        assert sorted(expected, key=lambda record: record[1]) == [
+            (record.feed_id, record.timestamp, bytes(record.payload))
+            for record in reader.records()
+        ]
+    # The index covers every record, so reading it does not need a scan
+    index_entries, _ = archive._read_index(str(index_path), path.stat().st_size)
+    assert len(expected) == len(index_entries)
+
+
+def test_append_to_non_archive(tmp_path):
+    path = tmp_path / "feeds.archive"
+    path.write_bytes(b"not an archive")
+
+    with pytest.raises(archive.ArchiveError):
+        archive.ArchiveWriter(str(path))
+    assert b"not an archive" == path.read_bytes()
+
+
+@pytest.mark.parametrize("content", [b"not an archive", b"short", b""])
+def test_not_an_archive(tmp_path, monkeypatch, content):
+    path = tmp_path / "feeds.archive"
+    path.write_bytes(content)
+    files = []
+
+    def open_(*args, **kwargs):
+        files.append(open(*args, **kwargs))
+        return files[-1]
+
+    monkeypatch.setattr(archive, "open", open_, raising=False)
+
+    with pytest.raises(archive.ArchiveError):
+        archive.ArchiveReader(str(path))
+    assert 1 == len(files)
+    assert files[0].closed
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        archive.ArchiveWriter(str(tmp_path / "feeds.archive"), "snappy")
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"engine": "fused"},
+        {"content_cache": True},
+        {"entity_cache_size": 100},
+        {"include_routes": ["A"]},
+    ],
+)
+def test_load_payload_views_into_subway_trips_parser(tmp_path, options):
+    path = tmp_path / "feeds.archive"
+    generator = syntheticfeeds.SubwayFeedGenerator(feed_id="ACE", scale=0.1)
+    snapshots = list(generator.snapshots(2))
+    _write(path, [("ACE", i, snapshot) for i, snapshot in enumerate(snapshots)])
+    expected_parser = SubwayTripsParser()
+    expected_parser.load_options(options)
+    parser = SubwayTripsParser()
+    parser.load_options(options)
+
+    with archive.ArchiveReader(str(path)) as reader:
+        for snapshot, record in zip(snapshots, reader.records("ACE")):
+            expected_parser.load_content(snapshot)
+            parser.load_content(record.payload)
+
+            assert list(expected_parser.get_trips()) == list(parser.get_trips())
+            record.payload.release()
+
+
+def test_load_payload_views_into_alerts_parser(tmp_path):
+    path = tmp_path / "feeds.archive"
+    snapshot = syntheticfeeds.AlertsFeedGenerator(scale=0.1).next_snapshot()
+    _write(path, [("gtfsrealtime-alerts", 100, snapshot)])
+    expected_parser = AlertsParser()
+    expected_parser.load_content(snapshot)
+    parser = AlertsParser()
+
+    with archive.ArchiveReader(str(path)) as reader:
+        parser.load_content(reader.at("gtfsrealtime-alerts", 100).payload)
+
+    assert list(expected_parser.get_alerts()) == list(parser.get_alerts())
+
+
+def test_record_appends_changed_payloads(tmp_path):
+    path = tmp_path / "feeds.archive"
+    feed_path = standinserver.FEED_PATHS[("nyc_subway", "L")]
+    path_to_feed = {feed_path: standinserver.StaticFeed(b"content")}
+
+    with standinserver.StandInServer(path_to_feed) as server:
+        requests = [fetcher.FeedRequest(feed_id="L", url=server.url + feed_path)]
+        with archive.ArchiveWriter(str(path)) as writer:
+            num_appended = asyncio.run(
+                archive.record(writer, requests, interval=0.05, duration=0.3)
+            )
+
+    # Later polls are answered with 304 Not Modified
+    assert 1 == num_appended
+    with archive.ArchiveReader(str(path)) as reader:
+        assert [b"content"] == [bytes(record.payload) for record in reader.records()]
+
+
+def test_info(tmp_path, capsys):
+    path = tmp_path / "feeds.archive"
+    _write(path, RECORDS)
+
+    assert 0 == archive.main(["info", str(path)])
+
+    assert "ACE" in capsys.readouterr().out
@@ -0,0 +1,305 @@
+import json
+import os
+
+import pytest
+from google.protobuf.internal import api_implementation
+from transiter_ny_mta import benchmark
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), os.pardir, benchmark.DEFAULT_BASELINE
+)
+
+
+@pytest.mark.parametrize(
+    "q,expected", [(0, 1), (50, 2.5), (100, 4), (25, 1.75), (99, 3.97)]
+)
+def test_percentile(q, expected):
+    assert expected == pytest.approx(benchmark.percentile([4, 1, 3, 2], q))
+
+
+def test_percentile__single_value():
+    assert 5 == benchmark.percentile([5], 90)
+
+
+@pytest.mark.parametrize("n,k,expected", [(5, 0, 1), (5, 2, 10), (10, 5, 252)])
+def test_binomial(n, k, expected):
+    assert expected == benchmark._binomial(n, k)
+
+
+@pytest.fixture
+def small_alert_index(monkeypatch):
+    # The alert index benchmarks ignore the scales, so their size is reduced instead
+    monkeypatch.setattr(benchmark, "ALERT_INDEX_ALERTS_PER_SCALE", 2)
+    benchmark._build_index_alerts.cache_clear()
+    yield
+    benchmark._build_index_alerts.cache_clear()
+
+
+def test_run_benchmarks(small_alert_index):
+    results = benchmark.run_benchmarks(
+        scales=[0.02, 0.04], iterations=2, warmup_iterations=0
+    )
+
+    assert {result.name for result in results} == {b.name for b in benchmark.BENCHMARKS}
+    assert 2 * len(benchmark.BENCHMARKS) == len(results)
+    for result in results:
+        assert result.entities > 0
+        assert 2 == len(result.timings)
+        assert result.throughput > 0
+        assert result.peak_memory >= 0
+
+
+def test_run_benchmarks__own_scales():
+    benchmarks = [
+        benchmark.Benchmark("a", lambda scale: (scale, 1), stage=str),
+        benchmark.Benchmark("b", lambda scale: (scale, 1), stage=str, scales=[3]),
+    ]
+
+    results = benchmark.run_benchmarks(benchmarks, scales=[1, 2], iterations=1)
+
+    assert [("a", 1), ("a", 2), ("b", 3)] == [
+        (result.name, result.scale) for result in results
+    ]
+
+
+def test_select_benchmarks():
+    benchmarks = benchmark.select_benchmarks(["alertsparser.", "stations"])
+
+    assert len(benchmarks) > 1
+    assert all(
+        b.name.startswith(("alertsparser.", "stationscsvparser.")) for b in benchmarks
+    )
+
+
+def test_select_benchmarks__no_match():
+    with pytest.raises(ValueError):
+        benchmark.select_benchmarks(["buses"])
+
+
+def test_main(tmp_path):
+    output = tmp_path / "results.json"
+
+    exit_code = benchmark.main(
+        [
+            "run",
+            "stationscsvparser",
+            "--scales",
+            "0.1",
+            "--iterations",
+            "3",
+            "--output",
+            str(output),
+        ]
+    )
+
+    report = json.loads(output.read_text())
+    assert 0 == exit_code
+    assert "protobuf_backend" in report["metadata"]
+    [result] = report["results"]
+    assert "stationscsvparser.direction_rules" == result["name"]
+    assert 3 == result["iterations"]
+    assert {"min", "mean", "max", "p50", "p90", "p99"} == set(result["latency"])
+    # The reference benchmark is reported separately
+    assert report["reference"] > 0
+
+
+@pytest.mark.parametrize(
+    "values,expected",
+    [
+        ([3], (3, 3)),
+        ([5, 1, 3], (1, 5)),
+        # With 5 values the range has 94% confidence, less than 95%
+        ([5, 1, 3, 2, 4], (1, 5)),
+        # With 10 values the 2nd to 9th values have 98% confidence, but the 3rd to
+        # the 8th only 89%
+        (list(range(10)), (1, 8)),
+    ],
+)
+def test_median_confidence_interval(values, expected):
+    assert expected == benchmark.median_confidence_interval(values)
+
+
+def _build_report(name_to_run_medians, scale=1):
+    results = [
+        benchmark.BenchmarkResult(
+            name=name,
+            scale=scale,
+            entities=10,
+            timings=run_medians,
+            run_medians=run_medians,
+            peak_memory=0,
+        )
+        for name, run_medians in name_to_run_medians.items()
+    ]
+    return json.loads(json.dumps(benchmark.build_report(results)))
+
+
+def test_compare():
+    baseline = _build_report(
+        {"stable": [1.0] * 5, "slower": [1.0] * 5, "noisy": [1.0] * 5, "gone": [1.0]}
+    )
+    current = _build_report(
+        {
+            "stable": [1.0, 1.1, 0.9, 1.0, 1.0],
+            "slower": [2.0, 2.1, 1.9, 2.0, 2.0],
+            "noisy": [1.0, 1.1, 1.5, 1.6, 3.0],
+            "new": [1.0],
+        }
+    )
+
+    comparisons = benchmark.compare(baseline, current, threshold=0.25)
+
+    assert {"stable": False, "slower": True, "noisy": False} == {
+        comparison.name: comparison.regressed for comparison in comparisons
+    }
+    assert 2 == pytest.approx(comparisons[1].ratio)
+
+
+def test_compare__scaled_by_reference():
+    baseline = _build_report({"stage": [1.0] * 5})
+    baseline["reference"] = 0.01
+    current = _build_report({"stage": [2.0] * 5})
+    current["reference"] = 0.02
+
+    [comparison] = benchmark.compare(baseline, current)
+
+    assert 2 == pytest.approx(comparison.baseline)
+    assert not comparison.regressed
+
+
+def test_compare__different_scales_are_skipped():
+    baseline = _build_report({"stage": [1.0]}, scale=1)
+    current = _build_report({"stage": [1.0]}, scale=2)
+
+    assert [] == benchmark.compare(baseline, current)
+
+
+@pytest.mark.parametrize("current_run_medians,expected_exit_code", [(1.1, 0), (3, 1)])
+def test_main__compare(tmp_path, current_run_medians, expected_exit_code):
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(_build_report({"stage": [1.0] * 5})))
+    current_path = tmp_path / "current.json"
+    current_path.write_text(
+        json.dumps(_build_report({"stage": [current_run_medians] * 5}))
+    )
+
+    exit_code = benchmark.main(
+        ["compare", "--baseline", str(baseline_path), "--current", str(current_path)]
+    )
+
+    assert expected_exit_code == exit_code
+
+
+@pytest.mark.parametrize(
+    "ignore_environment,expected_exit_code", [(False, 0), (True, 1)]
+)
+def test_main__compare__different_environment(
+    tmp_path, ignore_environment, expected_exit_code
+):
+    baseline = _build_report({"stage": [1.0] * 5})
+    baseline["metadata"]["protobuf_backend"] = "another backend"
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(baseline))
+    current_path = tmp_path / "current.json"
+    current_path.write_text(json.dumps(_build_report({"stage": [3.0] * 5})))
+
+    exit_code = benchmark.main(
+        ["compare", "--baseline", str(baseline_path), "--current", str(current_path)]
+        + (["--ignore-environment"] if ignore_environment else [])
+    )
+
+    assert expected_exit_code == exit_code
+
+
+def test_environment_differences():
+    metadata = benchmark.build_metadata()
+
+    assert [] == benchmark.environment_differences(metadata, dict(metadata, python="x"))
+    assert [
+        "python_version is 2.7 (baseline: {})".format(metadata["python_version"])
+    ] == (
+        benchmark.environment_differences(
+            metadata, dict(metadata, python_version="2.7")
+        )
+    )
+
+
+def test_main__compare_runs_baseline_benchmarks(tmp_path):
+    baseline_path = tmp_path / "baseline.json"
+    benchmark.main(
+        ["run", "stationscsvparser", "--scales", "0.1", "-o", str(baseline_path)]
+    )
+    current_path = tmp_path / "current.json"
+
+    exit_code = benchmark.main(
+        [
+            "compare",
+            "--baseline",
+            str(baseline_path),
+            "--threshold",
+            "100",
+            "--runs",
+            "2",
+            "--output",
+            str(current_path),
+        ]
+    )
+
+    current = json.loads(current_path.read_text())
+    assert 0 == exit_code
+    [result] = current["results"]
+    assert "stationscsvparser.direction_rules" == result["name"]
+    assert current["reference"] > 0
+    assert 2 == len(result["run_medians"])
+
+
+def test_main__matrix(tmp_path):
+    output_path = tmp_path / "matrix.json"
+
+    exit_code = benchmark.main(
+        [
+            "matrix",
+            "alertsparser.decode",
+            "--scales",
+            "0.1",
+            "--iterations",
+            "1",
+            "--backends",
+            api_implementation.Type(),
+            "unknown",
+            "--output",
+            str(output_path),
+        ]
+    )
+
+    matrix = json.loads(output_path.read_text())
+    assert 0 == exit_code
+    assert "error" in matrix["backends"]["unknown"]
+    [result] = matrix["backends"][api_implementation.Type()]["results"]
+    assert "alertsparser.decode" == result["name"]
+
+
+def test_format_matrix():
+    matrix = {
+        "backends": {
+            "python": {"results": [{"name": "a", "scale": 1, "throughput": 10}]},
+            "upb": {"results": [{"name": "a", "scale": 1, "throughput": 100}]},
+            "cpp": {"error": "ImportError"},
+        }
+    }
+
+    lines = benchmark.format_matrix(matrix).splitlines()
+
+    assert "python (e/s)" in lines[0] and "upb (e/s)" in lines[0]
+    assert ["a", "1", "10", "100"] == lines[1].split()
+    assert "cpp: failed: ImportError" == lines[2]
+
+
+def test_baseline_covers_every_benchmark():
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    assert {b.name for b in benchmark.BENCHMARKS} == {
+        result["name"] for result in baseline["results"]
+    }
+    assert baseline["reference"] > 0
@@ -0,0 +1,103 @@
+import pytest
+from transiter_ny_mta import AlertsParser, StationsCsvParser, SubwayTripsParser
+from transiter_ny_mta import contentcache
+from transiter_ny_mta.proto import alerts_pb2
+from transiter_ny_mta.proto import subwaytrips_pb2
+
+STATIONS_CSV = b"""
+Station ID,Complex ID,GTFS Stop ID,Division,Line,Stop Name,Borough,Daytime Routes,Structure,GTFS Latitude,GTFS Longitude,North Direction Label,South Direction Label
+2,2,R03,BMT,Astoria,Astoria Blvd,Q,N W,Elevated,40.770258,-73.917843,Ditmars Blvd,Manhattan
+""".strip()
+
+
+def build_subway_content(trip_id):
+    return subwaytrips_pb2.FeedMessage(
+        header=subwaytrips_pb2.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            subwaytrips_pb2.FeedEntity(
+                id="1",
+                trip_update=subwaytrips_pb2.TripUpdate(
+                    trip=subwaytrips_pb2.TripDescriptor(trip_id=trip_id)
+                ),
+            )
+        ],
+    ).SerializeToString()
+
+
+def build_alerts_content(alert_id):
+    return alerts_pb2.FeedMessage(
+        header=alerts_pb2.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[alerts_pb2.FeedEntity(id=alert_id, alert=alerts_pb2.Alert())],
+    ).SerializeToString()
+
+
+@pytest.mark.parametrize(
+    "parser_type,get_entities,content_1,content_2",
+    [
+        [
+            SubwayTripsParser,
+            SubwayTripsParser.get_trips,
+            build_subway_content("trip_1"),
+            build_subway_content("trip_2"),
+        ],
+        [
+            AlertsParser,
+            AlertsParser.get_alerts,
+            build_alerts_content("alert_1"),
+            build_alerts_content("alert_2"),
+        ],
+        [
+            StationsCsvParser,
+            StationsCsvParser.get_direction_rules,
+            STATIONS_CSV,
+            STATIONS_CSV.replace(b"R03", b"R04"),
+        ],
+    ],
+)
+def test_content_cache(parser_type, get_entities, content_1, content_2):
+    parser = parser_type()
+    parser.load_options({"content_cache": True})
+
+    parser.load_content(content_1)
+    entities_1 = list(get_entities(parser))
+    assert not parser.content_cache.unchanged
+
+    parser.load_content(content_1)
+    assert parser.content_cache.unchanged
+    assert all(old is new for old, new in zip(entities_1, list(get_entities(parser))))
+
+    parser.load_content(content_2)
+    entities_2 = list(get_entities(parser))
+    assert not parser.content_cache.unchanged
+    assert entities_1 != entities_2
+
+    assert 1 == parser.content_cache.stats.hits
+    assert 2 == parser.content_cache.stats.misses
+
+
+def test_content_cache__disabled_by_default():
+    assert SubwayTripsParser().content_cache is None
+
+
+@pytest.mark.parametrize("parser_type", [SubwayTripsParser, AlertsParser])
+def test_content_cache__content_that_fails_to_decode(parser_type):
+    parser = parser_type()
+    parser.load_options({"content_cache": True})
+    parser.load_content(build_subway_content("trip_1"))
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            parser.load_content(b"not a feed")
+
+    assert 0 == parser.content_cache.stats.hits
+    assert not parser.content_cache.unchanged
+
+
+def test_content_cache__uncommitted_content_is_not_a_hit():
+    content_cache = contentcache.ContentCache()
+
+    assert not content_cache.check(b"content")
+    assert not content_cache.check(b"content")
+    content_cache.commit()
+
+    assert content_cache.check(b"content")
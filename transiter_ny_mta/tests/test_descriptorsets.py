@@ -0,0 +1,120 @@
+import importlib
+import shutil
+import subprocess
+import sys
+
+import pytest
+from google.protobuf import descriptor_pool
+from transiter_ny_mta.proto import alerts_pb2, descriptorsets, subwaytrips_pb2
+
+
+@pytest.mark.parametrize("key", ["alerts", "subwaytrips"])
+def test_descriptor_set_matches_generated_modules(key):
+    package = importlib.import_module(f"transiter_ny_mta.proto.{key}_pb2")
+    for suffix in ["gtfs_rt_base", "transiter_extension", "mta_extension"]:
+        generated_module = importlib.import_module(
+            f"{package.__name__}.transiter_ny_mta_{key}_{suffix}_pb2"
+        )
+        file_descriptor = package.DESCRIPTOR.pool.FindFileByName(
+            generated_module.DESCRIPTOR.name
+        )
+
+        assert (
+            generated_module.DESCRIPTOR.serialized_pb == file_descriptor.serialized_pb
+        )
+
+
+def test_own_descriptor_pool():
+    assert subwaytrips_pb2.DESCRIPTOR.pool is not descriptor_pool.Default()
+    assert subwaytrips_pb2.DESCRIPTOR.pool is not alerts_pb2.DESCRIPTOR.pool
+
+
+def test_messages_are_compatible_with_generated_modules():
+    from transiter_ny_mta.proto.subwaytrips_pb2 import (
+        transiter_ny_mta_subwaytrips_gtfs_rt_base_pb2 as generated_pb2,
+        transiter_ny_mta_subwaytrips_mta_extension_pb2 as generated_mta_pb2,
+    )
+
+    stop_time_update = generated_pb2.TripUpdate.StopTimeUpdate(stop_id="A42N")
+    stop_time_update.Extensions[
+        generated_mta_pb2.nyct_stop_time_update
+    ].actual_track = "E2"
+    content = stop_time_update.SerializeToString()
+
+    loaded = subwaytrips_pb2.TripUpdate.StopTimeUpdate.FromString(content)
+
+    assert generated_pb2.TripUpdate.StopTimeUpdate is not type(loaded)
+    assert "A42N" == loaded.stop_id
+    assert "E2" == loaded.Extensions[loaded._extensions_by_number[1001]].actual_track
+    assert content == loaded.SerializeToString()
+
+
+def test_nested_enum_values():
+    assert 0 == subwaytrips_pb2.FeedHeader.FULL_DATASET
+    assert 1 == subwaytrips_pb2.VehiclePosition.STOPPED_AT
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        subwaytrips_pb2.NotAMessage
+
+
+def test_dir():
+    assert {"FeedMessage", "TripUpdate", "MTA_EXTENSION_ID"} <= set(
+        dir(subwaytrips_pb2)
+    )
+
+
+def test_packages_are_independent():
+    def load():
+        return descriptorsets.DescriptorSetPackage(
+            subwaytrips_pb2.__file__.replace(
+                "__init__.py", descriptorsets.DESCRIPTOR_SET_FILENAME
+            ),
+            "transiter-ny-mta-subwaytrips-gtfs-rt-base.proto",
+        )
+
+    package_1 = load()
+    package_2 = load()
+
+    assert package_1.get("FeedMessage") is package_1.get("FeedMessage")
+    assert package_1.get("FeedMessage") is not package_2.get("FeedMessage")
+
+
+# Imports a copy of the alerts package under its usual module name
+_FALLBACK_SCRIPT = """
+import importlib.util
+import sys
+
+module_name = "transiter_ny_mta.proto.alerts_pb2"
+spec = importlib.util.spec_from_file_location(
+    module_name, {init_path!r}, submodule_search_locations=[{package_path!r}]
+)
+package = importlib.util.module_from_spec(spec)
+sys.modules[module_name] = package
+spec.loader.exec_module(package)
+
+assert "__getattr__" not in vars(package)
+assert package.FeedMessage.__module__.endswith("_gtfs_rt_base_pb2")
+assert 1001 in package.FeedHeader._extensions_by_number
+"""
+
+
+def test_missing_descriptor_set_falls_back_to_generated_modules(tmp_path):
+    package_path = tmp_path / "alerts_pb2"
+    shutil.copytree(
+        alerts_pb2.__path__[0],
+        package_path,
+        ignore=shutil.ignore_patterns(
+            descriptorsets.DESCRIPTOR_SET_FILENAME, "__pycache__"
+        ),
+    )
+    script = _FALLBACK_SCRIPT.format(
+        init_path=str(package_path / "__init__.py"), package_path=str(package_path)
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", script], stderr=subprocess.PIPE, universal_newlines=True,
+    )
+
+    assert 0 == result.returncode, result.stderr
@@ -0,0 +1,74 @@
+from transiter_ny_mta import SubwayTripsParser
+from transiter_ny_mta import entitycache
+from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
+
+
+def build_content(trip_id_to_route_id):
+    return gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            gtfs.FeedEntity(
+                id=trip_id,
+                trip_update=gtfs.TripUpdate(
+                    trip=gtfs.TripDescriptor(trip_id=trip_id, route_id=route_id)
+                ),
+            )
+            for trip_id, route_id in trip_id_to_route_id.items()
+        ],
+    ).SerializeToString()
+
+
+def parse_trips(content, options):
+    parser = SubwayTripsParser()
+    parser.load_options(options)
+    parser.load_content(content)
+    return list(parser.get_trips())
+
+
+def test_only_changed_entities_are_decoded():
+    content_1 = build_content({"trip_1": "A", "trip_2": "C", "trip_3": "SS"})
+    content_2 = build_content({"trip_1": "A", "trip_2": "E", "trip_4": "C"})
+    parser = SubwayTripsParser()
+    parser.load_options({"entity_cache_size": 10})
+
+    parser.load_content(content_1)
+    trips_1 = list(parser.get_trips())
+    parser.load_content(content_2)
+    trips_2 = list(parser.get_trips())
+
+    assert parse_trips(content_1, {}) == trips_1
+    assert parse_trips(content_2, {}) == trips_2
+    assert trips_1[0] is trips_2[0]
+    assert 1 == parser.entity_cache.stats.hits
+    assert 3 + 2 == parser.entity_cache.stats.misses
+    # trip_2 (old version) and trip_3 disappeared from the feed
+    assert 2 == parser.entity_cache.stats.evictions
+    assert 3 == len(parser.entity_cache)
+
+
+def test_cache_size_is_bounded():
+    cache = entitycache.EntityCache(max_size=2)
+
+    for value in range(3):
+        cache.get(cache.fingerprint(str(value).encode()), lambda: value)
+
+    assert 2 == len(cache)
+    assert 1 == cache.stats.evictions
+    assert 2 == cache.get(cache.fingerprint(b"2"), lambda: None)
+
+
+def test_entity_ids_are_not_fingerprinted():
+    trip_update = gtfs.TripUpdate(trip=gtfs.TripDescriptor(trip_id="trip_1"))
+    parser = SubwayTripsParser()
+    parser.load_options({"entity_cache_size": 10})
+
+    for entity_id in ["1", "2"]:
+        parser.load_content(
+            gtfs.FeedMessage(
+                header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+                entity=[gtfs.FeedEntity(id=entity_id, trip_update=trip_update)],
+            ).SerializeToString()
+        )
+        list(parser.get_trips())
+
+    assert 1 == parser.entity_cache.stats.hits
@@ -0,0 +1,48 @@
+import pytest
+from transiter.parse.gtfsrealtime import TRANSITER_EXTENSION_ID
+from transiter_ny_mta.proto import extensions
+from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
+from transiter_ny_mta.proto.extensions import FieldCopy
+
+STOP_TIME_TYPE = gtfs.TripUpdate.StopTimeUpdate
+TRACK_COPIES = [
+    FieldCopy(
+        gtfs.MTA_EXTENSION_ID, "scheduled_track", TRANSITER_EXTENSION_ID, "track"
+    ),
+    FieldCopy(gtfs.MTA_EXTENSION_ID, "actual_track", TRANSITER_EXTENSION_ID, "track"),
+]
+
+
+@pytest.mark.parametrize(
+    "scheduled_track,actual_track,expected_track",
+    [[None, None, None], ["1", None, "1"], [None, "2", "2"], ["1", "2", "2"]],
+)
+def test_compile_copies(scheduled_track, actual_track, expected_track):
+    package_extensions = extensions.PackageExtensions(gtfs)
+    copy_track = package_extensions.compile_copies(STOP_TIME_TYPE, TRACK_COPIES)
+    nyct_ext = package_extensions.accessor(STOP_TIME_TYPE, gtfs.MTA_EXTENSION_ID)
+    transiter_ext = package_extensions.accessor(STOP_TIME_TYPE, TRANSITER_EXTENSION_ID)
+    stop_time = STOP_TIME_TYPE()
+    if scheduled_track is not None:
+        nyct_ext(stop_time).scheduled_track = scheduled_track
+    if actual_track is not None:
+        nyct_ext(stop_time).actual_track = actual_track
+
+    copy_track(stop_time)
+
+    if expected_track is None:
+        assert not transiter_ext(stop_time).HasField("track")
+    else:
+        assert expected_track == transiter_ext(stop_time).track
+
+
+def test_compile_copies__unknown_field():
+    with pytest.raises(ValueError):
+        extensions.PackageExtensions(gtfs).compile_copies(
+            STOP_TIME_TYPE,
+            [
+                FieldCopy(
+                    gtfs.MTA_EXTENSION_ID, "track", TRANSITER_EXTENSION_ID, "track"
+                )
+            ],
+        )
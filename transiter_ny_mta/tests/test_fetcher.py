@@ -0,0 +1,232 @@
+import asyncio
+import gzip
+import hashlib
+import http.server
+import os
+import re
+import threading
+import time
+import zlib
+
+import pytest
+from transiter_ny_mta import fetcher
+
+PATH_TO_CONTENT = {
+    "/feeds/a": b"content a" * 100,
+    "/feeds/b": b"content b" * 100,
+    "/feeds/chunked": b"chunked content",
+}
+SUBWAY_CONFIG = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "transiter_config_nyc_subway.yaml"
+)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/error":
+            self._send(500, b"error")
+            return
+        if self.path == "/slow":
+            time.sleep(0.5)
+        content = PATH_TO_CONTENT.get(self.path)
+        if content is None:
+            self._send(404, b"")
+            return
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        headers = {"ETag": etag}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            headers["Content-Encoding"] = "gzip"
+        self._send(200, content, headers, chunked=self.path == "/feeds/chunked")
+
+    def _send(self, status, content, headers=None, chunked=False):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(content), 10):
+                chunk = content[i : i + 10]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # For example, the client timed out and closed the connection
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _run(coroutine_function):
+    async def run():
+        feed_fetcher = fetcher.Fetcher(timeout=0.25)
+        try:
+            return await coroutine_function(feed_fetcher)
+        finally:
+            await feed_fetcher.close()
+
+    return asyncio.run(run())
+
+
+def test_fetch_all(base_url):
+    requests = [
+        fetcher.FeedRequest(feed_id, base_url + "/feeds/" + feed_id)
+        for feed_id in ["a", "b", "chunked"]
+    ]
+
+    async def fetch_twice(feed_fetcher):
+        first = await feed_fetcher.fetch_all(requests)
+        second = await feed_fetcher.fetch_all(requests)
+        return first, second, feed_fetcher.connections_opened
+
+    first, second, connections_opened = _run(fetch_twice)
+
+    for feed_id in ["a", "b", "chunked"]:
+        assert 200 == first[feed_id].status
+        assert PATH_TO_CONTENT["/feeds/" + feed_id] == first[feed_id].content
+        assert first[feed_id].error is None
+        assert second[feed_id].not_modified
+        assert second[feed_id].content is None
+    assert first["a"].transferred_bytes < len(PATH_TO_CONTENT["/feeds/a"])
+    # The second poll reuses the connections of the first
+    assert 3 == connections_opened
+
+
+@pytest.mark.parametrize(
+    "path,expected_status", [["/error", 500], ["/missing", 404], ["/slow", None]]
+)
+def test_fetch__errors(base_url, path, expected_status):
+    result = _run(
+        lambda feed_fetcher: feed_fetcher.fetch(
+            fetcher.FeedRequest("feed", base_url + path)
+        )
+    )
+
+    assert expected_status == result.status
+    assert result.content is None
+    assert result.error is not None
+
+
+def test_fetch__reused_across_event_loops(base_url):
+    feed_fetcher = fetcher.Fetcher(timeout=0.25)
+    request = fetcher.FeedRequest("a", base_url + "/feeds/a")
+
+    first = asyncio.run(feed_fetcher.fetch(request))
+
+    async def fetch_and_close():
+        try:
+            return await feed_fetcher.fetch(request)
+        finally:
+            await feed_fetcher.close()
+
+    second = asyncio.run(fetch_and_close())
+
+    assert 200 == first.status
+    assert second.error is None
+    assert second.not_modified
+
+
+def test_fetch__connection_refused():
+    result = _run(
+        lambda feed_fetcher: feed_fetcher.fetch(
+            fetcher.FeedRequest("feed", "http://127.0.0.1:1/feed")
+        )
+    )
+
+    assert result.status is None
+    assert result.error is not None
+
+
+@pytest.mark.parametrize(
+    "content_encoding,body",
+    [
+        [None, b"content"],
+        ["Identity", b"content"],
+        ["gzip", gzip.compress(b"content")],
+        ["GZIP", gzip.compress(b"content")],
+        [" Deflate ", zlib.compress(b"content")],
+    ],
+)
+def test_decode_body(content_encoding, body):
+    assert b"content" == fetcher._decode_body(body, content_encoding)
+
+
+def test_decode_body__unsupported_encoding():
+    with pytest.raises(fetcher.FetchError):
+        fetcher._decode_body(b"content", "br")
+
+
+def test_subway_feed_requests():
+    requests = fetcher.subway_feed_requests("key", base_url="http://localhost/")
+
+    assert 9 == len(requests)
+    assert "http://localhost/nyct%2Fgtfs-ace" == requests[2].url
+    assert {"X-API-KEY": "key"} == requests[2].headers
+
+
+def test_subway_feed_paths_match_config():
+    with open(SUBWAY_CONFIG) as f:
+        config = f.read()
+    prefix = re.escape(fetcher.MTA_API_BASE_URL)
+    feed_id_to_path = {
+        "gtfsrealtime-alerts": re.search(
+            r"gtfsrealtime-alerts:\s+http:\s+url: \"" + prefix + r"([^\"]+)\"", config
+        ).group(1)
+    }
+    postfix_template = re.search(
+        r"url: \"" + prefix + r"([^\"]+)\{\{ mta_url_postfix \}\}\"", config
+    ).group(1)
+    for feed_id, postfix in re.findall(r'\("(\w+)", "([\w-]*)"\)', config):
+        feed_id_to_path[feed_id] = postfix_template + postfix
+
+    assert feed_id_to_path == fetcher.SUBWAY_FEED_ID_TO_PATH
+
+
+def test_load_results():
+    class Parser:
+        content = None
+
+        def load_content(self, content):
+            self.content = content
+
+    parser_1 = Parser()
+    parser_2 = Parser()
+
+    loaded_feed_ids = fetcher.load_results(
+        {
+            "1": fetcher.FetchResult("1", status=200, content=b"content"),
+            "2": fetcher.FetchResult("2", status=304),
+            "3": fetcher.FetchResult("3", status=200, content=b"content"),
+        },
+        {"1": parser_1, "2": parser_2},
+    )
+
+    assert ["1"] == loaded_feed_ids
+    assert b"content" == parser_1.content
+    assert parser_2.content is None
@@ -0,0 +1,166 @@
+import os
+import shutil
+
+import pytest
+from transiter_ny_mta.proto import gtfs_rt_vendorizer
+
+PROTO_DIR = os.path.dirname(gtfs_rt_vendorizer.__file__)
+
+# The vendored proto files are valid sources, as rewriting them is idempotent
+SOURCE_FILENAME_TO_VENDORED_PATH = {
+    "gtfs-realtime.proto": "alerts_pb2/transiter-ny-mta-alerts-gtfs-rt-base.proto",
+    "gtfs-realtime-transiter-extension.proto": (
+        "alerts_pb2/transiter-ny-mta-alerts-transiter-extension.proto"
+    ),
+    "gtfs-realtime-service-status.proto": (
+        "alerts_pb2/transiter-ny-mta-alerts-mta-extension.proto"
+    ),
+    "gtfs-realtime-NYCT.proto": (
+        "subwaytrips_pb2/transiter-ny-mta-subwaytrips-mta-extension.proto"
+    ),
+}
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    for filename, vendored_path in SOURCE_FILENAME_TO_VENDORED_PATH.items():
+        shutil.copy(os.path.join(PROTO_DIR, vendored_path), cache_dir / filename)
+    return cache_dir
+
+
+def test_substitute_package_settings():
+    proto = "\n".join(
+        [
+            'option java_package = "com.google.transit.realtime";',
+            "package transit_realtime;",
+            'import "gtfs-realtime.proto";',
+            "  optional transit_realtime.TripDescriptor trip = 1;",
+        ]
+    )
+
+    assert (
+        [
+            'option java_package = "com.github.transiter-ny-mta.alerts";',
+            "package transiter_ny_mta_alerts;",
+            'import "transiter-ny-mta-alerts-gtfs-rt-base.proto";',
+            "  optional TripDescriptor trip = 1;",
+        ]
+        == gtfs_rt_vendorizer._substitute_package_settings(
+            proto, gtfs_rt_vendorizer.alerts_config
+        ).splitlines()
+    )
+
+
+def test_load_sources__cached(cache_dir, monkeypatch):
+    monkeypatch.setattr(gtfs_rt_vendorizer, "_download", _fail_download)
+
+    url_to_source = gtfs_rt_vendorizer.load_sources(
+        [gtfs_rt_vendorizer.GTFS_RT_PROTO_URL], str(cache_dir)
+    )
+
+    assert (cache_dir / "gtfs-realtime.proto").read_text() == url_to_source[
+        gtfs_rt_vendorizer.GTFS_RT_PROTO_URL
+    ]
+
+
+def test_load_sources__downloads_missing_sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtfs_rt_vendorizer, "_download", lambda url: "source")
+
+    url_to_source = gtfs_rt_vendorizer.load_sources(
+        [gtfs_rt_vendorizer.GTFS_RT_PROTO_URL], str(tmp_path)
+    )
+
+    assert {gtfs_rt_vendorizer.GTFS_RT_PROTO_URL: "source"} == url_to_source
+    assert "source" == (tmp_path / "gtfs-realtime.proto").read_text()
+
+
+def test_load_sources__offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(gtfs_rt_vendorizer, "_download", _fail_download)
+
+    with pytest.raises(gtfs_rt_vendorizer.VendorizerError):
+        gtfs_rt_vendorizer.load_sources(
+            [gtfs_rt_vendorizer.GTFS_RT_PROTO_URL], str(tmp_path), offline=True
+        )
+
+
+def test_inputs_hash():
+    config = gtfs_rt_vendorizer.alerts_config
+    protos = {"a.proto": "message A {}"}
+
+    hash_1 = gtfs_rt_vendorizer.inputs_hash(config, protos, "libprotoc 3", True)
+    hash_2 = gtfs_rt_vendorizer.inputs_hash(config, dict(protos), "libprotoc 3", True)
+
+    assert hash_1 == hash_2
+    assert hash_1 != gtfs_rt_vendorizer.inputs_hash(
+        config, {"a.proto": "message B {}"}, "libprotoc 3", True
+    )
+    assert hash_1 != gtfs_rt_vendorizer.inputs_hash(config, protos, "libprotoc 4", True)
+    assert hash_1 != gtfs_rt_vendorizer.inputs_hash(
+        config, protos, "libprotoc 3", False
+    )
+
+
+@pytest.mark.parametrize("descriptor_set", [True, False])
+def test_is_up_to_date(tmp_path, descriptor_set):
+    config = gtfs_rt_vendorizer.alerts_config
+    shutil.copytree(os.path.join(PROTO_DIR, config.directory), tmp_path / "alerts_pb2")
+    (tmp_path / "alerts_pb2" / "inputs.sha256").write_text("hash")
+
+    assert gtfs_rt_vendorizer.is_up_to_date(
+        config, str(tmp_path), "hash", descriptor_set
+    )
+    assert not gtfs_rt_vendorizer.is_up_to_date(
+        config, str(tmp_path), "other hash", descriptor_set
+    )
+
+    (tmp_path / "alerts_pb2" / "descriptor_set.pb").unlink()
+
+    assert descriptor_set != gtfs_rt_vendorizer.is_up_to_date(
+        config, str(tmp_path), "hash", descriptor_set
+    )
+
+
+@pytest.mark.skipif(shutil.which("protoc") is None, reason="protoc is not installed")
+def test_main(cache_dir, tmp_path, capsys):
+    output_dir = tmp_path / "output"
+    args = ["--offline", "--cache-dir", str(cache_dir), "--output-dir", str(output_dir)]
+
+    exit_code = gtfs_rt_vendorizer.main(args + ["--verify-iterations", "1"])
+
+    assert 0 == exit_code
+    for key in ["alerts", "subwaytrips"]:
+        assert (output_dir / f"{key}_pb2" / "descriptor_set.pb").exists()
+        assert (output_dir / f"{key}_pb2" / "inputs.sha256").exists()
+    assert "[subwaytrips] Decoded a synthetic feed" in capsys.readouterr().out
+
+    exit_code = gtfs_rt_vendorizer.main(args + ["alerts"])
+
+    assert 0 == exit_code
+    assert "[alerts] Up to date" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(shutil.which("protoc") is None, reason="protoc is not installed")
+def test_main__verification_fails(cache_dir, tmp_path):
+    (cache_dir / "gtfs-realtime-service-status.proto").write_text(
+        'syntax = "proto2";\nimport "gtfs-realtime.proto";\n'
+    )
+
+    exit_code = gtfs_rt_vendorizer.main(
+        [
+            "alerts",
+            "--offline",
+            "--cache-dir",
+            str(cache_dir),
+            "--output-dir",
+            str(tmp_path / "output"),
+        ]
+    )
+
+    assert 1 == exit_code
+    assert not (tmp_path / "output" / "alerts_pb2" / "inputs.sha256").exists()
+
+
+def _fail_download(url):
+    raise AssertionError(f"unexpected download of {url}")
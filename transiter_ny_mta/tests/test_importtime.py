@@ -0,0 +1,83 @@
+import subprocess
+import sys
+
+from transiter_ny_mta import importtime
+
+IMPORTTIME_OUTPUT = """
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 | site
+import time:        20 |         20 |     c
+import time:        30 |         50 |   b
+import time:        10 |         60 | a
+"""
+
+
+def test_parse_importtime_output():
+    assert [
+        importtime.ModuleImportTime("site", 100, 100, 0),
+        importtime.ModuleImportTime("c", 20, 20, 2),
+        importtime.ModuleImportTime("b", 30, 50, 1),
+        importtime.ModuleImportTime("a", 10, 60, 0),
+    ] == importtime.parse_importtime_output(IMPORTTIME_OUTPUT)
+
+
+def test_measure_scenario(monkeypatch):
+    monkeypatch.setattr(
+        importtime,
+        "run_importtime",
+        lambda statement: importtime.parse_importtime_output(IMPORTTIME_OUTPUT),
+    )
+
+    report = importtime.measure_scenario(
+        "scenario", "import a", runs=3, startup_modules={"site"}
+    )
+
+    assert [60, 60, 60] == report.totals
+    assert ["c", "b", "a"] == [module.module for module in report.modules]
+    assert ["b", "c", "a"] == [
+        module["module"] for module in report.to_json(top_modules=3)["slowest_modules"]
+    ]
+
+
+def test_parsers_are_imported_lazily():
+    statement = (
+        "import sys; from transiter_ny_mta import StationsCsvParser; "
+        "print(sorted(m for m in sys.modules if m.startswith('transiter_ny_mta')))"
+    )
+
+    output = subprocess.run(
+        [sys.executable, "-c", statement],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+
+    assert "transiter_ny_mta.stationscsvparser" in output
+    assert "subwaytripsparser" not in output
+    assert "alertsparser" not in output
+    assert "_pb2" not in output
+
+
+def test_parsers_load_only_their_protobuf_package():
+    statement = (
+        "import sys; from transiter_ny_mta import AlertsParser; AlertsParser(); "
+        "print(sorted(m for m in sys.modules if m.startswith('transiter_ny_mta')))"
+    )
+
+    output = subprocess.run(
+        [sys.executable, "-c", statement],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+
+    assert "transiter_ny_mta.proto.alerts_pb2" in output
+    assert "subwaytrips_pb2" not in output
+
+
+def test_measure_scenario__real_import():
+    report = importtime.measure_scenario("package", "import transiter_ny_mta", runs=1)
+
+    assert 1 == len(report.totals)
+    assert "transiter_ny_mta" in {module.module for module in report.modules}
+    assert "site" not in {module.module for module in report.modules}
@@ -0,0 +1,191 @@
+import pytest
+from transiter_ny_mta import (
+    AlertsParser,
+    SubwayTripsParser,
+    instrumentation,
+    syntheticfeeds,
+)
+from transiter_ny_mta.instrumentation import Stage
+
+
+@pytest.fixture
+def events():
+    events = []
+    instrumentation.add_listener(events.append)
+    yield events
+    instrumentation.remove_listener(events.append)
+
+
+def test_recorder__disabled():
+    assert instrumentation.recorder("parser", None) is None
+
+
+def _parse_trips(options, content):
+    parser = SubwayTripsParser()
+    parser.load_options(options)
+    parser.load_content(content)
+    return list(parser.get_trips())
+
+
+@pytest.mark.parametrize(
+    "options,expected_stages",
+    [
+        (
+            {"engine": "default"},
+            [Stage.DECODE, Stage.MOVE_EXTENSIONS, Stage.CONVERT, Stage.FIXUPS],
+        ),
+        ({"engine": "fused"}, [Stage.DECODE, Stage.CONVERT]),
+        ({"entity_cache_size": 1000}, [Stage.CONVERT]),
+    ],
+)
+@pytest.mark.parametrize("feed_id", ["BDFM", "SIR"])
+def test_subway_trips_parser(events, options, expected_stages, feed_id):
+    content = syntheticfeeds.SubwayFeedGenerator(
+        seed=3, feed_id=feed_id, num_trips=40
+    ).next_snapshot()
+    instrumentation.remove_listener(events.append)
+    expected_trips = _parse_trips(options, content)
+    instrumentation.add_listener(events.append)
+
+    trips = _parse_trips({"feed_id": feed_id, **options}, content)
+
+    assert expected_trips == trips
+    assert expected_stages == [event.stage for event in events]
+    assert all(event.feed_id == feed_id for event in events)
+    assert all(event.parser == "SubwayTripsParser" for event in events)
+    assert all(event.duration >= 0 for event in events)
+    counts = {}
+    for event in events:
+        counts.update(event.counts)
+    assert len(content) == counts[instrumentation.BYTES]
+    assert len(trips) == counts[instrumentation.TRIPS]
+    if feed_id == "BDFM":
+        assert 0 == counts[instrumentation.TRIPS_DROPPED]
+        assert counts[instrumentation.STOP_IDS_FLIPPED] > 0
+    else:
+        # The SIR feed contains trips for the SS route, which are dropped
+        assert counts[instrumentation.TRIPS_DROPPED] > 0
+        assert 0 == counts[instrumentation.STOP_IDS_FLIPPED]
+    assert 40 == counts[instrumentation.TRIPS] + counts[instrumentation.TRIPS_DROPPED]
+
+
+def test_subway_trips_parser__entity_cache_counts(events):
+    generator = syntheticfeeds.SubwayFeedGenerator(seed=3, num_trips=40, churn=0.1)
+    parser = SubwayTripsParser()
+    parser.load_options({"entity_cache_size": 1000})
+
+    parser.load_content(generator.next_snapshot())
+    parser.load_content(generator.next_snapshot())
+
+    first, second = [event.counts for event in events]
+    assert 0 == first[instrumentation.ENTITY_CACHE_HITS]
+    assert 40 == first[instrumentation.ENTITY_CACHE_MISSES]
+    assert 40 == (
+        second[instrumentation.ENTITY_CACHE_HITS]
+        + second[instrumentation.ENTITY_CACHE_MISSES]
+    )
+    assert second[instrumentation.ENTITY_CACHE_HITS] > 0
+
+
+def test_subway_trips_parser__vehicles(events):
+    parser = SubwayTripsParser()
+    parser.load_content(
+        syntheticfeeds.SubwayFeedGenerator(seed=3, num_trips=40).next_snapshot()
+    )
+
+    vehicles = list(parser.get_vehicles())
+
+    assert Stage.CONVERT_VEHICLES == events[-1].stage
+    assert len(vehicles) == events[-1].counts[instrumentation.VEHICLES]
+
+
+@pytest.mark.parametrize(
+    "engine,expected_stages",
+    [
+        ("default", [Stage.FILTER, Stage.DECODE, Stage.MOVE_EXTENSIONS, Stage.CONVERT]),
+        ("fused", [Stage.FILTER, Stage.DECODE, Stage.CONVERT]),
+    ],
+)
+def test_alerts_parser(events, engine, expected_stages):
+    content = syntheticfeeds.AlertsFeedGenerator(
+        seed=3, num_alerts=40, non_alert_fraction=0.5
+    ).next_snapshot()
+    parser = AlertsParser()
+    parser.load_options({"feed_id": "alerts", "engine": engine})
+
+    parser.load_content(content)
+    alerts = list(parser.get_alerts())
+
+    assert expected_stages == [event.stage for event in events]
+    assert all(event.feed_id == "alerts" for event in events)
+    filter_counts = events[0].counts
+    assert 40 == filter_counts[instrumentation.ENTITIES]
+    assert filter_counts[instrumentation.ALERTS_DROPPED] > 0
+    assert events[1].counts[instrumentation.BYTES] < len(content)
+    assert len(alerts) == events[-1].counts[instrumentation.ALERTS]
+    assert 40 == len(alerts) + filter_counts[instrumentation.ALERTS_DROPPED]
+
+
+def test_alerts_parser__keep_non_alerts(events):
+    parser = AlertsParser()
+    parser.load_options({"keep_non_alerts": True})
+
+    parser.load_content(
+        syntheticfeeds.AlertsFeedGenerator(seed=3, num_alerts=40).next_snapshot()
+    )
+    alerts = list(parser.get_alerts())
+
+    assert Stage.FILTER not in [event.stage for event in events]
+    assert 40 == len(alerts)
+
+
+def test_alerts_parser__incremental(events):
+    generator = syntheticfeeds.AlertsFeedGenerator(
+        seed=3, num_alerts=40, non_alert_fraction=0, churn=0.2
+    )
+    parser = AlertsParser()
+    parser.load_options({"incremental": True})
+    parser.load_content(generator.next_snapshot())
+    list(parser.get_alerts())
+    del events[:]
+
+    parser.load_content(generator.next_snapshot())
+    alerts = list(parser.get_alerts())
+
+    assert [Stage.FILTER, Stage.CONVERT] == [event.stage for event in events]
+    counts = events[-1].counts
+    changes = parser.get_alert_changes()
+    assert len(alerts) == counts[instrumentation.ALERTS]
+    assert len(alerts) == counts[instrumentation.ENTITIES]
+    assert counts[instrumentation.ENTITY_CACHE_HITS] > 0
+    assert len(changes.added) + len(changes.updated) == (
+        counts[instrumentation.ENTITY_CACHE_MISSES]
+    )
+    assert len(changes.added) == counts[instrumentation.ALERTS_ADDED]
+    assert len(changes.updated) == counts[instrumentation.ALERTS_UPDATED]
+    assert len(changes.removed) == counts[instrumentation.ALERTS_REMOVED]
+
+
+def test_content_cache_hits_are_not_recorded(events):
+    content = syntheticfeeds.AlertsFeedGenerator(seed=3, num_alerts=5).next_snapshot()
+    parser = AlertsParser()
+    parser.load_options({"content_cache": True})
+    parser.load_content(content)
+    list(parser.get_alerts())
+    del events[:]
+
+    parser.load_content(content)
+    list(parser.get_alerts())
+
+    assert [] == events
+
+
+def test_remove_listener(events):
+    other_events = []
+    instrumentation.add_listener(other_events.append)
+    instrumentation.remove_listener(other_events.append)
+
+    _parse_trips(None, syntheticfeeds.SubwayFeedGenerator(num_trips=5).next_snapshot())
+
+    assert [] == other_events
+    assert len(events) > 0
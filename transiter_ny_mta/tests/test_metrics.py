@@ -0,0 +1,178 @@
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from transiter_ny_mta import (
+    AlertsParser,
+    StationsCsvParser,
+    SubwayTripsParser,
+    instrumentation,
+    metrics,
+    syntheticfeeds,
+)
+from transiter_ny_mta.instrumentation import Stage, StageEvent
+
+
+def _event(duration, feed_id="ACE", stage=Stage.DECODE, **counts):
+    return StageEvent(
+        parser="SubwayTripsParser",
+        feed_id=feed_id,
+        stage=stage,
+        duration=duration,
+        counts=counts,
+    )
+
+
+def test_histogram():
+    collector = metrics.MetricsCollector(buckets=[0.1, 1])
+
+    collector(_event(0.05))
+    collector(_event(0.1))
+    collector(_event(0.5))
+    collector(_event(3))
+
+    lines = collector.render().splitlines()
+    labels = 'feed_id="ACE",parser="SubwayTripsParser",stage="decode"'
+    name = "transiter_ny_mta_stage_duration_seconds"
+    assert f"# TYPE {name} histogram" in lines
+    assert f'{name}_bucket{{{labels},le="0.1"}} 2' in lines
+    assert f'{name}_bucket{{{labels},le="1.0"}} 3' in lines
+    assert f'{name}_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f"{name}_count{{{labels}}} 4" in lines
+    assert f"{name}_sum{{{labels}}} 3.65" in lines
+
+
+def test_counters():
+    collector = metrics.MetricsCollector()
+
+    collector(_event(0.1, bytes=1000, entities=10))
+    collector(_event(0.1, bytes=500, entities=5))
+    collector(
+        _event(0.1, stage=Stage.FIXUPS, trips=8, trips_dropped=2, stop_ids_flipped=3)
+    )
+    collector(_event(0.1, feed_id=None, bytes=7))
+
+    lines = collector.render().splitlines()
+    labels = 'feed_id="ACE",parser="SubwayTripsParser"'
+    assert f"transiter_ny_mta_parsed_bytes_total{{{labels}}} 1500" in lines
+    assert (
+        'transiter_ny_mta_parsed_bytes_total{feed_id="",parser="SubwayTripsParser"} 7'
+        in lines
+    )
+    assert (
+        f'transiter_ny_mta_entities_total{{{labels},stage="decode",type="feed_entity"}}'
+        " 15" in lines
+    )
+    assert (
+        f'transiter_ny_mta_entities_total{{{labels},stage="fixups",type="trip"}} 8'
+        in lines
+    )
+    assert (
+        f'transiter_ny_mta_skipped_entities_total{{{labels},reason="route_id"}} 2'
+        in lines
+    )
+    assert f"transiter_ny_mta_stop_ids_flipped_total{{{labels}}} 3" in lines
+
+
+def test_label_escaping():
+    collector = metrics.MetricsCollector()
+
+    collector(_event(0.1, feed_id='a"b\\c\nd'))
+
+    assert 'feed_id="a\\"b\\\\c\\nd"' in collector.render()
+
+
+def test_threads():
+    collector = metrics.MetricsCollector()
+
+    def record():
+        for _ in range(1000):
+            collector(_event(0.001, bytes=1))
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (
+        'transiter_ny_mta_parsed_bytes_total{feed_id="ACE",parser="SubwayTripsParser"}'
+        " 4000" in collector.render().splitlines()
+    )
+
+
+def test_threads__shards_are_merged_when_threads_exit():
+    collector = metrics.MetricsCollector()
+    collector(_event(0.001, bytes=1))
+
+    for _ in range(10):
+        thread = threading.Thread(target=collector, args=(_event(0.001, bytes=1),))
+        thread.start()
+        thread.join()
+
+    assert 1 == len(collector._shards)
+    assert (
+        'transiter_ny_mta_parsed_bytes_total{feed_id="ACE",parser="SubwayTripsParser"}'
+        " 11" in collector.render().splitlines()
+    )
+
+
+@pytest.fixture
+def collector():
+    collector = metrics.MetricsCollector()
+    instrumentation.add_listener(collector)
+    yield collector
+    instrumentation.remove_listener(collector)
+
+
+def test_parsers(collector):
+    for feed_id in ["ACE", "BDFM"]:
+        parser = SubwayTripsParser()
+        parser.load_options({"feed_id": feed_id})
+        parser.load_content(
+            syntheticfeeds.SubwayFeedGenerator(
+                feed_id=feed_id, num_trips=10
+            ).next_snapshot()
+        )
+        list(parser.get_trips())
+    parser = AlertsParser()
+    parser.load_options({"feed_id": "alerts"})
+    parser.load_content(
+        syntheticfeeds.AlertsFeedGenerator(num_alerts=10).next_snapshot()
+    )
+    list(parser.get_alerts())
+    parser = StationsCsvParser()
+    parser.load_options({"feed_id": "DirectionRules"})
+    parser.load_content(syntheticfeeds.build_stations_csv(num_stations=10))
+    list(parser.get_direction_rules())
+
+    rendered = collector.render()
+
+    for feed_id in ["ACE", "BDFM", "alerts", "DirectionRules"]:
+        assert f'transiter_ny_mta_parsed_bytes_total{{feed_id="{feed_id}"' in rendered
+    assert (
+        'transiter_ny_mta_entities_total{feed_id="DirectionRules",'
+        'parser="StationsCsvParser",stage="convert",type="direction_rule"} 29'
+        in rendered
+    )
+
+
+def test_http_server():
+    collector = metrics.MetricsCollector()
+    collector(_event(0.1))
+    server = metrics.start_http_server(0, collector, address="127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(url + "/metrics") as response:
+            body = response.read().decode("utf-8")
+            content_type = response.headers["Content-Type"]
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert collector.render() == body
+    assert metrics.CONTENT_TYPE == content_type
+    assert 404 == exc_info.value.code
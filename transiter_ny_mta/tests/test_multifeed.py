@@ -0,0 +1,76 @@
+import pytest
+from transiter_ny_mta import SubwayTripsParser, multifeed, syntheticfeeds
+
+
+@pytest.fixture(scope="module")
+def multi_feed_parser():
+    with multifeed.MultiFeedParser(max_workers=2) as multi_feed_parser:
+        yield multi_feed_parser
+
+
+def test_parse(multi_feed_parser):
+    feed_id_to_content = {
+        feed_id: syntheticfeeds.SubwayFeedGenerator(
+            feed_id=feed_id, scale=0.1
+        ).next_snapshot()
+        for feed_id in multifeed.SUBWAY_FEED_IDS
+    }
+
+    feed_id_to_result = multi_feed_parser.parse(feed_id_to_content)
+
+    assert list(feed_id_to_content.keys()) == list(feed_id_to_result.keys())
+    for feed_id, content in feed_id_to_content.items():
+        parser = SubwayTripsParser()
+        parser.load_content(content)
+        result = feed_id_to_result[feed_id]
+        assert result.error is None
+        assert parser.get_timestamp() == result.timestamp
+        assert list(parser.get_trips()) == result.trips
+        assert list(parser.get_vehicles()) == result.vehicles
+        assert 0 < result.parse_duration <= result.duration
+
+
+def test_parse__each_feed_has_one_worker():
+    generators = {
+        feed_id: syntheticfeeds.SubwayFeedGenerator(feed_id=feed_id, scale=0.1)
+        for feed_id in ["123456", "ACE", "L", "G"]
+    }
+    feed_id_to_executors = {feed_id: set() for feed_id in generators}
+
+    with multifeed.MultiFeedParser(max_workers=2) as multi_feed_parser:
+        for _ in range(3):
+            multi_feed_parser.parse(
+                {
+                    feed_id: generator.next_snapshot()
+                    for feed_id, generator in generators.items()
+                }
+            )
+            for feed_id, executors in feed_id_to_executors.items():
+                executors.add(multi_feed_parser._feed_id_to_executor[feed_id])
+
+    # The parser of each feed keeps its state between batches
+    assert all(1 == len(executors) for executors in feed_id_to_executors.values())
+    assert 2 == len(set.union(*feed_id_to_executors.values()))
+
+
+def test_parse__error(multi_feed_parser):
+    content = syntheticfeeds.SubwayFeedGenerator(feed_id="L", scale=0.1).next_snapshot()
+
+    feed_id_to_result = multi_feed_parser.parse({"L": content, "G": b"\x80"})
+
+    assert feed_id_to_result["L"].error is None
+    assert len(feed_id_to_result["L"].trips) > 0
+    assert feed_id_to_result["G"].error is not None
+    assert [] == feed_id_to_result["G"].trips
+
+
+def test_parse_feeds__options():
+    content = syntheticfeeds.SubwayFeedGenerator(
+        feed_id="123456", scale=0.1
+    ).next_snapshot()
+
+    feed_id_to_result = multifeed.parse_feeds(
+        {"123456": content}, max_workers=1, options={"include_routes": ["6"]}
+    )
+
+    assert {"6"} == {trip.route_id for trip in feed_id_to_result["123456"].trips}
@@ -0,0 +1,48 @@
+import importlib
+import logging
+
+from google.protobuf.internal import api_implementation
+from transiter_ny_mta import proto
+
+
+def test_backend_report():
+    report = proto.backend_report()
+
+    assert api_implementation.Type() == report.backend
+    assert (api_implementation.Type() == "python") == report.is_pure_python
+    assert report.available_backends is None
+
+
+def test_backend_report__requested_backend(monkeypatch):
+    monkeypatch.setenv(proto.BACKEND_ENV_VARIABLE, "upb")
+
+    report = proto.backend_report()
+
+    assert "upb" == report.requested_backend
+    assert "requested backend: upb" in str(report)
+
+
+def test_available_backends():
+    backends = proto.available_backends()
+
+    assert api_implementation.Type() in backends
+
+
+def test_is_backend_available__unknown_backend():
+    assert not proto.is_backend_available("unknown")
+
+
+def test_import_logs_backend(caplog):
+    with caplog.at_level(logging.DEBUG, logger=proto.__name__):
+        importlib.reload(proto)
+
+    assert [logging.DEBUG] == [record.levelno for record in caplog.records]
+    message = caplog.records[0].getMessage()
+    assert f"Using the {api_implementation.Type()} protobuf backend" in message
+
+
+def test_warn_if_pure_python(caplog):
+    with caplog.at_level(logging.WARNING, logger=proto.__name__):
+        proto.warn_if_pure_python()
+
+    assert (len(caplog.records) == 1) == (api_implementation.Type() == "python")
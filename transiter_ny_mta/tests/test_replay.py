@@ -0,0 +1,76 @@
+import pytest
+from transiter_ny_mta import archive, replay
+
+NUM_FEEDS = 9
+
+
+@pytest.fixture(scope="module")
+def archive_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("replay") / "synthetic.archive")
+    replay.write_synthetic_archive(path, num_polls=2, poll_interval=2, scale=0.05)
+    return path
+
+
+def test_replay(archive_path):
+    report = replay.replay(archive_path, sample_every=4)
+
+    assert 2 * NUM_FEEDS == report.snapshots
+    assert 2 == report.simulated_duration
+    assert report.snapshots_per_second > 0
+    assert report.feed_id_to_error == {}
+    assert NUM_FEEDS == len(report.feed_id_to_stats)
+    assert all(len(stats.durations) == 2 for stats in report.feed_id_to_stats.values())
+    assert [4, 8, 12, 16, 18] == [sample.snapshots for sample in report.memory_samples]
+    assert report.rss_growth is not None
+    assert report.traced_growth is None
+    assert report.max_lag is None
+
+
+def test_replay__loops_and_feeds(archive_path):
+    report = replay.replay(archive_path, loops=3, feed_ids=["L", "gtfsrealtime-alerts"])
+
+    assert 2 * 3 * 2 == report.snapshots
+    # Each loop starts one poll interval after the previous one ends
+    assert 2 + 4 + 4 == report.simulated_duration
+    assert {"L", "gtfsrealtime-alerts"} == set(report.feed_id_to_stats)
+
+
+def test_replay__at_speed(archive_path):
+    report = replay.replay(archive_path, speed=20, feed_ids=["L"])
+
+    assert report.wall_duration >= 2 / 20
+    assert report.max_lag is not None
+
+
+def test_replay__trace_memory(archive_path):
+    report = replay.replay(archive_path, trace_memory=True, sample_every=9)
+
+    assert report.traced_growth is not None
+
+
+def test_replay__workers(archive_path):
+    report = replay.replay(archive_path, workers=2, loops=2)
+
+    assert 2 * 2 * NUM_FEEDS == report.snapshots
+    assert report.feed_id_to_error == {}
+    assert report.memory_samples[-1].rss is not None
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_replay__errors(tmp_path, workers):
+    path = str(tmp_path / "invalid.archive")
+    with archive.ArchiveWriter(path) as writer:
+        writer.append("L", 100, b"not a feed")
+        writer.append("L", 102, b"not a feed")
+
+    report = replay.replay(path, workers=workers)
+
+    assert 2 == report.feed_id_to_stats["L"].errors
+    assert "L" in report.feed_id_to_error
+    assert "L failed" in report.format()
+
+
+def test_main(capsys):
+    assert 0 == replay.main(["--synthetic", "1", "--scale", "0.05"])
+
+    assert "snapshots/s" in capsys.readouterr().out
@@ -0,0 +1,119 @@
+import pytest
+from transiter_ny_mta import routefilter
+from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
+
+
+@pytest.mark.parametrize(
+    "include,exclude,route_id,expected",
+    [
+        [None, None, "A", True],
+        [["A"], None, "A", True],
+        [["A"], None, "C", False],
+        [["A"], None, None, False],
+        [None, ["A"], "A", False],
+        [None, ["A"], "C", True],
+        [None, ["A"], None, True],
+        [["A", "C"], ["C"], "C", False],
+        [["5"], None, "5X", True],
+        [None, ["5"], "5X", False],
+        [None, None, "SS", False],
+    ],
+)
+def test_keeps(include, exclude, route_id, expected):
+    route_filter = routefilter.RouteFilter(
+        include, exclude, aliases={"5X": "5"}, always_exclude={"SS"}
+    )
+
+    assert expected == route_filter.keeps(route_id)
+    # The decision is cached
+    assert expected == route_filter.keeps(route_id)
+
+
+@pytest.mark.parametrize(
+    "include,exclude,expected",
+    [
+        [None, None, True],
+        [None, ["A"], True],
+        [["A"], None, False],
+        [["SS"], None, True],
+    ],
+)
+def test_keeps__vehicle_on_always_excluded_route(include, exclude, expected):
+    route_filter = routefilter.RouteFilter(include, exclude, always_exclude={"SS"})
+
+    assert not route_filter.keeps("SS")
+    assert expected == route_filter.keeps("SS", vehicle=True)
+
+
+def test_filter_content():
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            _build_trip_update_entity("1", "A"),
+            _build_trip_update_entity("2", "C"),
+            gtfs.FeedEntity(
+                id="3", vehicle=gtfs.VehiclePosition(trip=_build_trip("C"))
+            ),
+            gtfs.FeedEntity(
+                id="4", vehicle=gtfs.VehiclePosition(trip=_build_trip("A"))
+            ),
+            gtfs.FeedEntity(id="5", alert=gtfs.Alert()),
+        ],
+    )
+    route_filter = routefilter.RouteFilter(include=["A"])
+
+    content, num_entities, num_removed = route_filter.filter_content(
+        message.SerializeToString()
+    )
+
+    filtered_message = gtfs.FeedMessage.FromString(content)
+    assert message.header == filtered_message.header
+    assert ["1", "4", "5"] == [entity.id for entity in filtered_message.entity]
+    assert (5, 2) == (num_entities, num_removed)
+
+
+def test_filter_content__always_excluded_route():
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            _build_trip_update_entity("1", "SS"),
+            gtfs.FeedEntity(
+                id="2", vehicle=gtfs.VehiclePosition(trip=_build_trip("SS"))
+            ),
+            gtfs.FeedEntity(
+                id="3",
+                trip_update=gtfs.TripUpdate(trip=_build_trip("SS")),
+                vehicle=gtfs.VehiclePosition(trip=_build_trip("SS")),
+            ),
+        ],
+    )
+    route_filter = routefilter.RouteFilter(exclude=["A"], always_exclude={"SS"})
+
+    content, num_entities, num_removed = route_filter.filter_content(
+        message.SerializeToString()
+    )
+
+    # Vehicles on always excluded routes are kept
+    filtered_message = gtfs.FeedMessage.FromString(content)
+    assert ["2", "3"] == [entity.id for entity in filtered_message.entity]
+    assert (3, 1) == (num_entities, num_removed)
+
+
+def test_filter_content__nothing_removed():
+    content = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[_build_trip_update_entity("1", "A")],
+    ).SerializeToString()
+    route_filter = routefilter.RouteFilter(exclude=["C"])
+
+    assert (content, 1, 0) == route_filter.filter_content(content)
+
+
+def _build_trip(route_id):
+    return gtfs.TripDescriptor(trip_id="trip_" + route_id, route_id=route_id)
+
+
+def _build_trip_update_entity(entity_id, route_id):
+    return gtfs.FeedEntity(
+        id=entity_id, trip_update=gtfs.TripUpdate(trip=_build_trip(route_id))
+    )
@@ -0,0 +1,155 @@
+import asyncio
+import urllib.error
+import urllib.request
+
+import pytest
+from transiter_ny_mta import SubwayTripsParser, fetcher, standinserver, syntheticfeeds
+
+
+class _CountingFeed(standinserver.Feed):
+    def __init__(self):
+        self.num_payloads = 0
+
+    def payload(self, elapsed):
+        self.num_payloads += 1
+        return str(self.num_payloads).encode("utf-8")
+
+
+def _get(url, headers=None):
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_feed_is_abstract():
+    with pytest.raises(TypeError):
+        standinserver.Feed()
+
+
+@pytest.mark.parametrize(
+    "elapsed,loop,expected",
+    [
+        [0, False, b"a"],
+        [4.9, False, b"a"],
+        [5, False, b"b"],
+        [100, False, b"c"],
+        [14.9, True, b"c"],
+        [15, True, b"a"],
+        [20, True, b"b"],
+    ],
+)
+def test_replay_feed(elapsed, loop, expected):
+    feed = standinserver.ReplayFeed([(110, b"c"), (100, b"a"), (105, b"b")], loop)
+
+    assert expected == feed.payload(elapsed)
+
+
+def test_generator_feed():
+    generator = syntheticfeeds.AlertsFeedGenerator(scale=0.1, poll_interval=5)
+    expected = list(
+        syntheticfeeds.AlertsFeedGenerator(scale=0.1, poll_interval=5).snapshots(3)
+    )
+    feed = standinserver.GeneratorFeed(generator)
+
+    assert [expected[0], expected[0], expected[1], expected[2], expected[2]] == [
+        feed.payload(elapsed) for elapsed in [0, 4.9, 5, 10, 12]
+    ]
+
+
+def test_serve_synthetic_feeds_to_fetcher():
+    path_to_feed = standinserver.build_synthetic_feeds(scale=0.1)
+
+    async def fetch_twice(base_url):
+        feed_fetcher = fetcher.Fetcher()
+        requests = fetcher.subway_feed_requests("key", base_url=base_url)
+        try:
+            first = await feed_fetcher.fetch_all(requests)
+            second = await feed_fetcher.fetch_all(requests)
+        finally:
+            await feed_fetcher.close()
+        return first, second
+
+    # The clock is stopped so that the feeds do not change
+    with standinserver.StandInServer(path_to_feed, api_key="key", speed=0) as server:
+        first, second = asyncio.run(
+            fetch_twice(server.url + standinserver.MTA_API_PREFIX)
+        )
+
+    assert 9 == len(first)
+    assert all(result.status == 200 for result in first.values())
+    assert all(result.not_modified for result in second.values())
+    assert 9 == server.stats.not_modified
+    parser = SubwayTripsParser()
+    parser.load_content(first["ACE"].content)
+    assert len(list(parser.get_trips())) > 0
+
+
+def test_api_key():
+    path = standinserver.FEED_PATHS[("nyc_subway", "L")]
+    path_to_feed = {path: standinserver.StaticFeed(b"content")}
+
+    with standinserver.StandInServer(path_to_feed, api_key="key") as server:
+        assert 403 == _get(server.url + path)[0]
+        assert 403 == _get(server.url + path, {"X-API-KEY": "other"})[0]
+        assert (200, b"content") == _get(server.url + path, {"X-API-KEY": "key"})
+        assert 404 == _get(server.url + "/missing", {"X-API-KEY": "key"})[0]
+
+
+def test_faults__errors():
+    faults = standinserver.Faults(error_rate=1, error_status=502)
+
+    with standinserver.StandInServer(
+        {"/feed": standinserver.StaticFeed(b"content")}, faults=faults
+    ) as server:
+        assert 502 == _get(server.url + "/feed")[0]
+
+    assert {502: 1} == server.stats.statuses
+
+
+def test_faults__truncated_bodies():
+    faults = standinserver.Faults(truncate_rate=1)
+
+    async def fetch(url):
+        feed_fetcher = fetcher.Fetcher()
+        try:
+            return await feed_fetcher.fetch(fetcher.FeedRequest("feed", url))
+        finally:
+            await feed_fetcher.close()
+
+    with standinserver.StandInServer(
+        {"/feed": standinserver.StaticFeed(b"content" * 100)}, faults=faults
+    ) as server:
+        result = asyncio.run(fetch(server.url + "/feed"))
+
+    assert result.content is None
+    assert result.error is not None
+    assert 1 == server.stats.truncated
+
+
+def test_faults__stale_repeats():
+    faults = standinserver.Faults(stale_rate=1)
+
+    with standinserver.StandInServer(
+        {"/feed": _CountingFeed()}, faults=faults
+    ) as server:
+        payloads = [_get(server.url + "/feed")[1] for _ in range(3)]
+
+    assert [b"1", b"1", b"1"] == payloads
+    assert 2 == server.stats.stale
+
+
+def test_load_recorded_feeds(tmp_path):
+    feed_directory = tmp_path / "nyc_subway" / "G"
+    feed_directory.mkdir(parents=True)
+    (feed_directory / "1600000005.pb").write_bytes(b"second")
+    (feed_directory / "1600000000.pb").write_bytes(b"first")
+    (feed_directory / "README").write_text("not a snapshot")
+
+    path_to_feed = standinserver.load_recorded_feeds(str(tmp_path))
+
+    feed = path_to_feed[standinserver.FEED_PATHS[("nyc_subway", "G")]]
+    assert 1 == len(path_to_feed)
+    assert [b"first", b"second"] == [feed.payload(0), feed.payload(5)]
@@ -0,0 +1,93 @@
+import pytest
+from transiter import parse
+from transiter_ny_mta import subscriptions
+
+
+def _build_trip(trip_id, route_id, direction_id, stop_ids):
+    return parse.Trip(
+        id=trip_id,
+        route_id=route_id,
+        direction_id=direction_id,
+        stop_times=[parse.TripStopTime(stop_id=stop_id) for stop_id in stop_ids],
+    )
+
+
+TRIP_1 = _build_trip("1", "A", False, ["A01N", "A02N", "A03N"])
+TRIP_2 = _build_trip("2", "A", True, ["A03S", "A02S"])
+TRIP_3 = _build_trip("3", "C", True, ["A03S", "B01S"])
+
+
+@pytest.mark.parametrize(
+    "subscription,expected_trips",
+    [
+        [subscriptions.Subscription("all"), [TRIP_1, TRIP_2, TRIP_3]],
+        [subscriptions.Subscription("routes", route_ids=frozenset({"C"})), [TRIP_3],],
+        [subscriptions.Subscription("direction", direction_id=True), [TRIP_2, TRIP_3]],
+        [
+            subscriptions.Subscription("stops", stop_id_prefixes=("A03", "B")),
+            [
+                _build_trip("1", "A", False, ["A03N"]),
+                _build_trip("2", "A", True, ["A03S"]),
+                TRIP_3,
+            ],
+        ],
+        [
+            subscriptions.Subscription(
+                "combined",
+                route_ids=frozenset({"A", "C"}),
+                stop_id_prefixes=("A02",),
+                direction_id=True,
+            ),
+            [_build_trip("2", "A", True, ["A02S"])],
+        ],
+        [subscriptions.Subscription("none", stop_id_prefixes=("Z",)), []],
+    ],
+)
+def test_fan_out(subscription, expected_trips):
+    subscription_set = subscriptions.SubscriptionSet([subscription])
+
+    name_to_trips = subscription_set.fan_out([TRIP_1, TRIP_2, TRIP_3])
+
+    assert {subscription.name: expected_trips} == name_to_trips
+
+
+def test_fan_out__many_subscriptions():
+    subscription_set = subscriptions.SubscriptionSet(
+        [
+            subscriptions.Subscription("all"),
+            subscriptions.Subscription("C", route_ids=frozenset({"C"})),
+            subscriptions.Subscription("A01", stop_id_prefixes=("A01",)),
+        ]
+    )
+    trips = [TRIP_1, TRIP_2, TRIP_3]
+
+    for _ in range(2):
+        name_to_trips = subscription_set.fan_out(trips)
+
+        assert {
+            "all": trips,
+            "C": [TRIP_3],
+            "A01": [_build_trip("1", "A", False, ["A01N"])],
+        } == name_to_trips
+    # The parser's trips are not modified
+    assert 3 == len(TRIP_1.stop_times)
+
+
+def test_duplicate_names():
+    with pytest.raises(ValueError):
+        subscriptions.SubscriptionSet(
+            [subscriptions.Subscription("a"), subscriptions.Subscription("a")]
+        )
+
+
+def test_from_dict():
+    assert subscriptions.Subscription(
+        "name", frozenset({"A"}), ("A01",), True
+    ) == subscriptions.Subscription.from_dict(
+        {
+            "name": "name",
+            "routes": ["A"],
+            "stop_id_prefixes": ["A01"],
+            "direction_id": True,
+        }
+    )
@@ -5,7 +5,7 @@ import pytz
 from transiter import parse
 from transiter_ny_mta import SubwayTripsParser
 from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
-from transiter_ny_mta.subwaytripsparser import _MtaDirection
+from transiter_ny_mta.subwaytripsparser import Engine, _MtaDirection
 
 ALERT_ID = "alert_id"
 TRIP_ID = "trip_id"
@@ -17,6 +17,18 @@ TIME_1 = datetime.datetime.utcfromtimestamp(1000).replace(tzinfo=pytz.UTC)
 TIME_2 = datetime.datetime.utcfromtimestamp(2000).replace(tzinfo=pytz.UTC)
 
 
+PARSER_OPTIONS = [{"engine": engine.value} for engine in Engine] + [
+    {"entity_cache_size": 100}
+]
+
+
+@pytest.fixture(params=PARSER_OPTIONS)
+def parser(request):
+    parser = SubwayTripsParser()
+    parser.load_options(request.param)
+    return parser
+
+
 @pytest.mark.parametrize("existing_direction_id", [None, True, False])
 @pytest.mark.parametrize(
     "mta_direction,expected_direction_id",
@@ -28,7 +40,7 @@ TIME_2 = datetime.datetime.utcfromtimestamp(2000).replace(tzinfo=pytz.UTC)
         [None, False],
     ],
 )
-def test_direction(existing_direction_id, mta_direction, expected_direction_id):
+def test_direction(existing_direction_id, mta_direction, expected_direction_id, parser):
     trip = gtfs.TripDescriptor(trip_id=TRIP_ID)
     if existing_direction_id is not None:
         expected_direction_id = existing_direction_id
@@ -45,7 +57,6 @@ def test_direction(existing_direction_id, mta_direction, expected_direction_id):
 
     expected_trip = parse.Trip(id=TRIP_ID, direction_id=expected_direction_id)
 
-    parser = SubwayTripsParser()
     parser.load_content(message.SerializeToString())
     actual_trips = list(parser.get_trips())
 
@@ -64,7 +75,13 @@ def test_direction(existing_direction_id, mta_direction, expected_direction_id):
     [[VEHICLE_ID, VEHICLE_ID], [None, "vehicle_" + TRIP_ID]],
 )
 def test_create_vehicle(
-    entity_key, entity_type, is_assigned, expect_vehicle, train_id, expected_vehicle_id
+    entity_key,
+    entity_type,
+    is_assigned,
+    expect_vehicle,
+    train_id,
+    expected_vehicle_id,
+    parser,
 ):
     trip = gtfs.TripDescriptor(trip_id=TRIP_ID)
     mta_ext = trip.Extensions[trip._extensions_by_number[gtfs.MTA_EXTENSION_ID]]
@@ -81,7 +98,6 @@ def test_create_vehicle(
 
     expected_vehicle = parse.Vehicle(id=expected_vehicle_id, trip_id=TRIP_ID)
 
-    parser = SubwayTripsParser()
     parser.load_content(message.SerializeToString())
     actual_vehicles = list(parser.get_vehicles())
 
@@ -103,7 +119,7 @@ def test_create_vehicle(
         [TRACK_1_ID, TRACK_2_ID, TRACK_2_ID],
     ],
 )
-def test_track(scheduled_track, actual_track, expected_track):
+def test_track(scheduled_track, actual_track, expected_track, parser):
     stop_time = gtfs.TripUpdate.StopTimeUpdate(stop_id=STOP_ID)
     mta_ext = stop_time.Extensions[
         stop_time._extensions_by_number[gtfs.MTA_EXTENSION_ID]
@@ -132,7 +148,6 @@ def test_track(scheduled_track, actual_track, expected_track):
         stop_times=[parse.TripStopTime(stop_id=STOP_ID, track=expected_track)],
     )
 
-    parser = SubwayTripsParser()
     parser.load_content(message.SerializeToString())
     actual_trips = list(parser.get_trips())
 
@@ -159,7 +174,9 @@ STOP_IDS_TO_INVERT = {"M11", "M12", "M13", "M14", "M16", "M18"}
         for old_direction in ["S", "N"]
     ],
 )
-def test_invert_stop_id_direction_in_bushwick(route_id, stop_id, expected_stop_id):
+def test_invert_stop_id_direction_in_bushwick(
+    route_id, stop_id, expected_stop_id, parser
+):
     message = gtfs.FeedMessage(
         header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[
@@ -180,7 +197,6 @@ def test_invert_stop_id_direction_in_bushwick(route_id, stop_id, expected_stop_i
         stop_times=[parse.TripStopTime(stop_id=expected_stop_id)],
     )
 
-    parser = SubwayTripsParser()
     parser.load_content(message.SerializeToString())
     actual_trips = list(parser.get_trips())
 
@@ -191,7 +207,7 @@ def test_invert_stop_id_direction_in_bushwick(route_id, stop_id, expected_stop_i
     "route_id,actual_route_id,valid_trip",
     [["5", "5", True], ["5X", "5", True], ["", "", False], ["SS", "", False]],
 )
-def test_fix_route_ids(route_id, actual_route_id, valid_trip):
+def test_fix_route_ids(route_id, actual_route_id, valid_trip, parser):
     message = gtfs.FeedMessage(
         header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
         entity=[
@@ -208,7 +224,6 @@ def test_fix_route_ids(route_id, actual_route_id, valid_trip):
         id=TRIP_ID, route_id=actual_route_id, direction_id=False,
     )
 
-    parser = SubwayTripsParser()
     parser.load_content(message.SerializeToString())
     actual_trips = list(parser.get_trips())
 
@@ -216,3 +231,148 @@ def test_fix_route_ids(route_id, actual_route_id, valid_trip):
         assert [expected_trip] == actual_trips
     else:
         assert [] == actual_trips
+
+
+def test_options_agree_on_mixed_feed():
+    trip_1 = gtfs.TripDescriptor(
+        trip_id=TRIP_ID,
+        route_id="M",
+        start_time="10:11:12",
+        start_date="20200102",
+        schedule_relationship=gtfs.TripDescriptor.ScheduleRelationship.SCHEDULED,
+    )
+    mta_ext = trip_1.Extensions[trip_1._extensions_by_number[gtfs.MTA_EXTENSION_ID]]
+    mta_ext.direction = _MtaDirection.SOUTH.value
+    mta_ext.is_assigned = True
+    stop_time = gtfs.TripUpdate.StopTimeUpdate(
+        stop_id="M11N",
+        arrival=gtfs.TripUpdate.StopTimeEvent(time=1000, delay=5),
+        departure=gtfs.TripUpdate.StopTimeEvent(time=2000, uncertainty=7),
+    )
+    stop_time.Extensions[
+        stop_time._extensions_by_number[gtfs.MTA_EXTENSION_ID]
+    ].scheduled_track = TRACK_1_ID
+    trip_2 = gtfs.TripDescriptor(trip_id="trip_2", route_id="SS")
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0", timestamp=1000),
+        entity=[
+            gtfs.FeedEntity(
+                id="1",
+                trip_update=gtfs.TripUpdate(
+                    trip=trip_1, timestamp=2000, stop_time_update=[stop_time]
+                ),
+            ),
+            gtfs.FeedEntity(id="2", vehicle=gtfs.VehiclePosition(trip=trip_1)),
+            gtfs.FeedEntity(id="3", trip_update=gtfs.TripUpdate(trip=trip_2)),
+        ],
+    )
+
+    results = []
+    for options in PARSER_OPTIONS:
+        parser = SubwayTripsParser()
+        parser.load_options(options)
+        parser.load_content(message.SerializeToString())
+        results.append(
+            (
+                parser.get_timestamp(),
+                list(parser.get_trips()),
+                list(parser.get_vehicles()),
+            )
+        )
+
+    assert all(results[0] == result for result in results[1:])
+    assert TIME_1 == results[0][0]
+    assert ["M11S"] == [stop_time.stop_id for stop_time in results[0][1][0].stop_times]
+
+
+@pytest.mark.parametrize(
+    "route_options,expected_route_ids,expected_vehicle_route_ids",
+    [
+        [{"include_routes": ["A"]}, ["A"], ["A"]],
+        [{"include_routes": ["5", "C"]}, ["5", "C"], ["5X", "C"]],
+        [{"exclude_routes": ["A"]}, ["5", "C"], ["5X", "C", "SS"]],
+        [{"include_routes": ["A", "C"], "exclude_routes": ["C"]}, ["A"], ["A"]],
+        [{"include_routes": ["SS"]}, [], ["SS"]],
+    ],
+)
+def test_route_filter(
+    route_options, expected_route_ids, expected_vehicle_route_ids, parser
+):
+    engine = parser._engine
+    parser.load_options(route_options)
+    route_ids = ["A", "5X", "C", "SS"]
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            gtfs.FeedEntity(
+                id=str(i),
+                trip_update=gtfs.TripUpdate(
+                    trip=gtfs.TripDescriptor(trip_id=f"trip_{i}", route_id=route_id),
+                ),
+            )
+            for i, route_id in enumerate(route_ids)
+        ]
+        + [
+            # Trips on dropped routes are removed, but their vehicles are kept
+            gtfs.FeedEntity(
+                id=f"vehicle_{route_id}",
+                vehicle=gtfs.VehiclePosition(
+                    trip=gtfs.TripDescriptor(trip_id=route_id, route_id=route_id),
+                ),
+            )
+            for route_id in route_ids
+        ],
+    )
+
+    parser.load_content(message.SerializeToString())
+
+    assert expected_route_ids == [trip.route_id for trip in parser.get_trips()]
+    assert expected_vehicle_route_ids == sorted(
+        vehicle.trip_id for vehicle in parser.get_vehicles()
+    )
+    assert engine is parser._engine
+
+
+def test_get_subscribed_trips(parser):
+    engine = parser._engine
+    parser.load_options(
+        {
+            "subscriptions": [
+                {"name": "A trains", "routes": ["A"]},
+                {"name": "stop A02", "stop_id_prefixes": ["A02"]},
+            ]
+        }
+    )
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+        entity=[
+            gtfs.FeedEntity(
+                id=str(i),
+                trip_update=gtfs.TripUpdate(
+                    trip=gtfs.TripDescriptor(trip_id=f"trip_{i}", route_id=route_id),
+                    stop_time_update=[
+                        gtfs.TripUpdate.StopTimeUpdate(stop_id=stop_id)
+                        for stop_id in ["A01N", "A02N"]
+                    ],
+                ),
+            )
+            for i, route_id in enumerate(["A", "C"])
+        ],
+    )
+
+    parser.load_content(message.SerializeToString())
+    name_to_trips = parser.get_subscribed_trips()
+
+    assert ["trip_0"] == [trip.id for trip in name_to_trips["A trains"]]
+    assert [["A02N"], ["A02N"]] == [
+        [stop_time.stop_id for stop_time in trip.stop_times]
+        for trip in name_to_trips["stop A02"]
+    ]
+    assert engine is parser._engine
+
+
+def test_get_subscribed_trips__no_subscriptions():
+    parser = SubwayTripsParser()
+
+    with pytest.raises(ValueError):
+        parser.get_subscribed_trips()
@@ -0,0 +1,67 @@
+import pytest
+from transiter_ny_mta import (
+    AlertsParser,
+    StationsCsvParser,
+    SubwayTripsParser,
+    syntheticfeeds,
+)
+
+
+@pytest.mark.parametrize("feed_id", syntheticfeeds.FEED_ID_TO_NUM_TRIPS.keys())
+def test_subway_feed(feed_id):
+    generator = syntheticfeeds.SubwayFeedGenerator(seed=1, feed_id=feed_id)
+    parser = SubwayTripsParser()
+
+    parser.load_content(generator.next_snapshot())
+    trips = list(parser.get_trips())
+
+    assert generator.num_trips >= len(trips) > 0
+    assert {trip.route_id for trip in trips} <= set(
+        syntheticfeeds.FEED_ID_TO_ROUTE_IDS[feed_id]
+    ) | {"5"}
+    assert all(len(trip.stop_times) <= 40 for trip in trips)
+    assert len(list(parser.get_vehicles())) > 0
+
+
+def test_subway_feed_is_deterministic():
+    def build_snapshots():
+        generator = syntheticfeeds.SubwayFeedGenerator(seed=5, num_trips=20)
+        return list(generator.snapshots(3))
+
+    snapshots = build_snapshots()
+
+    assert snapshots == build_snapshots()
+    assert snapshots[0] != snapshots[1]
+
+
+def test_subway_feed_scale():
+    generator = syntheticfeeds.SubwayFeedGenerator(num_trips=10, scale=10)
+
+    assert 100 == len(generator.build_feed_message().entity) - sum(
+        entity.HasField("vehicle") for entity in generator.build_feed_message().entity
+    )
+
+
+def test_alerts_feed():
+    generator = syntheticfeeds.AlertsFeedGenerator(
+        seed=1, num_alerts=50, non_alert_fraction=0.5
+    )
+    parser = AlertsParser()
+
+    parser.load_content(generator.next_snapshot())
+    alerts = list(parser.get_alerts())
+
+    assert 0 < len(alerts) < 50
+    assert all(len(alert.messages) == 2 for alert in alerts)
+    assert all(len(alert.route_ids) > 0 for alert in alerts)
+
+
+def test_stations_csv():
+    parser = StationsCsvParser()
+
+    parser.load_content(syntheticfeeds.build_stations_csv(seed=1, num_stations=20))
+    direction_rules = list(parser.get_direction_rules())
+
+    # 9 special rules and 2 rules for each station
+    assert 9 + 2 * 20 == len(direction_rules)
+    assert "(Terminating trains)" in {rule.name for rule in direction_rules}
@@ -0,0 +1,88 @@
+import pytest
+from transiter_ny_mta import SubwayTripsParser, syntheticfeeds
+from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
+from transiter_ny_mta.tripdeltas import TripDelta
+
+
+def diff_full_snapshots(old_trips, new_trips):
+    old = {trip.id: trip for trip in old_trips}
+    new = {trip.id: trip for trip in new_trips}
+    added = set(new.keys()) - set(old.keys())
+    removed = set(old.keys()) - set(new.keys())
+    changed = {}
+    for trip_id in set(new.keys()) & set(old.keys()):
+        if old[trip_id] == new[trip_id]:
+            continue
+        stop_id_to_old = {s.stop_id: s for s in old[trip_id].stop_times}
+        new_stop_ids = {s.stop_id for s in new[trip_id].stop_times}
+        changed[trip_id] = (
+            [s for s in new[trip_id].stop_times if stop_id_to_old.get(s.stop_id) != s],
+            set(stop_id_to_old.keys()) - new_stop_ids,
+        )
+    return added, removed, changed
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("options", [{}, {"entity_cache_size": 1000}])
+def test_deltas_equal_full_snapshot_diff(seed, options):
+    generator = syntheticfeeds.SubwayFeedGenerator(
+        seed=seed, num_trips=15, churn=0.3, poll_interval=60
+    )
+    parser = SubwayTripsParser()
+    parser.load_options(options)
+    previous_trips = []
+
+    for content in generator.snapshots(5):
+        parser.load_content(content)
+        deltas = parser.get_trip_deltas()
+
+        reference_parser = SubwayTripsParser()
+        reference_parser.load_content(content)
+        current_trips = list(reference_parser.get_trips())
+        added, removed, changed = diff_full_snapshots(previous_trips, current_trips)
+        type_to_deltas = {
+            type_: [d for d in deltas if d.type is type_] for type_ in TripDelta.Type
+        }
+        assert added == {d.trip_id for d in type_to_deltas[TripDelta.Type.ADDED]}
+        assert removed == {d.trip_id for d in type_to_deltas[TripDelta.Type.REMOVED]}
+        assert changed == {
+            d.trip_id: (d.stop_times, set(d.removed_stop_ids))
+            for d in type_to_deltas[TripDelta.Type.CHANGED]
+        }
+
+        previous_trips = current_trips
+
+
+def test_repeated_stop_ids():
+    trip = gtfs.TripDescriptor(trip_id="trip_id", route_id="A")
+    contents = [
+        gtfs.FeedMessage(
+            header=gtfs.FeedHeader(gtfs_realtime_version="2.0"),
+            entity=[
+                gtfs.FeedEntity(
+                    id="1",
+                    trip_update=gtfs.TripUpdate(
+                        trip=trip,
+                        stop_time_update=[
+                            gtfs.TripUpdate.StopTimeUpdate(stop_id="A01N"),
+                            gtfs.TripUpdate.StopTimeUpdate(
+                                stop_id="A01N",
+                                arrival=gtfs.TripUpdate.StopTimeEvent(time=time),
+                            ),
+                        ],
+                    ),
+                )
+            ],
+        ).SerializeToString()
+        for time in [1000, 2000]
+    ]
+    parser = SubwayTripsParser()
+    parser.load_content(contents[0])
+    parser.get_trip_deltas()
+
+    parser.load_content(contents[1])
+    [delta] = parser.get_trip_deltas()
+
+    assert TripDelta.Type.CHANGED == delta.type
+    assert [delta.trip.stop_times[1]] == delta.stop_times
+    assert [] == delta.removed_stop_ids
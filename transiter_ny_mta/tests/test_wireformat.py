@@ -0,0 +1,149 @@
+import pytest
+from transiter_ny_mta import wireformat
+from transiter_ny_mta.proto import alerts_pb2
+from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs
+
+TRIP_UPDATE = wireformat.FEED_ENTITY_TRIP_UPDATE
+VEHICLE = wireformat.FEED_ENTITY_VEHICLE
+
+
+def test_split_feed_message():
+    message = gtfs.FeedMessage(
+        header=gtfs.FeedHeader(gtfs_realtime_version="2.0", timestamp=1000),
+        entity=[
+            gtfs.FeedEntity(
+                id=str(i),
+                trip_update=gtfs.TripUpdate(
+                    trip=gtfs.TripDescriptor(trip_id=f"trip_{i}", route_id="A")
+                ),
+            )
+            for i in range(3)
+        ],
+    )
+
+    header, entities = wireformat.split_feed_message(message.SerializeToString())
+
+    assert message.header == gtfs.FeedHeader.FromString(bytes(header))
+    assert list(message.entity) == [
+        gtfs.FeedEntity.FromString(bytes(entity)) for entity in entities
+    ]
+
+
+@pytest.mark.parametrize(
+    "buffer,expected_value", [[b"\x00", 0], [b"\x01", 1], [b"\xac\x02", 300]]
+)
+def test_read_varint(buffer, expected_value):
+    assert (expected_value, len(buffer)) == wireformat.read_varint(buffer, 0)
+
+
+@pytest.mark.parametrize("buffer", [b"\x80", b"\x12\x05abc", b"\x0b"])
+def test_malformed_content(buffer):
+    with pytest.raises(wireformat.WireFormatError):
+        wireformat.split_feed_message(buffer)
+
+
+@pytest.mark.parametrize(
+    "entity,expected_route_ids",
+    [
+        [gtfs.FeedEntity(id="1"), {}],
+        [
+            gtfs.FeedEntity(
+                id="1",
+                trip_update=gtfs.TripUpdate(trip=gtfs.TripDescriptor(route_id="A")),
+            ),
+            {TRIP_UPDATE: "A"},
+        ],
+        [
+            gtfs.FeedEntity(
+                id="1",
+                trip_update=gtfs.TripUpdate(trip=gtfs.TripDescriptor(trip_id="t")),
+            ),
+            {TRIP_UPDATE: None},
+        ],
+        [
+            gtfs.FeedEntity(
+                id="1", vehicle=gtfs.VehiclePosition(trip=gtfs.TripDescriptor())
+            ),
+            {VEHICLE: None},
+        ],
+        [
+            gtfs.FeedEntity(
+                id="1",
+                trip_update=gtfs.TripUpdate(trip=gtfs.TripDescriptor(route_id="A")),
+                vehicle=gtfs.VehiclePosition(trip=gtfs.TripDescriptor(route_id="Ä")),
+            ),
+            {TRIP_UPDATE: "A", VEHICLE: "Ä"},
+        ],
+    ],
+)
+def test_entity_route_ids(entity, expected_route_ids):
+    assert expected_route_ids == wireformat.entity_route_ids(entity.SerializeToString())
+
+
+def test_entity_route_ids__merged_fields():
+    # The decoder merges repeated message fields, so the last route ID wins
+    content = b"".join(
+        gtfs.FeedEntity(
+            id="1",
+            trip_update=gtfs.TripUpdate(trip=gtfs.TripDescriptor(route_id=route_id)),
+        ).SerializeToString()
+        for route_id in ["A", "C"]
+    )
+
+    assert "C" == gtfs.FeedEntity.FromString(content).trip_update.trip.route_id
+    assert {TRIP_UPDATE: "C"} == wireformat.entity_route_ids(content)
+
+
+def _alert_entity(*texts_and_languages):
+    return alerts_pb2.FeedEntity(
+        id="1",
+        alert=alerts_pb2.Alert(
+            header_text=alerts_pb2.TranslatedString(
+                translation=[
+                    alerts_pb2.TranslatedString.Translation(
+                        text=text, language=language
+                    )
+                    for text, language in texts_and_languages
+                ]
+            ),
+            description_text=alerts_pb2.TranslatedString(
+                translation=[
+                    alerts_pb2.TranslatedString.Translation(text="Description")
+                ]
+            ),
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    "entity,expected_translations",
+    [
+        [alerts_pb2.FeedEntity(id="1"), None],
+        [alerts_pb2.FeedEntity(id="1", alert=alerts_pb2.Alert()), []],
+        [_alert_entity(("Header", None)), [(None, "Header")]],
+        [
+            _alert_entity(("Header", "en"), ("Encabezado", "es")),
+            [("en", "Header"), ("es", "Encabezado")],
+        ],
+        [_alert_entity(("", "")), [("", "")]],
+    ],
+)
+def test_alert_header_translations(entity, expected_translations):
+    assert expected_translations == wireformat.alert_header_translations(
+        entity.SerializeToString()
+    )
+
+
+def test_alert_header_translations__merged_fields():
+    # The decoder concatenates the translations of repeated alert fields
+    content = b"".join(
+        _alert_entity((text, "en")).SerializeToString() for text in ["A", "B"]
+    )
+
+    assert ["A", "B"] == [
+        translation.text
+        for translation in alerts_pb2.FeedEntity.FromString(
+            content
+        ).alert.header_text.translation
+    ]
+    assert [("en", "A"), ("en", "B")] == wireformat.alert_header_translations(content)
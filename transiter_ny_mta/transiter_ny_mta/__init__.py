@@ -1,3 +1,34 @@
-from .alertsparser import AlertsParser
-from .subwaytripsparser import SubwayTripsParser
-from .stationscsvparser import StationsCsvParser
+"""
+Transiter parsers for the NY MTA's feeds.
+
+The parsers are imported lazily on first access, so that a process only pays for
+importing the parsers (and their vendored protobuf packages) that it uses.
+"""
+import importlib
+import typing
+
+if typing.TYPE_CHECKING:
+    from .alertsparser import AlertsParser
+    from .stationscsvparser import StationsCsvParser
+    from .subwaytripsparser import SubwayTripsParser
+
+_ATTRIBUTE_TO_MODULE = {
+    "AlertsParser": "alertsparser",
+    "SubwayTripsParser": "subwaytripsparser",
+    "StationsCsvParser": "stationscsvparser",
+}
+
+__all__ = list(_ATTRIBUTE_TO_MODULE.keys())
+
+
+def __getattr__(name):
+    module_name = _ATTRIBUTE_TO_MODULE.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module("." + module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
@@ -0,0 +1,137 @@
+"""
+Incremental conversion of the alerts feed, keyed by alert ID and update time.
+
+The Mercury extension of every alert carries the time the alert was last updated.
+The cache keeps, for each alert ID, the update time and the alert converted in the
+previous load. On each load the ID and update time of every alert are read from the
+wire format, and only the alerts that are new or whose update time changed are
+decoded and converted; the others are returned as is. Alerts without an update
+time are keyed by their serialized bytes instead.
+
+This relies on the feed bumping the update time whenever an alert changes. A cache
+hit returns the same object that was returned previously.
+"""
+import dataclasses
+import typing
+
+from transiter import parse
+from transiter_ny_mta import entitycache
+from transiter_ny_mta import wireformat
+from transiter_ny_mta.proto import alerts_pb2
+
+MERCURY_ALERT_UPDATED_AT = 2
+
+
+@dataclasses.dataclass
+class AlertChanges:
+    """
+    The alerts added, updated and removed by a load, relative to the previous load.
+
+    For removed alerts, these are the alerts of the previous load.
+    """
+
+    added: typing.List[parse.Alert] = dataclasses.field(default_factory=list)
+    updated: typing.List[parse.Alert] = dataclasses.field(default_factory=list)
+    removed: typing.List[parse.Alert] = dataclasses.field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+
+class AlertCache:
+    """
+    build_alert is called with the alert ID and the serialized alert of each new or
+    updated alert, and returns the converted alert.
+    """
+
+    def __init__(self, build_alert: typing.Callable[[str, bytes], parse.Alert]):
+        self.stats = entitycache.EntityCacheStats()
+        self._build_alert = build_alert
+        # Alert ID to the key (update time or serialized alert) and converted alert
+        self._id_to_entry = {}
+
+    def __len__(self):
+        return len(self._id_to_entry)
+
+    def load(
+        self, serialized_entities: typing.Iterable[memoryview]
+    ) -> typing.Tuple[typing.List[parse.Alert], AlertChanges]:
+        """
+        Return the alerts of the serialized feed entities, in order, and the changes.
+        """
+        alerts = []
+        changes = AlertChanges()
+        id_to_entry = {}
+        for serialized_entity in serialized_entities:
+            alert_id, serialized_alert = _read_entity(serialized_entity)
+            if serialized_alert is None:
+                continue
+            updated_at = _read_updated_at(serialized_alert)
+            key = bytes(serialized_alert) if updated_at is None else updated_at
+            entry = id_to_entry.get(alert_id)
+            if entry is None:
+                entry = self._id_to_entry.get(alert_id)
+            if entry is not None and entry[0] == key:
+                self.stats.hits += 1
+                alert = entry[1]
+            else:
+                self.stats.misses += 1
+                alert = self._build_alert(alert_id, bytes(serialized_alert))
+                # An alert whose ID is repeated in the feed is reported once
+                if alert_id not in id_to_entry:
+                    if alert_id in self._id_to_entry:
+                        changes.updated.append(alert)
+                    else:
+                        changes.added.append(alert)
+            id_to_entry[alert_id] = (key, alert)
+            alerts.append(alert)
+        for alert_id, (_, alert) in self._id_to_entry.items():
+            if alert_id not in id_to_entry:
+                changes.removed.append(alert)
+                self.stats.evictions += 1
+        self._id_to_entry = id_to_entry
+        return alerts, changes
+
+
+def _read_entity(serialized_entity) -> typing.Tuple[str, typing.Optional[bytes]]:
+    """
+    Return the ID and the serialized alert of the feed entity.
+
+    The serialized alert is None if the entity has no alert. As in the decoder, the
+    last ID wins and repeated alert fields are merged by concatenating them.
+    """
+    alert_id = ""
+    alert_pieces = []
+    for field in wireformat.iter_fields(serialized_entity):
+        if field.wire_type != wireformat.LENGTH_DELIMITED:
+            continue
+        if field.number == wireformat.FEED_ENTITY_ID:
+            alert_id = str(serialized_entity[field.value_start : field.end], "utf-8")
+        elif field.number == wireformat.FEED_ENTITY_ALERT:
+            alert_pieces.append(serialized_entity[field.value_start : field.end])
+    if len(alert_pieces) == 0:
+        return alert_id, None
+    if len(alert_pieces) == 1:
+        return alert_id, alert_pieces[0]
+    return alert_id, b"".join(alert_pieces)
+
+
+def _read_updated_at(serialized_alert) -> typing.Optional[int]:
+    updated_at = None
+    for field in wireformat.iter_fields(serialized_alert):
+        if (
+            field.number != alerts_pb2.MTA_EXTENSION_ID
+            or field.wire_type != wireformat.LENGTH_DELIMITED
+        ):
+            continue
+        for mercury_field in wireformat.iter_fields(
+            serialized_alert, field.value_start, field.end
+        ):
+            if (
+                mercury_field.number == MERCURY_ALERT_UPDATED_AT
+                and mercury_field.wire_type == wireformat.VARINT
+            ):
+                updated_at, _ = wireformat.read_varint(
+                    serialized_alert, mercury_field.value_start
+                )
+    return updated_at
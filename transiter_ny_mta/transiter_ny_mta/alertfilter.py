@@ -0,0 +1,83 @@
+"""
+Filter of the non-alert entities of a serialized alerts feed, applied before
+decoding.
+
+The MTA alerts feed carries schedule notices, like "Weekend Service", alongside
+the alerts. The header translations of each feed entity's alert are read from the
+wire format, and entities whose alert has a non-alert header are removed from the
+content without being decoded; nothing else of the entity is read. As in the
+messages Transiter builds, only the last header of each language counts.
+"""
+import typing
+
+from transiter_ny_mta import wireformat
+
+DEFAULT_NON_ALERT_HEADERS = ("weekend service", "weekday service")
+
+
+def _normalize_header(header: str) -> str:
+    return header.strip().lower()
+
+
+class NonAlertFilter:
+    """
+    Removes the alerts with a header in non_alert_headers.
+
+    Headers are compared after stripping whitespace and lower casing.
+    """
+
+    def __init__(
+        self, non_alert_headers: typing.Iterable[str] = DEFAULT_NON_ALERT_HEADERS
+    ):
+        self._non_alert_headers = frozenset(
+            _normalize_header(header) for header in non_alert_headers
+        )
+
+    def is_non_alert_header(self, header: str) -> bool:
+        return _normalize_header(header) in self._non_alert_headers
+
+    def is_non_alert(
+        self, translations: typing.Sequence[typing.Tuple[typing.Optional[str], str]]
+    ) -> bool:
+        """
+        Return whether an alert with the (language, text) header translations is a
+        non-alert.
+        """
+        for i, (language, text) in enumerate(translations):
+            if not self.is_non_alert_header(text):
+                continue
+            # A later header in the same language replaces this one in the messages
+            if all(
+                later_language != language
+                for later_language, _ in translations[i + 1 :]
+            ):
+                return True
+        return False
+
+    def filter_content(self, content: bytes) -> typing.Tuple[bytes, int, int]:
+        """
+        Return the content without the non-alert entities.
+
+        The number of entities in the content and the number removed are also
+        returned. If no entities are removed, the content is returned as is.
+        """
+        view = memoryview(content)
+        pieces = []
+        num_entities = 0
+        num_removed = 0
+        for field in wireformat.iter_fields(view):
+            if (
+                field.number == wireformat.FEED_MESSAGE_ENTITY
+                and field.wire_type == wireformat.LENGTH_DELIMITED
+            ):
+                num_entities += 1
+                translations = wireformat.alert_header_translations(
+                    view, field.value_start, field.end
+                )
+                if translations is not None and self.is_non_alert(translations):
+                    num_removed += 1
+                    continue
+            pieces.append(view[field.start : field.end])
+        if num_removed == 0:
+            return content, num_entities, 0
+        return b"".join(pieces), num_entities, num_removed
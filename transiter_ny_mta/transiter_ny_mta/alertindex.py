@@ -0,0 +1,411 @@
+"""
+Index of the active periods of alerts, for finding the alerts active at a time.
+
+The index holds one interval tree of active periods for all of the alerts, and one
+for the alerts of each informed route and stop. Each tree is a centered interval
+tree: every node has a center time and holds the active periods that contain it,
+sorted by start and by end, and the periods entirely before or after the center
+are in its left or right subtree. A query visits one path of the tree and only
+reads the periods it returns, so point and range queries take O(log n + k) time
+for n periods and k results.
+
+Alerts are added and removed without rebuilding the trees: a period is inserted
+at the first node whose center it contains, and new leaves are centered on the
+period. Once a tree has been updated as many times as it had periods when it was
+last built, it is rebuilt to keep it balanced. A tree receiving at least as many
+periods as it holds at once, as when the index is created, is built from scratch.
+
+As in GTFS Realtime, an alert without active periods is always active, and a
+period without a start or end is unbounded on that side. Active periods include
+both their start and their end.
+"""
+import bisect
+import datetime
+import math
+import typing
+
+from transiter import parse
+
+from . import alertcache
+
+# Trees with fewer updates than this since they were built are never rebuilt
+_MIN_UPDATES_BEFORE_REBUILD = 16
+
+
+class AlertIndex:
+    def __init__(self, alerts: typing.Iterable[parse.Alert] = ()):
+        self._all = _IntervalTree()
+        self._route_id_to_tree = {}
+        self._stop_id_to_tree = {}
+        # Alert ID to the alert, its intervals, and the route and stop IDs they were
+        # indexed under
+        self._alert_id_to_entry = {}
+        self._add_all(alerts)
+
+    def __len__(self):
+        return len(self._alert_id_to_entry)
+
+    def __contains__(self, alert_id):
+        return alert_id in self._alert_id_to_entry
+
+    def get(self, alert_id: str) -> typing.Optional[parse.Alert]:
+        entry = self._alert_id_to_entry.get(alert_id)
+        return None if entry is None else entry[0]
+
+    def add(self, alert: parse.Alert) -> None:
+        """
+        Add the alert, replacing the indexed alert with the same ID if any.
+        """
+        self._add_all([alert])
+
+    def _add_all(self, alerts: typing.Iterable[parse.Alert]) -> None:
+        # The intervals are grouped by tree, so that a tree receiving many intervals
+        # is built once instead of receiving them one at a time. The last alert with
+        # each ID wins. The replaced alerts are removed first, so that no tree is
+        # emptied and dropped while intervals are pending.
+        alerts = list({alert.id: alert for alert in alerts}.values())
+        for alert in alerts:
+            self.remove(alert.id)
+        tree_to_intervals = {}
+        for alert in alerts:
+            intervals = [
+                _Interval(start, end, alert) for start, end in _get_time_ranges(alert)
+            ]
+            route_ids = set(alert.route_ids)
+            stop_ids = set(alert.stop_ids)
+            trees = [self._all]
+            for route_id in route_ids:
+                trees.append(_get_or_create(self._route_id_to_tree, route_id))
+            for stop_id in stop_ids:
+                trees.append(_get_or_create(self._stop_id_to_tree, stop_id))
+            for tree in trees:
+                tree_to_intervals.setdefault(tree, []).extend(intervals)
+            self._alert_id_to_entry[alert.id] = (alert, intervals, route_ids, stop_ids)
+        for tree, intervals in tree_to_intervals.items():
+            tree.extend(intervals)
+
+    def remove(self, alert_id: str) -> typing.Optional[parse.Alert]:
+        """
+        Remove the alert with the ID, and return it.
+        """
+        entry = self._alert_id_to_entry.pop(alert_id, None)
+        if entry is None:
+            return None
+        alert, intervals, route_ids, stop_ids = entry
+        for interval in intervals:
+            self._all.remove(interval)
+        for route_id in route_ids:
+            _remove_from(self._route_id_to_tree, route_id, intervals)
+        for stop_id in stop_ids:
+            _remove_from(self._stop_id_to_tree, stop_id, intervals)
+        return alert
+
+    def apply_changes(self, changes: alertcache.AlertChanges) -> None:
+        """
+        Apply the changes returned by the AlertsParser's get_alert_changes method.
+        """
+        for alert in changes.removed:
+            self.remove(alert.id)
+        for alert in changes.added:
+            self.add(alert)
+        for alert in changes.updated:
+            self.add(alert)
+
+    def set_alerts(self, alerts: typing.Iterable[parse.Alert]) -> None:
+        """
+        Replace the indexed alerts with the alerts.
+
+        Alerts that are the same object as the indexed alert with the same ID are
+        not indexed again, so this is cheap for the alerts of the AlertsParser's
+        incremental option.
+        """
+        alert_ids = set()
+        changed_alerts = []
+        for alert in alerts:
+            alert_ids.add(alert.id)
+            entry = self._alert_id_to_entry.get(alert.id)
+            if entry is None or entry[0] is not alert:
+                changed_alerts.append(alert)
+        for alert_id in list(self._alert_id_to_entry):
+            if alert_id not in alert_ids:
+                self.remove(alert_id)
+        self._add_all(changed_alerts)
+
+    def active_at(
+        self, time: datetime.datetime, route_id: str = None, stop_id: str = None
+    ) -> typing.List[parse.Alert]:
+        """
+        Return the alerts active at the time, in no particular order.
+
+        If a route or stop ID is passed, only the alerts informing that route or stop
+        are returned.
+        """
+        tree = self._get_tree(route_id, stop_id)
+        if tree is None:
+            return []
+        timestamp = time.timestamp()
+        return _unique_alerts(tree.overlapping(timestamp, timestamp))
+
+    def active_between(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        route_id: str = None,
+        stop_id: str = None,
+    ) -> typing.List[parse.Alert]:
+        """
+        Return the alerts active at some time between the start and end, in no
+        particular order.
+
+        If a route or stop ID is passed, only the alerts informing that route or stop
+        are returned.
+        """
+        if start > end:
+            raise ValueError("The start is after the end")
+        tree = self._get_tree(route_id, stop_id)
+        if tree is None:
+            return []
+        return _unique_alerts(tree.overlapping(start.timestamp(), end.timestamp()))
+
+    def _get_tree(self, route_id, stop_id) -> typing.Optional["_IntervalTree"]:
+        if route_id is not None and stop_id is not None:
+            raise ValueError("Only one of route_id and stop_id may be passed")
+        if route_id is not None:
+            return self._route_id_to_tree.get(route_id)
+        if stop_id is not None:
+            return self._stop_id_to_tree.get(stop_id)
+        return self._all
+
+
+def is_active_at(alert: parse.Alert, time: datetime.datetime) -> bool:
+    """
+    Return whether the alert is active at the time, by scanning its active periods.
+    """
+    timestamp = time.timestamp()
+    return any(start <= timestamp <= end for start, end in _get_time_ranges(alert))
+
+
+def _get_time_ranges(alert: parse.Alert) -> typing.List[typing.Tuple[float, float]]:
+    if len(alert.active_periods) == 0:
+        return [(-math.inf, math.inf)]
+    return [
+        (
+            -math.inf
+            if active_period.starts_at is None
+            else active_period.starts_at.timestamp(),
+            math.inf
+            if active_period.ends_at is None
+            else active_period.ends_at.timestamp(),
+        )
+        for active_period in alert.active_periods
+    ]
+
+
+def _get_or_create(key_to_tree, key) -> "_IntervalTree":
+    tree = key_to_tree.get(key)
+    if tree is None:
+        tree = key_to_tree[key] = _IntervalTree()
+    return tree
+
+
+def _remove_from(key_to_tree, key, intervals) -> None:
+    tree = key_to_tree[key]
+    for interval in intervals:
+        tree.remove(interval)
+    if len(tree) == 0:
+        del key_to_tree[key]
+
+
+def _unique_alerts(intervals) -> typing.List[parse.Alert]:
+    # An alert with several matching active periods is returned once
+    alert_id_to_alert = {}
+    for interval in intervals:
+        alert_id_to_alert[interval.alert.id] = interval.alert
+    return list(alert_id_to_alert.values())
+
+
+class _Interval(typing.NamedTuple):
+    start: float
+    end: float
+    alert: parse.Alert
+
+
+class _Node:
+
+    __slots__ = ["center", "starts", "by_start", "ends", "by_end", "left", "right"]
+
+    def __init__(self, center: float):
+        self.center = center
+        # The intervals containing the center sorted by start and by end, with
+        # their starts and ends in separate lists for bisecting.
+        self.starts = []
+        self.by_start = []
+        self.ends = []
+        self.by_end = []
+        self.left = None
+        self.right = None
+
+    def add(self, interval: _Interval) -> None:
+        i = bisect.bisect_right(self.starts, interval.start)
+        self.starts.insert(i, interval.start)
+        self.by_start.insert(i, interval)
+        i = bisect.bisect_right(self.ends, interval.end)
+        self.ends.insert(i, interval.end)
+        self.by_end.insert(i, interval)
+
+    def discard(self, interval: _Interval) -> bool:
+        i = _index(self.starts, self.by_start, interval.start, interval)
+        if i is None:
+            return False
+        del self.starts[i]
+        del self.by_start[i]
+        i = _index(self.ends, self.by_end, interval.end, interval)
+        del self.ends[i]
+        del self.by_end[i]
+        return True
+
+
+def _index(keys, intervals, key, interval) -> typing.Optional[int]:
+    for i in range(bisect.bisect_left(keys, key), bisect.bisect_right(keys, key)):
+        if intervals[i] is interval:
+            return i
+    return None
+
+
+class _IntervalTree:
+    def __init__(self):
+        self._root = None
+        self._size = 0
+        self._updates = 0
+        self._max_updates = _MIN_UPDATES_BEFORE_REBUILD
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, interval: _Interval) -> None:
+        self._size += 1
+        self._count_update()
+        if self._root is None:
+            self._root = _Node(_center(interval))
+            self._root.add(interval)
+            return
+        node = self._root
+        while True:
+            if interval.end < node.center:
+                if node.left is None:
+                    node.left = _Node(_center(interval))
+                node = node.left
+            elif interval.start > node.center:
+                if node.right is None:
+                    node.right = _Node(_center(interval))
+                node = node.right
+            else:
+                node.add(interval)
+                return
+
+    def extend(self, intervals: typing.List[_Interval]) -> None:
+        if len(intervals) < self._size:
+            for interval in intervals:
+                self.insert(interval)
+            return
+        self._root = _build(list(self.overlapping(-math.inf, math.inf)) + intervals)
+        self._size += len(intervals)
+        self._updates = 0
+        self._max_updates = max(self._size, _MIN_UPDATES_BEFORE_REBUILD)
+
+    def remove(self, interval: _Interval) -> None:
+        node = self._root
+        while node is not None:
+            if interval.end < node.center:
+                node = node.left
+            elif interval.start > node.center:
+                node = node.right
+            else:
+                break
+        if node is None or not node.discard(interval):
+            raise KeyError(interval)
+        self._size -= 1
+        # Empty nodes are removed when the tree is rebuilt
+        self._count_update()
+
+    def _count_update(self) -> None:
+        self._updates += 1
+        if self._updates > self._max_updates:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._root = _build(list(self.overlapping(-math.inf, math.inf)))
+        self._updates = 0
+        self._max_updates = max(self._size, _MIN_UPDATES_BEFORE_REBUILD)
+
+    def overlapping(self, start: float, end: float) -> typing.Iterator[_Interval]:
+        """
+        Return the intervals overlapping the closed interval from start to end.
+        """
+        nodes = [self._root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if node is None:
+                continue
+            if end < node.center:
+                # Every interval of the node ends at or after the center
+                by_start = node.by_start
+                for i in range(bisect.bisect_right(node.starts, end)):
+                    yield by_start[i]
+                nodes.append(node.left)
+            elif start > node.center:
+                # Every interval of the node starts at or before the center
+                by_end = node.by_end
+                for i in range(bisect.bisect_left(node.ends, start), len(by_end)):
+                    yield by_end[i]
+                nodes.append(node.right)
+            else:
+                yield from node.by_start
+                nodes.append(node.left)
+                nodes.append(node.right)
+
+
+def _center(interval: _Interval) -> float:
+    if interval.start != -math.inf:
+        return interval.start
+    if interval.end != math.inf:
+        return interval.end
+    return 0.0
+
+
+def _get_start(interval: _Interval) -> float:
+    return interval.start
+
+
+def _get_end(interval: _Interval) -> float:
+    return interval.end
+
+
+def _build(intervals: typing.List[_Interval]) -> typing.Optional[_Node]:
+    if len(intervals) == 0:
+        return None
+    # The median endpoint is contained in the interval it is an endpoint of, so
+    # every node holds at least one interval. This holds for infinite endpoints too.
+    endpoints = sorted(
+        endpoint
+        for interval in intervals
+        for endpoint in (interval.start, interval.end)
+    )
+    node = _Node(endpoints[len(endpoints) // 2])
+    left = []
+    right = []
+    contained = []
+    for interval in intervals:
+        if interval.end < node.center:
+            left.append(interval)
+        elif interval.start > node.center:
+            right.append(interval)
+        else:
+            contained.append(interval)
+    node.by_start = sorted(contained, key=_get_start)
+    node.starts = [interval.start for interval in node.by_start]
+    node.by_end = sorted(contained, key=_get_end)
+    node.ends = [interval.end for interval in node.by_end]
+    node.left = _build(left)
+    node.right = _build(right)
+    return node
@@ -1,10 +1,40 @@
+import datetime
 import enum
+import functools
 import os
+import typing
 
+from transiter import parse
 from transiter.parse import Alert
 from transiter.parse import gtfsrealtime
 
+from . import alertcache
+from . import alertfilter
+from . import contentcache
+from . import instrumentation
+from .instrumentation import Stage
 from .proto import alerts_pb2 as gtfs_rt_pb2
+from .proto import extensions
+from . import wireformat
+from .proto.extensions import FieldCopy
+
+# Setting this to true keeps the non-alerts; the keep_non_alerts option overrides it
+KEEP_NON_ALERTS_ENV_VARIABLE = "TRANSITER_NY_MTA_KEEP_NON_ALERTS"
+
+
+class Engine(enum.Enum):
+    """
+    The engine used to convert the decoded feed into Transiter alerts.
+
+    The default engine moves the Mercury extension data into the GTFS Realtime
+    message and then relies on Transiter's GTFS Realtime parser. The fused engine
+    reads the Mercury extensions directly and builds the final alerts in a single
+    traversal of the feed, without writing to the decoded message. With both
+    engines the non-alerts are removed before the feed is decoded.
+    """
+
+    DEFAULT = "default"
+    FUSED = "fused"
 
 
 class NyctBusPriority(enum.Enum):
@@ -49,34 +79,208 @@ priority_to_effect = {
 }
 
 
+_EXTENSIONS = extensions.PackageExtensions(gtfs_rt_pb2)
+_mercury_entity_selector = _EXTENSIONS.accessor(
+    gtfs_rt_pb2.EntitySelector, gtfs_rt_pb2.MTA_EXTENSION_ID
+)
+_mercury_alert = _EXTENSIONS.accessor(gtfs_rt_pb2.Alert, gtfs_rt_pb2.MTA_EXTENSION_ID)
+_transiter_alert = _EXTENSIONS.accessor(
+    gtfs_rt_pb2.Alert, gtfsrealtime.TRANSITER_EXTENSION_ID
+)
+_copy_mercury_timestamps = _EXTENSIONS.compile_copies(
+    gtfs_rt_pb2.Alert,
+    [
+        FieldCopy(
+            gtfs_rt_pb2.MTA_EXTENSION_ID,
+            field_name,
+            gtfsrealtime.TRANSITER_EXTENSION_ID,
+            field_name,
+        )
+        for field_name in ["created_at", "updated_at"]
+    ],
+)
+
+
 class AlertsParser(gtfsrealtime.GtfsRealtimeParser):
 
     GTFS_REALTIME_PB2_MODULE = gtfs_rt_pb2
 
+    def __init__(self):
+        super().__init__()
+        self._engine = Engine.DEFAULT
+        self._feed_id = None
+        self._recorder = None
+        self._content_cache = None
+        self._keep_non_alerts = os.environ.get(KEEP_NON_ALERTS_ENV_VARIABLE) == "true"
+        self._non_alert_filter = alertfilter.NonAlertFilter()
+        self._alert_cache = None
+        self._undecoded_content = None
+        self._serialized_header = None
+        self._alert_cache_alerts = None
+        self._alert_changes = None
+
+    def load_options(self, options_blob: typing.Optional[dict]) -> None:
+        if options_blob is None:
+            return
+        # Options that are absent keep their current values
+        self._engine = Engine(options_blob.get("engine", self._engine.value))
+        self._feed_id = options_blob.get("feed_id", self._feed_id)
+        if options_blob.get("content_cache", False):
+            self._content_cache = contentcache.ContentCache()
+        keep_non_alerts = options_blob.get("keep_non_alerts")
+        if keep_non_alerts is not None:
+            self._keep_non_alerts = bool(keep_non_alerts)
+        non_alert_headers = options_blob.get("non_alert_headers")
+        if non_alert_headers is not None:
+            self._non_alert_filter = alertfilter.NonAlertFilter(non_alert_headers)
+        if options_blob.get("incremental", False):
+            self._alert_cache = alertcache.AlertCache(_build_alert_from_string)
+
+    @property
+    def content_cache(self) -> typing.Optional[contentcache.ContentCache]:
+        return self._content_cache
+
+    @property
+    def alert_cache(self) -> typing.Optional[alertcache.AlertCache]:
+        return self._alert_cache
+
+    def load_content(self, content: bytes) -> None:
+        if self._content_cache is not None and self._content_cache.check(content):
+            if self._alert_cache is not None:
+                self._alert_changes = alertcache.AlertChanges()
+            return
+        self._load_content(content)
+        if self._content_cache is not None:
+            self._content_cache.commit()
+
+    def _load_content(self, content: bytes) -> None:
+        self._recorder = instrumentation.recorder(type(self).__name__, self._feed_id)
+        if not self._keep_non_alerts:
+            content = self._filter_non_alerts(content)
+        if self._alert_cache is not None:
+            if self._recorder is not None:
+                self._load_content_with_alert_cache_instrumented(content)
+                return
+            self._load_content_with_alert_cache(content)
+            return
+        self._decode(content)
+
+    def _decode(self, content: bytes) -> None:
+        if self._recorder is not None:
+            self._load_content_instrumented(content)
+            return
+        if self._engine is Engine.DEFAULT:
+            super().load_content(content)
+            return
+        self._gtfs_feed_message = gtfs_rt_pb2.FeedMessage()
+        self._gtfs_feed_message.ParseFromString(content)
+
+    def _filter_non_alerts(self, content: bytes) -> bytes:
+        if self._recorder is None:
+            content, _, _ = self._non_alert_filter.filter_content(content)
+            return content
+        with self._recorder.stage(Stage.FILTER) as counts:
+            content, num_entities, num_removed = self._non_alert_filter.filter_content(
+                content
+            )
+            counts[instrumentation.ENTITIES] = num_entities
+            counts[instrumentation.ALERTS_DROPPED] = num_removed
+        return content
+
+    def _load_content_instrumented(self, content: bytes) -> None:
+        with self._recorder.stage(Stage.DECODE) as counts:
+            self._gtfs_feed_message = gtfs_rt_pb2.FeedMessage()
+            self._gtfs_feed_message.ParseFromString(content)
+            counts[instrumentation.BYTES] = len(content)
+            counts[instrumentation.ENTITIES] = len(self._gtfs_feed_message.entity)
+        if self._engine is Engine.DEFAULT:
+            with self._recorder.stage(Stage.MOVE_EXTENSIONS):
+                self.post_process_feed_message(self._gtfs_feed_message)
+
+    def _load_content_with_alert_cache_instrumented(self, content: bytes) -> None:
+        stats = self._alert_cache.stats
+        hits = stats.hits
+        misses = stats.misses
+        with self._recorder.stage(Stage.CONVERT) as counts:
+            self._load_content_with_alert_cache(content)
+            counts[instrumentation.BYTES] = len(content)
+            counts[instrumentation.ENTITIES] = stats.hits - hits + stats.misses - misses
+            counts[instrumentation.ENTITY_CACHE_HITS] = stats.hits - hits
+            counts[instrumentation.ENTITY_CACHE_MISSES] = stats.misses - misses
+            counts[instrumentation.ALERTS] = len(self._alert_cache_alerts)
+            counts[instrumentation.ALERTS_ADDED] = len(self._alert_changes.added)
+            counts[instrumentation.ALERTS_UPDATED] = len(self._alert_changes.updated)
+            counts[instrumentation.ALERTS_REMOVED] = len(self._alert_changes.removed)
+
+    def _load_content_with_alert_cache(self, content: bytes) -> None:
+        # Only the alerts that are new or whose update time changed are decoded,
+        # and they are converted using the fused engine. The full message is only
+        # decoded if it is needed by one of the other methods.
+        header, serialized_entities = wireformat.split_feed_message(content)
+        alerts, changes = self._alert_cache.load(serialized_entities)
+        self._gtfs_feed_message = None
+        self._undecoded_content = content
+        self._serialized_header = header
+        self._alert_cache_alerts = alerts
+        self._alert_changes = changes
+
+    def _decode_if_needed(self) -> None:
+        if self._gtfs_feed_message is None and self._undecoded_content is not None:
+            self._decode(self._undecoded_content)
+
+    def get_timestamp(self) -> typing.Optional[datetime.datetime]:
+        if self._gtfs_feed_message is None and self._serialized_header is not None:
+            header = gtfs_rt_pb2.FeedHeader.FromString(bytes(self._serialized_header))
+            return gtfsrealtime._timestamp_to_datetime(header.timestamp)
+        return super().get_timestamp()
+
+    def get_alert_changes(self) -> alertcache.AlertChanges:
+        """
+        Return the alerts added, updated and removed by the last load_content call.
+
+        This requires the incremental option. Loading the same content again gives
+        no changes.
+        """
+        if self._alert_cache is None:
+            raise ValueError("Alert changes require the incremental option")
+        if self._alert_changes is None:
+            raise ValueError("No content has been loaded")
+        return self._alert_changes
+
     def get_alerts(self):
-        for alert in super().get_alerts():
-            if _should_skip_alert(alert):
-                continue
-            yield alert
+        if self._content_cache is not None:
+            return iter(self._content_cache.get("alerts", self._get_alerts))
+        return self._get_alerts()
 
-    @staticmethod
-    def post_process_feed_message(feed_message):
-        _move_data_between_extensions(feed_message)
+    def _get_alerts(self):
+        if self._recorder is not None:
+            yield from self._get_alerts_instrumented()
+            return
+        yield from self._convert()
 
+    def _get_alerts_instrumented(self):
+        # For the alert cache, the alerts are built and recorded in load_content
+        if self._alert_cache is not None:
+            return self._alert_cache_alerts
+        with self._recorder.stage(Stage.CONVERT) as counts:
+            alerts = list(self._convert())
+            counts[instrumentation.ALERTS] = len(alerts)
+        return alerts
 
-_NON_ALERT_HEADERS = {
-    "weekend service",
-    "weekday service",
-}
+    def _convert(self):
+        if self._alert_cache is not None:
+            return self._alert_cache_alerts
+        if self._engine is Engine.FUSED:
+            return _parse_alerts_fused(self._gtfs_feed_message)
+        return super().get_alerts()
 
+    def print(self):
+        self._decode_if_needed()
+        super().print()
 
-def _should_skip_alert(alert) -> bool:
-    if os.environ.get("TRANSITER_NY_MTA_KEEP_NON_ALERTS") == "true":
-        return False
-    for message in alert.messages:
-        if message.header.strip().lower() in _NON_ALERT_HEADERS:
-            return True
-    return False
+    @staticmethod
+    def post_process_feed_message(feed_message):
+        _move_data_between_extensions(feed_message)
 
 
 def _move_data_between_extensions(feed_message):
@@ -84,27 +288,12 @@ def _move_data_between_extensions(feed_message):
         if not entity.HasField("alert"):
             continue
         alert = entity.alert
-        mta_ext_key = alert._extensions_by_number[gtfs_rt_pb2.MTA_EXTENSION_ID]
-        transiter_ext_key = alert._extensions_by_number[
-            gtfsrealtime.TRANSITER_EXTENSION_ID
-        ]
-        if alert.Extensions[mta_ext_key].HasField("created_at"):
-            alert.Extensions[transiter_ext_key].created_at = alert.Extensions[
-                mta_ext_key
-            ].created_at
-        if alert.Extensions[mta_ext_key].HasField("updated_at"):
-            alert.Extensions[transiter_ext_key].updated_at = alert.Extensions[
-                mta_ext_key
-            ].updated_at
+        _copy_mercury_timestamps(alert)
 
         if len(alert.informed_entity) == 0:
             alert.effect = Alert.Effect.MODIFIED_SERVICE.value
             continue
-        informed_entity = alert.informed_entity[0]
-        mta_ext_key = informed_entity._extensions_by_number[
-            gtfs_rt_pb2.MTA_EXTENSION_ID
-        ]
-        sort_order = informed_entity.Extensions[mta_ext_key].sort_order
+        sort_order = _mercury_entity_selector(alert.informed_entity[0]).sort_order
         priority_val_string = sort_order[sort_order.rfind(":") + 1 :]
         priority = _convert_priority_val_string_to_priority(priority_val_string)
         alert.cause = priority_to_cause.get(priority, Alert.Cause.UNKNOWN_CAUSE).value
@@ -113,6 +302,102 @@ def _move_data_between_extensions(feed_message):
         ).value
 
 
+def _parse_alerts_fused(feed_message):
+    for entity in feed_message.entity:
+        if not entity.HasField("alert"):
+            continue
+        yield _build_alert_fused(entity.id, entity.alert)
+
+
+def _build_alert_fused(alert_id, alert) -> parse.Alert:
+    # This follows Transiter's GTFS Realtime alert parser, reading the Mercury data
+    # that _move_data_between_extensions would copy into the message.
+    informed_entities = alert.informed_entity
+    if len(informed_entities) == 0:
+        cause = Alert.Cause(alert.cause)
+        effect = Alert.Effect.MODIFIED_SERVICE
+    else:
+        cause, effect = _get_cause_and_effect(
+            _mercury_entity_selector(informed_entities[0]).sort_order
+        )
+    mercury_alert = _mercury_alert(alert)
+    transiter_alert = _transiter_alert(alert)
+    created_at = (
+        mercury_alert.created_at
+        if mercury_alert.HasField("created_at")
+        else transiter_alert.created_at
+    )
+    updated_at = (
+        mercury_alert.updated_at
+        if mercury_alert.HasField("updated_at")
+        else transiter_alert.updated_at
+    )
+    parsed_alert = parse.Alert(
+        id=alert_id,
+        cause=cause,
+        effect=effect,
+        created_at=gtfsrealtime._timestamp_to_datetime(created_at),
+        updated_at=gtfsrealtime._timestamp_to_datetime(updated_at),
+        sort_order=transiter_alert.sort_order
+        if transiter_alert.HasField("sort_order")
+        else None,
+        messages=_build_messages_fused(alert),
+        active_periods=[
+            parse.AlertActivePeriod(
+                starts_at=gtfsrealtime._timestamp_to_datetime(active_period.start),
+                ends_at=gtfsrealtime._timestamp_to_datetime(active_period.end),
+            )
+            for active_period in alert.active_period
+        ],
+    )
+    gtfsrealtime.attach_informed_entities(alert, parsed_alert)
+    return parsed_alert
+
+
+def _build_alert_from_string(alert_id, serialized_alert: bytes) -> parse.Alert:
+    return _build_alert_fused(alert_id, gtfs_rt_pb2.Alert.FromString(serialized_alert))
+
+
+def _build_messages_fused(alert) -> typing.List[parse.AlertMessage]:
+    language_to_message = {}
+
+    def get_message(translation):
+        language = _get_language(translation)
+        message = language_to_message.get(language)
+        if message is None:
+            message = language_to_message[language] = parse.AlertMessage(
+                header="", description="", language=language
+            )
+        return message
+
+    for translation in alert.header_text.translation:
+        get_message(translation).header = translation.text
+    for translation in alert.description_text.translation:
+        get_message(translation).description = translation.text
+    for translation in alert.url.translation:
+        get_message(translation).url = translation.text
+    return list(language_to_message.values())
+
+
+def _get_language(translation) -> typing.Optional[str]:
+    if translation.HasField("language"):
+        return translation.language
+    return None
+
+
+# The feed uses few distinct sort orders, but they are read from the feed, so the
+# cache is bounded
+@functools.lru_cache(maxsize=1024)
+def _get_cause_and_effect(sort_order: str):
+    priority = _convert_priority_val_string_to_priority(
+        sort_order[sort_order.rfind(":") + 1 :]
+    )
+    return (
+        priority_to_cause.get(priority, Alert.Cause.UNKNOWN_CAUSE),
+        priority_to_effect.get(priority, Alert.Effect.MODIFIED_SERVICE),
+    )
+
+
 def _convert_priority_val_string_to_priority(
     priority_val_string: str,
 ) -> NyctBusPriority:
@@ -0,0 +1,525 @@
+"""
+An append-only archive of raw feed payloads, and a memory-mapped reader for it.
+
+The archive file starts with a magic number and is followed by one record per
+payload:
+
+    header:  timestamp (float64), stored length (uint32), length (uint32),
+             compression (uint8), feed ID length (uint16)
+    feed ID: UTF-8
+    payload: the payload, compressed using zlib or lzma if the compression is set
+
+All integers are little endian. Next to the archive, the writer appends one entry
+per record to an index file (the archive path with .index appended) holding the
+record's timestamp, offset and feed ID. A record is only indexed after it has been
+written, so if the writer is interrupted the index may miss the last records (they
+are found by scanning the archive from the last indexed record) and the archive
+may end with a partial record (which is ignored). When a writer opens an existing
+archive it indexes such records and truncates a partial record or index entry, so
+that the records it appends are found.
+
+The reader memory maps the archive and loads the index into sorted arrays per feed,
+so that finding the records of a feed at or around a time is a binary search.
+Uncompressed payloads are returned as memoryviews of the mapped file, without
+copying them, and can be passed straight to a parser's load_content; compressed
+payloads are decompressed into new bytes objects. Memoryviews of payloads must be
+released before the reader is closed.
+
+Usage:
+
+    python -m transiter_ny_mta.archive record feeds.archive --api-key KEY
+    python -m transiter_ny_mta.archive info feeds.archive
+"""
+import argparse
+import asyncio
+import bisect
+import dataclasses
+import lzma
+import mmap
+import os
+import struct
+import sys
+import time
+import typing
+import zlib
+
+MAGIC = b"TNMARCH1"
+INDEX_MAGIC = b"TNMINDX1"
+INDEX_SUFFIX = ".index"
+
+NONE = "none"
+ZLIB = "zlib"
+LZMA = "lzma"
+_COMPRESSION_TO_CODE = {NONE: 0, ZLIB: 1, LZMA: 2}
+_CODE_TO_COMPRESSION = {code: name for name, code in _COMPRESSION_TO_CODE.items()}
+
+_RECORD_HEADER = struct.Struct("<dIIBH")
+_INDEX_ENTRY_HEADER = struct.Struct("<dQH")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class Record:
+    feed_id: str
+    timestamp: float
+    # A memoryview of the mapped archive if the payload is not compressed
+    payload: typing.Union[memoryview, bytes]
+
+
+class ArchiveWriter:
+    def __init__(
+        self, path: str, compression: str = NONE, level: typing.Optional[int] = None
+    ):
+        if compression not in _COMPRESSION_TO_CODE:
+            raise ValueError(f"Unknown compression {compression}")
+        self._compression = compression
+        self._level = level
+        unindexed_entries = _recover(path)
+        self._file = open(path, "ab")
+        self._index_file = open(path + INDEX_SUFFIX, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        if self._index_file.tell() == 0:
+            self._index_file.write(INDEX_MAGIC)
+        for timestamp, offset, feed_id in unindexed_entries:
+            _write_index_entry(
+                self._index_file, timestamp, offset, feed_id.encode("utf-8")
+            )
+        self._index_file.flush()
+
+    def append(self, feed_id: str, timestamp: float, payload) -> None:
+        """
+        Append a payload of the feed fetched at the timestamp (a Unix time).
+        """
+        payload = bytes(payload)
+        stored_payload = _compress(payload, self._compression, self._level)
+        encoded_feed_id = feed_id.encode("utf-8")
+        offset = self._file.tell()
+        self._file.write(
+            _RECORD_HEADER.pack(
+                timestamp,
+                len(stored_payload),
+                len(payload),
+                _COMPRESSION_TO_CODE[self._compression],
+                len(encoded_feed_id),
+            )
+        )
+        self._file.write(encoded_feed_id)
+        self._file.write(stored_payload)
+        self._file.flush()
+        _write_index_entry(self._index_file, timestamp, offset, encoded_feed_id)
+        self._index_file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _FeedIndex:
+    def __init__(self):
+        self.timestamps = []
+        self.offsets = []
+
+
+class ArchiveReader:
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < len(MAGIC):
+                raise ArchiveError(f"{path} is not an archive")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        self._view = memoryview(self._mmap)
+        try:
+            self._load_index(path, size)
+        except BaseException:
+            self.close()
+            raise
+
+    def _load_index(self, path: str, size: int) -> None:
+        if self._view[: len(MAGIC)] != MAGIC:
+            raise ArchiveError(f"{path} is not an archive")
+        entries, _ = _read_index(path + INDEX_SUFFIX, size)
+        entries.extend(_scan_unindexed(self._view, entries)[0])
+        self._feed_id_to_index = {}
+        # The index of all feeds, as (timestamp, offset) pairs
+        self._all = []
+        for timestamp, offset, feed_id in entries:
+            feed_index = self._feed_id_to_index.get(feed_id)
+            if feed_index is None:
+                feed_index = self._feed_id_to_index[feed_id] = _FeedIndex()
+            feed_index.timestamps.append(timestamp)
+            feed_index.offsets.append(offset)
+            self._all.append((timestamp, offset))
+        for feed_index in self._feed_id_to_index.values():
+            if feed_index.timestamps != sorted(feed_index.timestamps):
+                pairs = sorted(zip(feed_index.timestamps, feed_index.offsets))
+                feed_index.timestamps = [timestamp for timestamp, _ in pairs]
+                feed_index.offsets = [offset for _, offset in pairs]
+        self._all.sort()
+        self._all_timestamps = [timestamp for timestamp, _ in self._all]
+        self._all_offsets = [offset for _, offset in self._all]
+
+    def __len__(self):
+        return len(self._all)
+
+    def num_records(self, feed_id: typing.Optional[str] = None) -> int:
+        return len(self._timestamps(feed_id))
+
+    def feed_ids(self) -> typing.List[str]:
+        return sorted(self._feed_id_to_index.keys())
+
+    def time_range(
+        self, feed_id: typing.Optional[str] = None
+    ) -> typing.Optional[typing.Tuple[float, float]]:
+        timestamps = self._timestamps(feed_id)
+        if len(timestamps) == 0:
+            return None
+        return timestamps[0], timestamps[-1]
+
+    def timestamps(self, feed_id: typing.Optional[str] = None) -> typing.List[float]:
+        """
+        Return the timestamps of the records of the feed, or all feeds, in order.
+
+        The timestamps are read from the index, without reading the records.
+        """
+        return list(self._timestamps(feed_id))
+
+    def records(
+        self,
+        feed_id: typing.Optional[str] = None,
+        start: typing.Optional[float] = None,
+        end: typing.Optional[float] = None,
+    ) -> typing.Iterator[Record]:
+        """
+        Iterate over the records of the feed, or all feeds, in timestamp order.
+
+        If given, only records with start <= timestamp < end are returned.
+        """
+        timestamps = self._timestamps(feed_id)
+        offsets = self._offsets(feed_id)
+        first = 0 if start is None else bisect.bisect_left(timestamps, start)
+        last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+        for i in range(first, last):
+            yield self._read_record(offsets[i])
+
+    def at(self, feed_id: str, timestamp: float) -> typing.Optional[Record]:
+        """
+        Return the last record of the feed at or before the timestamp.
+        """
+        feed_index = self._feed_id_to_index.get(feed_id)
+        if feed_index is None:
+            return None
+        i = bisect.bisect_right(feed_index.timestamps, timestamp) - 1
+        if i < 0:
+            return None
+        return self._read_record(feed_index.offsets[i])
+
+    def close(self) -> None:
+        """
+        Close the archive.
+
+        If memoryviews of payloads are still referenced, BufferError is not raised:
+        the archive stays mapped until they and the reader are garbage collected.
+        """
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _timestamps(self, feed_id):
+        if feed_id is None:
+            return self._all_timestamps
+        feed_index = self._feed_id_to_index.get(feed_id)
+        return [] if feed_index is None else feed_index.timestamps
+
+    def _offsets(self, feed_id):
+        if feed_id is None:
+            return self._all_offsets
+        feed_index = self._feed_id_to_index.get(feed_id)
+        return [] if feed_index is None else feed_index.offsets
+
+    def _read_record(self, offset) -> Record:
+        (
+            timestamp,
+            compression,
+            length,
+            header_end,
+            payload_start,
+            payload_end,
+        ) = _read_header(self._view, offset)
+        payload = self._view[payload_start:payload_end]
+        compression = _CODE_TO_COMPRESSION.get(compression)
+        if compression is None:
+            raise ArchiveError(f"Unknown compression in record at {offset}")
+        if compression != NONE:
+            payload = _decompress(payload, compression)
+            if len(payload) != length:
+                raise ArchiveError(f"Corrupt payload in record at {offset}")
+        return Record(
+            feed_id=str(self._view[header_end:payload_start], "utf-8"),
+            timestamp=timestamp,
+            payload=payload,
+        )
+
+
+def _read_header(view, offset):
+    """
+    Return the record header at the offset, or None if the record is partial.
+    """
+    header_end = offset + _RECORD_HEADER.size
+    if header_end > len(view):
+        return None
+    (
+        timestamp,
+        stored_length,
+        length,
+        compression,
+        feed_id_length,
+    ) = _RECORD_HEADER.unpack_from(view, offset)
+    payload_start = header_end + feed_id_length
+    payload_end = payload_start + stored_length
+    if payload_end > len(view):
+        return None
+    return (
+        timestamp,
+        compression,
+        length,
+        header_end,
+        payload_start,
+        payload_end,
+    )
+
+
+def _scan_unindexed(view, entries):
+    """
+    Return the entries of the complete records after the indexed ones, and the end
+    of the last complete record.
+    """
+    if len(entries) > 0:
+        header = _read_header(view, entries[-1][1])
+        if header is None:
+            raise ArchiveError("The index references a partial record")
+        offset = header[-1]
+    else:
+        offset = len(MAGIC)
+    unindexed_entries = []
+    while True:
+        header = _read_header(view, offset)
+        if header is None:
+            return unindexed_entries, offset
+        timestamp, _, _, header_end, payload_start, payload_end = header
+        feed_id = str(view[header_end:payload_start], "utf-8")
+        unindexed_entries.append((timestamp, offset, feed_id))
+        offset = payload_end
+
+
+def _read_index(index_path, archive_size):
+    """
+    Return the entries of the index that reference complete records, and the end of
+    the last of them in the index file.
+    """
+    try:
+        with open(index_path, "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return [], 0
+    if content[: len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return [], 0
+    entries = []
+    position = len(INDEX_MAGIC)
+    while position + _INDEX_ENTRY_HEADER.size <= len(content):
+        timestamp, offset, feed_id_length = _INDEX_ENTRY_HEADER.unpack_from(
+            content, position
+        )
+        feed_id_start = position + _INDEX_ENTRY_HEADER.size
+        if feed_id_start + feed_id_length > len(content) or offset >= archive_size:
+            break
+        entries.append(
+            (
+                timestamp,
+                offset,
+                content[feed_id_start : feed_id_start + feed_id_length].decode(),
+            )
+        )
+        position = feed_id_start + feed_id_length
+    return entries, position
+
+
+def _write_index_entry(index_file, timestamp, offset, encoded_feed_id):
+    index_file.write(_INDEX_ENTRY_HEADER.pack(timestamp, offset, len(encoded_feed_id)))
+    index_file.write(encoded_feed_id)
+
+
+def _recover(path):
+    """
+    Prepare an existing archive for appending after the writer was interrupted.
+
+    A partial record at the end of the archive and anything in the index after its
+    last valid entry are truncated. The entries of the records that are not indexed
+    are returned, to be appended to the index.
+    """
+    index_path = path + INDEX_SUFFIX
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return []
+    if size < len(MAGIC):
+        # Interrupted while writing the magic number
+        _truncate(path, 0)
+        _truncate(index_path, 0)
+        return []
+    entries, index_end = _read_index(index_path, size)
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        view = memoryview(mapped)
+        try:
+            if view[: len(MAGIC)] != MAGIC:
+                raise ArchiveError(f"{path} is not an archive")
+            unindexed_entries, end = _scan_unindexed(view, entries)
+        finally:
+            view.release()
+    _truncate(path, end)
+    _truncate(index_path, index_end)
+    return unindexed_entries
+
+
+def _truncate(path, size):
+    try:
+        if os.path.getsize(path) > size:
+            os.truncate(path, size)
+    except FileNotFoundError:
+        pass
+
+
+def _compress(payload: bytes, compression: str, level: typing.Optional[int]):
+    if compression == ZLIB:
+        return zlib.compress(payload, -1 if level is None else level)
+    if compression == LZMA:
+        return lzma.compress(payload, preset=level)
+    return payload
+
+
+def _decompress(payload, compression: str) -> bytes:
+    if compression == ZLIB:
+        return zlib.decompress(payload)
+    return lzma.decompress(payload)
+
+
+async def record(
+    writer: ArchiveWriter,
+    requests,
+    interval: float,
+    duration: typing.Optional[float] = None,
+    feed_fetcher=None,
+) -> int:
+    """
+    Poll the feeds every interval seconds and append the payloads that changed.
+
+    Returns the number of payloads appended. Runs until the duration has passed,
+    or forever if it is None.
+    """
+    from transiter_ny_mta import fetcher
+
+    if feed_fetcher is None:
+        feed_fetcher = fetcher.Fetcher()
+    requests = list(requests)
+    num_appended = 0
+    start = time.monotonic()
+    try:
+        while duration is None or time.monotonic() - start < duration:
+            poll_start = time.monotonic()
+            feed_id_to_result = await feed_fetcher.fetch_all(requests)
+            timestamp = time.time()
+            for feed_id, result in feed_id_to_result.items():
+                if result.content is not None:
+                    writer.append(feed_id, timestamp, result.content)
+                    num_appended += 1
+                elif result.error is not None:
+                    print(f"{feed_id}: {result.error}", file=sys.stderr)
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - poll_start)))
+    finally:
+        await feed_fetcher.close()
+    return num_appended
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.archive",
+        description="Record feed payloads into an archive, or describe an archive.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser(
+        "record", help="poll the subway feeds and append their payloads"
+    )
+    record_parser.add_argument("path")
+    record_parser.add_argument("--api-key")
+    record_parser.add_argument(
+        "--base-url", help="base URL of the MTA API, for example of a stand-in server"
+    )
+    record_parser.add_argument("--interval", type=float, default=5)
+    record_parser.add_argument(
+        "--duration", type=float, help="in seconds; defaults to running forever"
+    )
+    record_parser.add_argument(
+        "--compression",
+        choices=list(_COMPRESSION_TO_CODE),
+        default=NONE,
+        help="compression of the payloads; compressed payloads are copied when "
+        "they are read, instead of being read from the mapped archive",
+    )
+    info_parser = subparsers.add_parser("info", help="describe the archive")
+    info_parser.add_argument("path")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        from transiter_ny_mta import fetcher
+
+        requests = (
+            fetcher.subway_feed_requests(args.api_key)
+            if args.base_url is None
+            else fetcher.subway_feed_requests(args.api_key, args.base_url)
+        )
+        with ArchiveWriter(args.path, args.compression) as writer:
+            try:
+                num_appended = asyncio.run(
+                    record(writer, requests, args.interval, args.duration)
+                )
+            except KeyboardInterrupt:
+                return 0
+        print(f"Appended {num_appended} payloads")
+        return 0
+    with ArchiveReader(args.path) as reader:
+        print("{:<24} {:>9} {:>12} {:>12}".format("feed", "records", "first", "last"))
+        for feed_id in reader.feed_ids():
+            first, last = reader.time_range(feed_id)
+            print(
+                "{:<24} {:>9} {:>12.0f} {:>12.0f}".format(
+                    feed_id, reader.num_records(feed_id), first, last
+                )
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1161 @@
+"""
+Benchmarks of each stage of the parsers in this package.
+
+The benchmarks run on synthetic feeds (see the syntheticfeeds module) at several
+sizes, given as multiples of the size of the real feed. Each benchmark times one
+stage of a parser: for example, decoding the protobuf, the post processing of the
+decoded feed message, the conversion of the message to Transiter types, or one of
+the fixups applied to the converted trips. Stages that mutate their input are given
+a fresh input for each iteration, which is built outside of the timed region.
+
+For each benchmark and size the results contain the throughput in entities per
+second (based on the median latency), latency percentiles, and the peak memory
+allocated by one run of the stage as measured by tracemalloc. The suite can be run
+several times; the median latency is then the median of the medians of each run,
+and is reported with a confidence interval.
+
+The alertindex benchmarks compare queries of the alert index with a scan of the
+alerts. As the index is meant for much larger sets of alerts than the real feed,
+they are always run at 1,000 and 10,000 alerts.
+
+The compare command is a regression gate: it runs the benchmarks in a baseline
+results file and fails if the median latency of any of them is, with confidence,
+more than a threshold above the baseline. To compare results from different
+machines, every report contains the median latency of a reference benchmark of
+pure Python code, and the baseline latencies are scaled by the ratio of the
+reference latencies. The relative speed of the benchmarks depends on the Python
+version and the protobuf backend, so the comparison is skipped if these differ
+from the baseline's.
+
+The matrix command runs the subway trips and alerts benchmarks under each of the
+available protobuf backends (see transiter_ny_mta.proto), each in its own process,
+and reports the throughput of each benchmark under each backend.
+
+Usage:
+
+    python -m transiter_ny_mta.benchmark run --runs 5 --output results.json
+    python -m transiter_ny_mta.benchmark compare --baseline benchmark-baseline.json
+    python -m transiter_ny_mta.benchmark matrix --output matrix.json
+"""
+import argparse
+import dataclasses
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from google.protobuf.internal import api_implementation
+from transiter.parse import gtfsrealtime
+
+from transiter_ny_mta import alertfilter
+from transiter_ny_mta import alertindex
+from transiter_ny_mta import alertsparser
+from transiter_ny_mta import stationscsvparser
+from transiter_ny_mta import subwaytripsparser
+from transiter_ny_mta import syntheticfeeds
+from transiter_ny_mta import proto
+from transiter_ny_mta import routefilter
+from transiter_ny_mta import subscriptions
+from transiter_ny_mta.proto import alerts_pb2
+from transiter_ny_mta.proto import subwaytrips_pb2
+
+DEFAULT_SCALES = (0.25, 1, 4)
+DEFAULT_ITERATIONS = 10
+DEFAULT_WARMUP_ITERATIONS = 2
+DEFAULT_RUNS = 1
+DEFAULT_GATE_RUNS = 5
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_BASELINE = "benchmark-baseline.json"
+ALERT_INDEX_ALERTS_PER_SCALE = 1000
+ALERT_INDEX_SCALES = (1, 10)
+# Metadata that the relative speed of the benchmarks depends on
+GATE_ENVIRONMENT_KEYS = ("python_implementation", "python_version", "protobuf_backend")
+DEFAULT_MATRIX_BENCHMARKS = ("subwaytripsparser.", "alertsparser.")
+PERCENTILES = (50, 90, 99)
+
+
+@dataclasses.dataclass
+class Benchmark:
+    """
+    A benchmark of one stage of a parser.
+
+    build_input is called once per size with the scale and returns the input to the
+    benchmark and the number of entities in it. If setup is provided it is called
+    before every iteration with the input, and its result is passed to the stage in
+    place of the input. Only the stage is timed. If scales is given the benchmark is
+    always run at those scales instead of the requested ones, for benchmarks whose
+    sizes are not multiples of the size of the real feed.
+    """
+
+    name: str
+    build_input: typing.Callable[[float], typing.Tuple[typing.Any, int]]
+    stage: typing.Callable[[typing.Any], typing.Any]
+    setup: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None
+    scales: typing.Optional[typing.Sequence[float]] = None
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    scale: float
+    entities: int
+    timings: typing.List[float]
+    # The median latency of each run of the benchmark
+    run_medians: typing.List[float]
+    peak_memory: int
+
+    @property
+    def median(self) -> float:
+        return percentile(self.run_medians, 50)
+
+    @property
+    def throughput(self) -> float:
+        median = self.median
+        if median == 0:
+            return float("inf")
+        return self.entities / median
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "scale": self.scale,
+            "entities": self.entities,
+            "iterations": len(self.timings),
+            "throughput": self.throughput,
+            "median": self.median,
+            "confidence_interval": median_confidence_interval(self.run_medians),
+            "run_medians": self.run_medians,
+            "latency": {
+                "min": min(self.timings),
+                "mean": sum(self.timings) / len(self.timings),
+                "max": max(self.timings),
+                **{f"p{q}": percentile(self.timings, q) for q in PERCENTILES},
+            },
+            "peak_memory": self.peak_memory,
+            "timings": self.timings,
+        }
+
+
+def percentile(values: typing.Sequence[float], q: float) -> float:
+    """
+    Return the q-th percentile of the values, interpolating between closest ranks.
+    """
+    if len(values) == 0:
+        raise ValueError("Cannot take the percentile of no values")
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def median_confidence_interval(
+    values: typing.Sequence[float], confidence: float = DEFAULT_CONFIDENCE
+) -> typing.Tuple[float, float]:
+    """
+    Return a distribution free confidence interval for the median of the values.
+
+    The interval is bounded by the j-th smallest and j-th largest values, where j is
+    the largest number such that the interval contains the median with at least the
+    given probability. With too few values to reach the confidence the interval is
+    the range of the values.
+    """
+    if len(values) == 0:
+        raise ValueError("Cannot take the median of no values")
+    values = sorted(values)
+    n = len(values)
+    j = 1
+    while j + 1 <= n - j:
+        next_coverage = sum(_binomial(n, i) for i in range(j + 1, n - j)) / 2 ** n
+        if next_coverage < confidence:
+            break
+        j += 1
+    return values[j - 1], values[n - j]
+
+
+def _binomial(n: int, k: int) -> int:
+    # math.comb is only available from Python 3.8
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
+def run_benchmarks(
+    benchmarks: typing.Iterable[Benchmark] = None,
+    scales: typing.Iterable[float] = DEFAULT_SCALES,
+    iterations: int = DEFAULT_ITERATIONS,
+    warmup_iterations: int = DEFAULT_WARMUP_ITERATIONS,
+    runs: int = DEFAULT_RUNS,
+) -> typing.List[BenchmarkResult]:
+    """
+    Run each benchmark at each scale, or at its own scales if it has them.
+
+    The whole suite is run the given number of times, so that a temporary slow down
+    of the machine affects one run of every benchmark rather than every run of one.
+    """
+    if benchmarks is None:
+        benchmarks = BENCHMARKS
+    return _run_cases(
+        _pair_with_scales(benchmarks, scales), iterations, warmup_iterations, runs
+    )
+
+
+def _pair_with_scales(benchmarks, scales):
+    scales = list(scales)
+    return [
+        (benchmark, scale)
+        for benchmark in benchmarks
+        for scale in (scales if benchmark.scales is None else benchmark.scales)
+    ]
+
+
+def _run_cases_with_reference(
+    benchmarks_and_scales, iterations, warmup_iterations, runs
+):
+    # The reference benchmark is run in every run of the suite, so that a temporary
+    # slow down of the machine affects it as it affects the other benchmarks
+    results = _run_cases(
+        list(benchmarks_and_scales) + [(REFERENCE_BENCHMARK, 1)],
+        iterations,
+        warmup_iterations,
+        runs,
+    )
+    return results[:-1], results[-1].median
+
+
+def _run_cases(benchmarks_and_scales, iterations, warmup_iterations, runs):
+    if iterations <= 0 or runs <= 0:
+        raise ValueError("The number of iterations and runs must be positive")
+    cases = []
+    for benchmark, scale in benchmarks_and_scales:
+        input_, entities = benchmark.build_input(scale)
+        result = BenchmarkResult(
+            name=benchmark.name,
+            scale=scale,
+            entities=entities,
+            timings=[],
+            run_medians=[],
+            peak_memory=_measure_peak_memory(benchmark, input_),
+        )
+        cases.append((benchmark, input_, result))
+    for _ in range(runs):
+        for benchmark, input_, result in cases:
+            timings = _time_stage(benchmark, input_, iterations, warmup_iterations)
+            result.timings.extend(timings)
+            result.run_medians.append(percentile(timings, 50))
+    return [result for _, _, result in cases]
+
+
+def _time_stage(benchmark, input_, iterations, warmup_iterations):
+    setup = benchmark.setup
+    stage = benchmark.stage
+    timings = []
+    for i in range(warmup_iterations + iterations):
+        argument = input_ if setup is None else setup(input_)
+        start = time.perf_counter()
+        stage(argument)
+        end = time.perf_counter()
+        if i >= warmup_iterations:
+            timings.append(end - start)
+    return timings
+
+
+def _measure_peak_memory(benchmark, input_):
+    # Tracing allocations slows everything down, so memory is measured in a
+    # separate run.
+    argument = input_ if benchmark.setup is None else benchmark.setup(input_)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        benchmark.stage(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+def build_report(
+    results: typing.Iterable[BenchmarkResult], reference: typing.Optional[float] = None
+) -> dict:
+    """
+    Build the report of the results.
+
+    reference is the median latency of the reference benchmark, a measure of the
+    speed of the machine that does not depend on the protobuf backend, in the same
+    runs as the results.
+    """
+    report = {
+        "metadata": build_metadata(),
+        "results": [result.to_json() for result in results],
+    }
+    if reference is not None:
+        report["reference"] = reference
+    return report
+
+
+def _build_reference_input(scale):
+    rng = random.Random(0)
+    return [f"{rng.random():.6f}" for _ in range(int(20000 * scale))], 1
+
+
+def _run_reference(values):
+    # Plain Python work of the kind the parsers do outside of protobuf: string
+    # handling, dictionaries and sorting
+    key_to_values = {}
+    for value in values:
+        key_to_values.setdefault(value[:4], []).append(float(value))
+    return sorted(key_to_values.items())
+
+
+REFERENCE_BENCHMARK = Benchmark(
+    name="reference", build_input=_build_reference_input, stage=_run_reference
+)
+
+
+def build_metadata() -> dict:
+    return {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "python_version": "{}.{}".format(*sys.version_info[:2]),
+        "python_implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "protobuf": _get_version("protobuf"),
+        "protobuf_backend": api_implementation.Type(),
+        "transiter": _get_version("transiter"),
+        "transiter_ny_mta": _get_version("transiter-ny-mta"),
+    }
+
+
+def _get_version(distribution: str) -> typing.Optional[str]:
+    try:
+        from importlib import metadata
+    except ImportError:  # Python < 3.8
+        return None
+    try:
+        return metadata.version(distribution)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _build_subway_content(feed_id):
+    def build_input(scale):
+        generator = syntheticfeeds.SubwayFeedGenerator(feed_id=feed_id, scale=scale)
+        feed_message = generator.build_feed_message()
+        return feed_message.SerializeToString(), len(feed_message.entity)
+
+    return build_input
+
+
+def _build_subway_trip_updates(scale):
+    content, _ = _build_subway_content("123456")(scale)
+    feed_message = subwaytrips_pb2.FeedMessage.FromString(content)
+    subwaytripsparser.SubwayTripsParser.post_process_feed_message(feed_message)
+    return feed_message, len(list(_trip_updates(feed_message)))
+
+
+def _trip_updates(feed_message):
+    return (entity for entity in feed_message.entity if entity.HasField("trip_update"))
+
+
+def _build_subway_trips(feed_id):
+    def build_input(scale):
+        content, _ = _build_subway_content(feed_id)(scale)
+        return content, len(list(_convert_subway_content(content)))
+
+    return build_input
+
+
+def _convert_subway_content(content):
+    feed_message = subwaytrips_pb2.FeedMessage.FromString(content)
+    subwaytripsparser.SubwayTripsParser.post_process_feed_message(feed_message)
+    return list(gtfsrealtime.parse_trips(feed_message))
+
+
+def _fix_m_trains(trips):
+    for trip in trips:
+        subwaytripsparser._invert_m_train_direction_in_bushwick(trip)
+
+
+def _fix_route_ids(trips):
+    for trip in trips:
+        subwaytripsparser._fix_route_ids(trip)
+
+
+def _run_subway_trips_parser(options):
+    def stage(content):
+        parser = subwaytripsparser.SubwayTripsParser()
+        parser.load_options(options)
+        parser.load_content(content)
+        return list(parser.get_trips())
+
+    return stage
+
+
+def _build_subscribed_trips(scale):
+    # One subscription per route and one per stop of the routes in the feed, as
+    # for consumers such as station countdown clocks
+    content, _ = _build_subway_content("123456")(scale)
+    trips = _run_subway_trips_parser(None)(content)
+    route_ids = sorted({trip.route_id for trip in trips})
+    stop_ids = sorted(
+        {stop_time.stop_id[:3] for trip in trips for stop_time in trip.stop_times}
+    )
+    subscription_set = subscriptions.SubscriptionSet(
+        [
+            subscriptions.Subscription(route_id, route_ids=frozenset({route_id}))
+            for route_id in route_ids
+        ]
+        + [
+            subscriptions.Subscription(stop_id, stop_id_prefixes=(stop_id,))
+            for stop_id in stop_ids
+        ]
+    )
+    return (subscription_set, trips), len(trips)
+
+
+def _build_alerts_content(scale):
+    generator = syntheticfeeds.AlertsFeedGenerator(scale=scale)
+    feed_message = generator.build_feed_message()
+    return feed_message.SerializeToString(), len(feed_message.entity)
+
+
+def _build_alerts_feed_message(scale):
+    content, entities = _build_alerts_content(scale)
+    feed_message = alerts_pb2.FeedMessage.FromString(content)
+    alertsparser.AlertsParser.post_process_feed_message(feed_message)
+    return feed_message, entities
+
+
+def _build_consecutive_alerts_contents(scale):
+    generator = syntheticfeeds.AlertsFeedGenerator(scale=scale)
+    previous_content = generator.next_snapshot()
+    feed_message = generator.build_feed_message()
+    return (
+        (previous_content, feed_message.SerializeToString()),
+        len(feed_message.entity),
+    )
+
+
+def _load_previous_alerts_content(contents):
+    previous_content, content = contents
+    parser = alertsparser.AlertsParser()
+    parser.load_options({"incremental": True})
+    parser.load_content(previous_content)
+    return parser, content
+
+
+def _load_next_alerts_content(parser_and_content):
+    parser, content = parser_and_content
+    parser.load_content(content)
+    return list(parser.get_alerts())
+
+
+def _run_alerts_parser(options):
+    def stage(content):
+        parser = alertsparser.AlertsParser()
+        parser.load_options(options)
+        parser.load_content(content)
+        return list(parser.get_alerts())
+
+    return stage
+
+
+@functools.lru_cache(maxsize=None)
+def _build_index_alerts(scale):
+    # Cached as every alertindex benchmark uses the same alerts, which are slow to
+    # build at the larger sizes
+    generator = syntheticfeeds.AlertsFeedGenerator(
+        num_alerts=ALERT_INDEX_ALERTS_PER_SCALE, scale=scale
+    )
+    parser = alertsparser.AlertsParser()
+    parser.load_options(
+        {"engine": alertsparser.Engine.FUSED.value, "keep_non_alerts": True}
+    )
+    parser.load_content(generator.next_snapshot())
+    alerts = tuple(parser.get_alerts())
+    # Each route at times around the time of the feed, where most alerts are
+    now = datetime.datetime.fromtimestamp(generator.time, datetime.timezone.utc)
+    queries = [
+        (route_id, now + datetime.timedelta(days=days))
+        for route_id in sorted(
+            {route_id for alert in alerts for route_id in alert.route_ids}
+        )
+        for days in [-3, -1, 0, 1, 3]
+    ]
+    return alerts, queries
+
+
+def _build_alert_index_queries(scale):
+    alerts, queries = _build_index_alerts(scale)
+    return (alertindex.AlertIndex(alerts), queries), len(alerts)
+
+
+def _build_alert_scan_queries(scale):
+    alerts, queries = _build_index_alerts(scale)
+    return (alerts, queries), len(alerts)
+
+
+def _build_alert_index_update(scale):
+    alerts, _ = _build_index_alerts(scale)
+    # The alerts that change in a typical poll
+    return (alertindex.AlertIndex(alerts), alerts[::20]), len(alerts)
+
+
+def _query_alert_index(index_and_queries):
+    index, queries = index_and_queries
+    return [index.active_at(time, route_id=route_id) for route_id, time in queries]
+
+
+def _scan_alerts(alerts_and_queries):
+    alerts, queries = alerts_and_queries
+    return [
+        [
+            alert
+            for alert in alerts
+            if route_id in alert.route_ids and alertindex.is_active_at(alert, time)
+        ]
+        for route_id, time in queries
+    ]
+
+
+def _update_alert_index(index_and_alerts):
+    index, alerts = index_and_alerts
+    for alert in alerts:
+        index.add(alert)
+
+
+def _build_stations_csv(scale):
+    return (
+        syntheticfeeds.build_stations_csv(scale=scale),
+        2 * max(1, int(syntheticfeeds.DEFAULT_NUM_STATIONS * scale)),
+    )
+
+
+def _run_stations_csv_parser(content):
+    parser = stationscsvparser.StationsCsvParser()
+    parser.load_content(content)
+    return list(parser.get_direction_rules())
+
+
+BENCHMARKS = [
+    Benchmark(
+        name="subwaytripsparser.decode",
+        build_input=_build_subway_content("123456"),
+        stage=subwaytrips_pb2.FeedMessage.FromString,
+    ),
+    Benchmark(
+        name="subwaytripsparser.post_process",
+        build_input=_build_subway_content("123456"),
+        setup=subwaytrips_pb2.FeedMessage.FromString,
+        stage=subwaytripsparser.SubwayTripsParser.post_process_feed_message,
+    ),
+    Benchmark(
+        name="subwaytripsparser.convert_trips",
+        build_input=_build_subway_trip_updates,
+        stage=lambda feed_message: list(gtfsrealtime.parse_trips(feed_message)),
+    ),
+    Benchmark(
+        name="subwaytripsparser.convert_vehicles",
+        build_input=_build_subway_trip_updates,
+        stage=lambda feed_message: list(gtfsrealtime.parse_vehicles(feed_message)),
+    ),
+    Benchmark(
+        name="subwaytripsparser.m_train_fixup",
+        build_input=_build_subway_trips("BDFM"),
+        setup=_convert_subway_content,
+        stage=_fix_m_trains,
+    ),
+    Benchmark(
+        name="subwaytripsparser.route_id_fixup",
+        build_input=_build_subway_trips("123456"),
+        setup=_convert_subway_content,
+        stage=_fix_route_ids,
+    ),
+    Benchmark(
+        name="subwaytripsparser.trips",
+        build_input=_build_subway_content("123456"),
+        stage=_run_subway_trips_parser(None),
+    ),
+    Benchmark(
+        name="subwaytripsparser.trips_fused",
+        build_input=_build_subway_content("123456"),
+        stage=_run_subway_trips_parser(
+            {"engine": subwaytripsparser.Engine.FUSED.value}
+        ),
+    ),
+    Benchmark(
+        name="subwaytripsparser.route_filter",
+        build_input=_build_subway_content("123456"),
+        stage=lambda content: routefilter.RouteFilter(
+            include=["6"],
+            aliases=subwaytripsparser._ROUTE_ID_ALIASES,
+            always_exclude=subwaytripsparser._DROPPED_ROUTE_IDS,
+        ).filter_content(content),
+    ),
+    Benchmark(
+        name="subwaytripsparser.trips_single_route",
+        build_input=_build_subway_content("123456"),
+        stage=_run_subway_trips_parser({"include_routes": ["6"]}),
+    ),
+    Benchmark(
+        name="subwaytripsparser.subscriptions",
+        build_input=_build_subscribed_trips,
+        stage=lambda subscribed_trips: subscribed_trips[0].fan_out(subscribed_trips[1]),
+    ),
+    Benchmark(
+        name="alertsparser.decode",
+        build_input=_build_alerts_content,
+        stage=alerts_pb2.FeedMessage.FromString,
+    ),
+    Benchmark(
+        name="alertsparser.post_process",
+        build_input=_build_alerts_content,
+        setup=alerts_pb2.FeedMessage.FromString,
+        stage=alertsparser.AlertsParser.post_process_feed_message,
+    ),
+    Benchmark(
+        name="alertsparser.convert_alerts",
+        build_input=_build_alerts_feed_message,
+        stage=lambda feed_message: list(gtfsrealtime.parse_alerts(feed_message)),
+    ),
+    Benchmark(
+        name="alertsparser.non_alert_prefilter",
+        build_input=_build_alerts_content,
+        stage=lambda content: alertfilter.NonAlertFilter().filter_content(content),
+    ),
+    Benchmark(
+        name="alertsparser.alerts",
+        build_input=_build_alerts_content,
+        stage=_run_alerts_parser(None),
+    ),
+    Benchmark(
+        name="alertsparser.alerts_fused",
+        build_input=_build_alerts_content,
+        stage=_run_alerts_parser({"engine": alertsparser.Engine.FUSED.value}),
+    ),
+    Benchmark(
+        # The next snapshot of the feed after loading the previous one
+        name="alertsparser.alerts_incremental",
+        build_input=_build_consecutive_alerts_contents,
+        setup=_load_previous_alerts_content,
+        stage=_load_next_alerts_content,
+    ),
+    Benchmark(
+        name="alertindex.build",
+        build_input=_build_alert_scan_queries,
+        stage=lambda alerts_and_queries: alertindex.AlertIndex(alerts_and_queries[0]),
+        scales=ALERT_INDEX_SCALES,
+    ),
+    Benchmark(
+        name="alertindex.active_at",
+        build_input=_build_alert_index_queries,
+        stage=_query_alert_index,
+        scales=ALERT_INDEX_SCALES,
+    ),
+    Benchmark(
+        # The same queries as alertindex.active_at, without the index
+        name="alertindex.scan",
+        build_input=_build_alert_scan_queries,
+        stage=_scan_alerts,
+        scales=ALERT_INDEX_SCALES,
+    ),
+    Benchmark(
+        name="alertindex.update",
+        build_input=_build_alert_index_update,
+        stage=_update_alert_index,
+        scales=ALERT_INDEX_SCALES,
+    ),
+    Benchmark(
+        name="stationscsvparser.direction_rules",
+        build_input=_build_stations_csv,
+        stage=_run_stations_csv_parser,
+    ),
+]
+
+
+def select_benchmarks(
+    names: typing.Optional[typing.Iterable[str]],
+) -> typing.List[Benchmark]:
+    """
+    Return the benchmarks whose name starts with one of the names.
+    """
+    if not names:
+        return list(BENCHMARKS)
+    names = tuple(names)
+    benchmarks = [
+        benchmark for benchmark in BENCHMARKS if benchmark.name.startswith(names)
+    ]
+    if len(benchmarks) == 0:
+        raise ValueError(f"No benchmarks match {', '.join(names)}")
+    return benchmarks
+
+
+def format_results(results: typing.Iterable[BenchmarkResult]) -> str:
+    lines = [
+        "{:<40} {:>6} {:>9} {:>14} {:>11} {:>11} {:>11}".format(
+            "benchmark",
+            "scale",
+            "entities",
+            "entities/s",
+            "p50 (ms)",
+            "p99 (ms)",
+            "peak (KiB)",
+        )
+    ]
+    for result in results:
+        lines.append(
+            "{:<40} {:>6} {:>9} {:>14.0f} {:>11.3f} {:>11.3f} {:>11.1f}".format(
+                result.name,
+                result.scale,
+                result.entities,
+                result.throughput,
+                result.median * 1000,
+                percentile(result.timings, 99) * 1000,
+                result.peak_memory / 1024,
+            )
+        )
+    return "\n".join(lines)
+
+
+@dataclasses.dataclass
+class Comparison:
+    """
+    The comparison of the median latency of a benchmark to the baseline.
+
+    The benchmark has regressed if the lower bound of the confidence interval of its
+    median latency is more than the threshold (a fraction) above the baseline median.
+    The baseline median is scaled to the speed of the current machine.
+    """
+
+    name: str
+    scale: float
+    baseline: float
+    current: float
+    confidence_interval: typing.Tuple[float, float]
+    threshold: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline
+
+    @property
+    def regressed(self) -> bool:
+        return self.confidence_interval[0] > self.baseline * (1 + self.threshold)
+
+
+def compare(
+    baseline_report: dict, current_report: dict, threshold: float = DEFAULT_THRESHOLD
+) -> typing.List[Comparison]:
+    """
+    Compare the results in two reports; benchmarks missing from either are skipped.
+
+    If both reports contain the latency of the reference benchmark, the baseline
+    latencies are scaled by the ratio of the reference latencies.
+    """
+    baseline_scale = reference_ratio(baseline_report, current_report)
+    key_to_current = {
+        (result["name"], result["scale"]): result
+        for result in current_report["results"]
+    }
+    comparisons = []
+    for baseline_result in baseline_report["results"]:
+        current_result = key_to_current.get(
+            (baseline_result["name"], baseline_result["scale"])
+        )
+        if current_result is None:
+            continue
+        comparisons.append(
+            Comparison(
+                name=baseline_result["name"],
+                scale=baseline_result["scale"],
+                baseline=baseline_result["median"] * baseline_scale,
+                current=current_result["median"],
+                confidence_interval=tuple(current_result["confidence_interval"]),
+                threshold=threshold,
+            )
+        )
+    return comparisons
+
+
+def reference_ratio(baseline_report: dict, current_report: dict) -> float:
+    """
+    Return the ratio of the current and baseline reference latencies, or 1 if either
+    report does not have one.
+    """
+    baseline_reference = baseline_report.get("reference")
+    current_reference = current_report.get("reference")
+    if not baseline_reference or not current_reference:
+        return 1.0
+    return current_reference / baseline_reference
+
+
+def environment_differences(
+    baseline_metadata: dict, current_metadata: dict
+) -> typing.List[str]:
+    """
+    Return descriptions of the differences in the environments of two reports that
+    prevent comparing them.
+    """
+    differences = []
+    for key in GATE_ENVIRONMENT_KEYS:
+        baseline_value = baseline_metadata.get(key)
+        current_value = current_metadata.get(key)
+        if baseline_value != current_value:
+            differences.append(f"{key} is {current_value} (baseline: {baseline_value})")
+    return differences
+
+
+def format_comparisons(comparisons: typing.Iterable[Comparison]) -> str:
+    lines = [
+        "{:<40} {:>6} {:>14} {:>13} {:>21} {:>7}".format(
+            "benchmark",
+            "scale",
+            "baseline (ms)",
+            "current (ms)",
+            "95% CI (ms)",
+            "ratio",
+        )
+    ]
+    for comparison in comparisons:
+        lines.append(
+            "{:<40} {:>6} {:>14.3f} {:>13.3f} {:>21} {:>7.2f}{}".format(
+                comparison.name,
+                comparison.scale,
+                comparison.baseline * 1000,
+                comparison.current * 1000,
+                "[{:.3f}, {:.3f}]".format(
+                    *(bound * 1000 for bound in comparison.confidence_interval)
+                ),
+                comparison.ratio,
+                "  REGRESSED" if comparison.regressed else "",
+            )
+        )
+    return "\n".join(lines)
+
+
+def run_matrix(
+    benchmark_prefixes: typing.Iterable[str] = DEFAULT_MATRIX_BENCHMARKS,
+    scales: typing.Iterable[float] = DEFAULT_SCALES,
+    iterations: int = DEFAULT_ITERATIONS,
+    warmup_iterations: int = DEFAULT_WARMUP_ITERATIONS,
+    runs: int = DEFAULT_RUNS,
+    backends: typing.Optional[typing.Iterable[str]] = None,
+) -> dict:
+    """
+    Run the benchmarks under each protobuf backend, each in a new Python process.
+
+    If backends is not given, the available backends are detected. The result maps
+    each backend to the report of its run, or to an error if the run failed or the
+    process did not use the backend.
+    """
+    if backends is None:
+        backends = proto.available_backends()
+    backend_to_result = {}
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "results.json")
+            result = subprocess.run(
+                [sys.executable, "-m", "transiter_ny_mta.benchmark", "run"]
+                + list(benchmark_prefixes)
+                + ["--scales"]
+                + [str(scale) for scale in scales]
+                + [
+                    "--iterations",
+                    str(iterations),
+                    "--warmup-iterations",
+                    str(warmup_iterations),
+                    "--runs",
+                    str(runs),
+                    "--output",
+                    output_path,
+                ],
+                env={**os.environ, proto.BACKEND_ENV_VARIABLE: backend},
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            if result.returncode != 0:
+                error_lines = result.stderr.strip().splitlines()
+                backend_to_result[backend] = {
+                    "error": error_lines[-1] if error_lines else "unknown error"
+                }
+                continue
+            report = _read_report(output_path)
+        actual_backend = report["metadata"]["protobuf_backend"]
+        if actual_backend != backend:
+            backend_to_result[backend] = {
+                "error": f"the {actual_backend} backend was used instead"
+            }
+            continue
+        backend_to_result[backend] = report
+    return {
+        "metadata": build_metadata(),
+        "backends": backend_to_result,
+    }
+
+
+def format_matrix(matrix: dict) -> str:
+    backend_to_result = matrix["backends"]
+    backends = [
+        backend
+        for backend, report in backend_to_result.items()
+        if "error" not in report
+    ]
+    key_to_throughputs = {}
+    for i, backend in enumerate(backends):
+        for result in backend_to_result[backend]["results"]:
+            throughputs = key_to_throughputs.setdefault(
+                (result["name"], result["scale"]), [None] * len(backends)
+            )
+            throughputs[i] = result["throughput"]
+    lines = [
+        "{:<40} {:>6}".format("benchmark", "scale")
+        + "".join(" {:>16}".format(backend + " (e/s)") for backend in backends)
+    ]
+    for (name, scale), throughputs in key_to_throughputs.items():
+        lines.append(
+            "{:<40} {:>6}".format(name, scale)
+            + "".join(
+                " {:>16}".format("-" if throughput is None else f"{throughput:.0f}")
+                for throughput in throughputs
+            )
+        )
+    for backend, report in backend_to_result.items():
+        if "error" in report:
+            lines.append(f"{backend}: failed: {report['error']}")
+    return "\n".join(lines)
+
+
+def _add_run_arguments(parser):
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="only run benchmarks whose name starts with one of these",
+    )
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        default=list(DEFAULT_SCALES),
+        help="feed sizes, as multiples of the size of the real feed",
+    )
+    _add_iteration_arguments(parser, DEFAULT_RUNS)
+    _add_output_argument(parser)
+
+
+def _add_iteration_arguments(parser, default_runs):
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument(
+        "--warmup-iterations", type=int, default=DEFAULT_WARMUP_ITERATIONS
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=default_runs,
+        help="number of times to run the suite",
+    )
+
+
+def _add_output_argument(parser):
+    parser.add_argument(
+        "--output", "-o", help="file to write the results to; defaults to stdout"
+    )
+
+
+def _add_matrix_arguments(parser):
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        default=list(DEFAULT_MATRIX_BENCHMARKS),
+        help="only run benchmarks whose name starts with one of these; defaults to "
+        "the subway trips and alerts benchmarks",
+    )
+    parser.add_argument(
+        "--scales", type=float, nargs="+", default=list(DEFAULT_SCALES),
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        help="protobuf backends to run the benchmarks under, out of {}; defaults "
+        "to all of the available backends".format(", ".join(proto.BACKENDS)),
+    )
+    _add_iteration_arguments(parser, DEFAULT_RUNS)
+    _add_output_argument(parser)
+
+
+def _add_compare_arguments(parser):
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help=f"baseline results file; defaults to {DEFAULT_BASELINE}",
+    )
+    parser.add_argument(
+        "--current",
+        help="results file to compare against the baseline, instead of running "
+        "the benchmarks in the baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="maximum allowed slow down as a fraction of the baseline latency",
+    )
+    parser.add_argument(
+        "--ignore-environment",
+        action="store_true",
+        help="compare even if the Python version or protobuf backend differ from "
+        "the baseline's",
+    )
+    _add_iteration_arguments(parser, DEFAULT_GATE_RUNS)
+    parser.add_argument("--output", "-o", help="file to write the current results to")
+
+
+def _run(args):
+    proto.warn_if_pure_python()
+    results, reference = _run_cases_with_reference(
+        _pair_with_scales(select_benchmarks(args.benchmarks), args.scales),
+        args.iterations,
+        args.warmup_iterations,
+        args.runs,
+    )
+    print(format_results(results), file=sys.stderr)
+    report = build_report(results, reference)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        _write_report(report, args.output)
+    return 0
+
+
+def _compare(args):
+    baseline_report = _read_report(args.baseline)
+    if args.current is not None:
+        current_report = _read_report(args.current)
+        current_metadata = current_report["metadata"]
+    else:
+        current_report = None
+        current_metadata = build_metadata()
+    differences = environment_differences(baseline_report["metadata"], current_metadata)
+    for difference in differences:
+        print(f"Note: {difference}")
+    if len(differences) > 0 and not args.ignore_environment:
+        print(
+            "Skipping the comparison, as the latencies depend on the environment; "
+            "regenerate the baseline in this environment, or pass "
+            "--ignore-environment to compare anyway"
+        )
+        return 0
+    if current_report is None:
+        proto.warn_if_pure_python()
+        current_report = _run_baseline_benchmarks(baseline_report, args)
+        if args.output is not None:
+            _write_report(current_report, args.output)
+    for key, baseline_value in baseline_report["metadata"].items():
+        current_value = current_report["metadata"].get(key)
+        if (
+            key not in ("created_at",) + GATE_ENVIRONMENT_KEYS
+            and current_value != baseline_value
+        ):
+            print(f"Note: {key} is {current_value} (baseline: {baseline_value})")
+    ratio = reference_ratio(baseline_report, current_report)
+    if ratio != 1:
+        print(
+            f"Baseline latencies are scaled by {ratio:.2f}, the ratio of the "
+            "reference benchmark latencies"
+        )
+    comparisons = compare(baseline_report, current_report, args.threshold)
+    print(format_comparisons(comparisons))
+    regressions = [comparison for comparison in comparisons if comparison.regressed]
+    if len(regressions) > 0:
+        print(
+            f"{len(regressions)} of {len(comparisons)} benchmarks regressed by more "
+            f"than {args.threshold:.0%}"
+        )
+        return 1
+    print(f"No benchmarks regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+def _matrix(args):
+    matrix = run_matrix(
+        args.benchmarks,
+        args.scales,
+        args.iterations,
+        args.warmup_iterations,
+        args.runs,
+        args.backends,
+    )
+    print(format_matrix(matrix), file=sys.stderr)
+    if args.output is None:
+        json.dump(matrix, sys.stdout, indent=2)
+        print()
+    else:
+        _write_report(matrix, args.output)
+    return 0
+
+
+def _run_baseline_benchmarks(baseline_report, args):
+    name_to_benchmark = {benchmark.name: benchmark for benchmark in BENCHMARKS}
+    benchmarks_and_scales = []
+    for result in baseline_report["results"]:
+        benchmark = name_to_benchmark.get(result["name"])
+        if benchmark is None:
+            print(f"Note: skipping unknown benchmark {result['name']}")
+            continue
+        benchmarks_and_scales.append((benchmark, result["scale"]))
+    results, reference = _run_cases_with_reference(
+        benchmarks_and_scales, args.iterations, args.warmup_iterations, args.runs
+    )
+    return build_report(results, reference)
+
+
+def _read_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.benchmark",
+        description="Benchmark the stages of the transiter_ny_mta parsers.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser(
+        "run", help="run the benchmarks and output the results as JSON"
+    )
+    _add_run_arguments(run_parser)
+    run_parser.set_defaults(func=_run)
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="compare the results of the benchmarks against a baseline, and fail "
+        "if any of them regressed",
+    )
+    _add_compare_arguments(compare_parser)
+    compare_parser.set_defaults(func=_compare)
+    matrix_parser = subparsers.add_parser(
+        "matrix",
+        help="run the subway trips and alerts benchmarks under each available "
+        "protobuf backend",
+    )
+    _add_matrix_arguments(matrix_parser)
+    matrix_parser.set_defaults(func=_matrix)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Cache of entities built from the serialized feed entities of previous loads.
+
+Between consecutive loads of a feed most feed entities are byte-for-byte unchanged.
+The cache maps a fingerprint of each serialized feed entity to the result of
+converting it, so that only new or changed feed entities need to be decoded.
+
+Note that a cache hit returns the same objects that were returned previously.
+"""
+import collections
+import dataclasses
+import hashlib
+import typing
+
+
+@dataclasses.dataclass
+class EntityCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class EntityCache:
+    def __init__(self, max_size: int):
+        if max_size <= 0:
+            raise ValueError("The entity cache size must be positive")
+        self.max_size = max_size
+        self.stats = EntityCacheStats()
+        self._fingerprint_to_value = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._fingerprint_to_value)
+
+    @staticmethod
+    def fingerprint(serialized_entity) -> bytes:
+        return hashlib.blake2b(serialized_entity, digest_size=16).digest()
+
+    def get(self, fingerprint: bytes, build: typing.Callable[[], typing.Any]):
+        """
+        Return the value for the fingerprint, building and caching it on a miss.
+        """
+        try:
+            value = self._fingerprint_to_value[fingerprint]
+        except KeyError:
+            pass
+        else:
+            self._fingerprint_to_value.move_to_end(fingerprint)
+            self.stats.hits += 1
+            return value
+        self.stats.misses += 1
+        value = build()
+        self._fingerprint_to_value[fingerprint] = value
+        if len(self._fingerprint_to_value) > self.max_size:
+            self._fingerprint_to_value.popitem(last=False)
+            self.stats.evictions += 1
+        return value
+
+    def retain(self, fingerprints: typing.Set[bytes]) -> None:
+        """
+        Evict all entries whose fingerprint is not in the set.
+
+        This is called after each load with the fingerprints of the feed entities in
+        that load, so that entities which disappeared from the feed are evicted.
+        """
+        for fingerprint in list(self._fingerprint_to_value.keys()):
+            if fingerprint not in fingerprints:
+                del self._fingerprint_to_value[fingerprint]
+                self.stats.evictions += 1
@@ -0,0 +1,383 @@
+"""
+Concurrent fetching of the MTA feeds using asyncio.
+
+A Fetcher issues the requests for all of the feeds concurrently over a pool of
+keep-alive HTTP/1.1 connections, so that consecutive polls of the MTA API reuse
+connections instead of opening a new one per feed and poll. It requests compressed
+responses, and remembers the ETag and Last-Modified validators of each URL so that
+feeds that have not changed since the previous poll are answered with 304 Not
+Modified and not transferred again:
+
+    feed_fetcher = fetcher.Fetcher()
+    requests = fetcher.subway_feed_requests(api_key)
+    feed_id_to_result = await feed_fetcher.fetch_all(requests)
+    fetcher.load_results(feed_id_to_result, feed_id_to_parser)
+    ...
+    await feed_fetcher.close()
+
+The content of each result is the decompressed body, which can be passed straight
+to a parser's load_content; fetcher.load_results does this for the feeds that
+changed. Only the standard library is used; the client supports exactly what the
+MTA API needs (GET requests, Content-Length and chunked bodies, gzip and deflate
+content encodings). A Fetcher can be used in consecutive event loops, for example
+by several calls of asyncio.run; its connections are not reused across loops.
+"""
+import asyncio
+import dataclasses
+import ssl
+import time
+import typing
+import urllib.parse
+import zlib
+
+MTA_API_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/"
+API_KEY_HEADER = "X-API-KEY"
+# The subway feeds in transiter_config_nyc_subway.yaml, by feed ID. The config is a
+# Jinja template that is not shipped with the package, so the paths are repeated
+# here and checked against it by the tests.
+SUBWAY_FEED_ID_TO_PATH = {
+    "gtfsrealtime-alerts": "camsys%2Fsubway-alerts",
+    "123456": "nyct%2Fgtfs",
+    "ACE": "nyct%2Fgtfs-ace",
+    "BDFM": "nyct%2Fgtfs-bdfm",
+    "G": "nyct%2Fgtfs-g",
+    "JZ": "nyct%2Fgtfs-jz",
+    "L": "nyct%2Fgtfs-l",
+    "NQRW": "nyct%2Fgtfs-nqrw",
+    "SIR": "nyct%2Fgtfs-si",
+}
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_TIMEOUT = 10.0
+USER_AGENT = "transiter-ny-mta"
+
+_MAX_LINE_LENGTH = 65536
+
+
+class FetchError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class FeedRequest:
+    feed_id: str
+    url: str
+    headers: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class FetchResult:
+    feed_id: str
+    # None if the request failed
+    status: typing.Optional[int] = None
+    # The decompressed body; None if the feed was not modified or the request failed
+    content: typing.Optional[bytes] = None
+    # The number of bytes received for the body, before decompression
+    transferred_bytes: int = 0
+    # In seconds
+    duration: float = 0.0
+    error: typing.Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+@dataclasses.dataclass
+class _Response:
+    status: int
+    headers: typing.Dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.num_requests = 0
+
+    def close(self):
+        self.writer.close()
+
+
+def subway_feed_requests(
+    api_key: typing.Optional[str], base_url: str = MTA_API_BASE_URL
+) -> typing.List[FeedRequest]:
+    """
+    Return the requests for the subway trip and alert feeds.
+
+    The base URL can be changed to fetch from a stand-in server.
+    """
+    headers = {} if api_key is None else {API_KEY_HEADER: api_key}
+    return [
+        FeedRequest(feed_id=feed_id, url=base_url + path, headers=dict(headers))
+        for feed_id, path in SUBWAY_FEED_ID_TO_PATH.items()
+    ]
+
+
+def load_results(
+    feed_id_to_result: typing.Dict[str, FetchResult],
+    feed_id_to_parser: typing.Dict[str, typing.Any],
+) -> typing.List[str]:
+    """
+    Load the content of each fetched feed into its parser.
+
+    Feeds that were not modified or failed to fetch are skipped. Returns the IDs of
+    the feeds that were loaded.
+    """
+    loaded_feed_ids = []
+    for feed_id, result in feed_id_to_result.items():
+        parser = feed_id_to_parser.get(feed_id)
+        if parser is None or result.content is None:
+            continue
+        parser.load_content(result.content)
+        loaded_feed_ids.append(feed_id)
+    return loaded_feed_ids
+
+
+class Fetcher:
+    def __init__(
+        self,
+        max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+        timeout: float = DEFAULT_TIMEOUT,
+        ssl_context: typing.Optional[ssl.SSLContext] = None,
+    ):
+        self._max_connections_per_host = max_connections_per_host
+        self._timeout = timeout
+        self._ssl_context = ssl_context
+        # The event loop that the connections and semaphores belong to
+        self._loop = None
+        self._host_to_idle_connections = {}
+        self._host_to_semaphore = {}
+        # The ETag and Last-Modified headers of the last response for each URL
+        self._url_to_validators = {}
+        self.connections_opened = 0
+
+    async def fetch_all(
+        self, requests: typing.Iterable[FeedRequest]
+    ) -> typing.Dict[str, FetchResult]:
+        """
+        Fetch the feeds concurrently and return the results by feed ID.
+        """
+        requests = list(requests)
+        results = await asyncio.gather(*(self.fetch(request) for request in requests))
+        return {result.feed_id: result for result in results}
+
+    async def fetch(self, request: FeedRequest) -> FetchResult:
+        """
+        Fetch one feed; errors are reported in the result rather than raised.
+        """
+        start = time.perf_counter()
+        result = FetchResult(feed_id=request.feed_id)
+        self._use_running_loop()
+        try:
+            response = await asyncio.wait_for(
+                self._fetch_response(request), self._timeout
+            )
+            result.status = response.status
+            result.transferred_bytes = len(response.body)
+            if response.status == 200:
+                result.content = _decode_body(
+                    response.body, response.headers.get("content-encoding")
+                )
+                self._url_to_validators[request.url] = {
+                    key: response.headers[header]
+                    for key, header in (
+                        ("If-None-Match", "etag"),
+                        ("If-Modified-Since", "last-modified"),
+                    )
+                    if header in response.headers
+                }
+            elif response.status != 304:
+                result.error = f"Unexpected HTTP status {response.status}"
+        except asyncio.TimeoutError:
+            result.error = f"Timed out after {self._timeout} seconds"
+        except asyncio.IncompleteReadError:
+            result.error = "The connection was closed before the response ended"
+        except (
+            OSError,
+            ValueError,
+            FetchError,
+            asyncio.LimitOverrunError,
+            RuntimeError,
+            zlib.error,
+        ) as e:
+            result.error = f"{type(e).__name__}: {e}"
+        result.duration = time.perf_counter() - start
+        return result
+
+    async def close(self) -> None:
+        self._close_idle_connections()
+
+    def _use_running_loop(self):
+        # Connections and semaphores can only be used in the event loop they were
+        # created in, so they are dropped when the fetcher is used in another one,
+        # for example by consecutive calls of asyncio.run. The validators are kept.
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        self._close_idle_connections()
+        self._host_to_semaphore = {}
+        self._loop = loop
+
+    def _close_idle_connections(self):
+        for connections in self._host_to_idle_connections.values():
+            for connection in connections:
+                try:
+                    connection.close()
+                except RuntimeError:
+                    # The connection's event loop is closed
+                    pass
+        self._host_to_idle_connections = {}
+
+    async def _fetch_response(self, request: FeedRequest) -> _Response:
+        url = urllib.parse.urlsplit(request.url)
+        if url.scheme not in ("http", "https"):
+            raise FetchError(f"Unsupported URL scheme {url.scheme}")
+        host_key = (url.scheme, url.hostname, url.port)
+        semaphore = self._host_to_semaphore.get(host_key)
+        if semaphore is None:
+            semaphore = self._host_to_semaphore[host_key] = asyncio.Semaphore(
+                self._max_connections_per_host
+            )
+        request_bytes = self._build_request_bytes(request, url)
+        async with semaphore:
+            connection = self._take_idle_connection(host_key)
+            if connection is not None:
+                try:
+                    response = await self._send(connection, request_bytes)
+                except (OSError, FetchError, asyncio.IncompleteReadError):
+                    # The server may have closed the idle connection; retry once
+                    # with a new connection.
+                    connection.close()
+                    connection = None
+                except BaseException:
+                    connection.close()
+                    raise
+            if connection is None:
+                connection = await self._open_connection(url)
+                try:
+                    response = await self._send(connection, request_bytes)
+                except BaseException:
+                    connection.close()
+                    raise
+            if response.keep_alive:
+                self._host_to_idle_connections.setdefault(host_key, []).append(
+                    connection
+                )
+            else:
+                connection.close()
+        return response
+
+    def _take_idle_connection(self, host_key) -> typing.Optional[_Connection]:
+        connections = self._host_to_idle_connections.get(host_key)
+        while connections:
+            connection = connections.pop()
+            if not connection.writer.is_closing():
+                return connection
+        return None
+
+    async def _open_connection(self, url) -> _Connection:
+        if url.scheme == "https":
+            ssl_context = self._ssl_context or ssl.create_default_context()
+            port = url.port or 443
+        else:
+            ssl_context = None
+            port = url.port or 80
+        reader, writer = await asyncio.open_connection(
+            url.hostname, port, ssl=ssl_context, limit=_MAX_LINE_LENGTH
+        )
+        self.connections_opened += 1
+        return _Connection(reader, writer)
+
+    def _build_request_bytes(self, request: FeedRequest, url) -> bytes:
+        target = url.path or "/"
+        if url.query:
+            target += "?" + url.query
+        headers = {
+            "Host": url.netloc,
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            **self._url_to_validators.get(request.url, {}),
+            **request.headers,
+        }
+        lines = [f"GET {target} HTTP/1.1"] + [
+            f"{key}: {value}" for key, value in headers.items()
+        ]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send(self, connection: _Connection, request_bytes: bytes) -> _Response:
+        connection.writer.write(request_bytes)
+        await connection.writer.drain()
+        connection.num_requests += 1
+        return await _read_response(connection.reader)
+
+
+async def _read_response(reader: asyncio.StreamReader) -> _Response:
+    status_line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip()
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise FetchError(f"Malformed status line {status_line!r}")
+    version = parts[0]
+    try:
+        status = int(parts[1])
+    except ValueError:
+        raise FetchError(f"Malformed status line {status_line!r}")
+    headers = {}
+    while True:
+        line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip("\r\n")
+        if line == "":
+            break
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    connection_header = headers.get("connection", "").lower()
+    keep_alive = (
+        version == "HTTP/1.1" and connection_header != "close"
+    ) or connection_header == "keep-alive"
+    if status == 304 or status == 204 or 100 <= status < 200:
+        body = b""
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        body = await _read_chunked_body(reader)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        # The body ends when the server closes the connection
+        body = await reader.read()
+        keep_alive = False
+    return _Response(status=status, headers=headers, body=body, keep_alive=keep_alive)
+
+
+async def _read_chunked_body(reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while True:
+        size_line = await reader.readuntil(b"\r\n")
+        try:
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise FetchError(f"Malformed chunk size {size_line!r}")
+        if size == 0:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    # Trailers
+    while (await reader.readuntil(b"\r\n")) != b"\r\n":
+        pass
+    return b"".join(chunks)
+
+
+def _decode_body(body: bytes, content_encoding: typing.Optional[str]) -> bytes:
+    if content_encoding is not None:
+        # Content codings are case-insensitive
+        content_encoding = content_encoding.strip().lower()
+    if content_encoding is None or content_encoding == "identity":
+        return body
+    if content_encoding == "gzip":
+        return zlib.decompress(body, wbits=zlib.MAX_WBITS | 16)
+    if content_encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib wrapper
+            return zlib.decompress(body, wbits=-zlib.MAX_WBITS)
+    raise FetchError(f"Unsupported content encoding {content_encoding}")
@@ -0,0 +1,234 @@
+"""
+Report the time taken to import the parsers in this package.
+
+Each scenario is an import statement that is run in a fresh interpreter with
+python -X importtime. The per module timings printed by the interpreter are parsed,
+and the modules imported during interpreter startup are excluded. For each scenario
+the report contains the median total import time over several runs, the number of
+modules imported, and the modules with the largest self import time.
+
+Usage:
+
+    python -m transiter_ny_mta.importtime [--runs 5] [--output report.json]
+"""
+import argparse
+import dataclasses
+import json
+import statistics
+import subprocess
+import sys
+import typing
+
+DEFAULT_RUNS = 5
+DEFAULT_TOP_MODULES = 10
+
+SCENARIOS = {
+    "package": "import transiter_ny_mta",
+    "StationsCsvParser": "from transiter_ny_mta import StationsCsvParser",
+    "SubwayTripsParser": "from transiter_ny_mta import SubwayTripsParser",
+    "AlertsParser": "from transiter_ny_mta import AlertsParser",
+    "all parsers": (
+        "from transiter_ny_mta import AlertsParser, StationsCsvParser, "
+        "SubwayTripsParser"
+    ),
+}
+
+_LINE_PREFIX = "import time:"
+
+
+@dataclasses.dataclass
+class ModuleImportTime:
+    module: str
+    # In microseconds
+    self_time: int
+    cumulative_time: int
+    # The nesting level of the import; modules imported directly by the statement
+    # have depth 0
+    depth: int
+
+
+def parse_importtime_output(output: str) -> typing.List[ModuleImportTime]:
+    """
+    Parse the lines printed to stderr by python -X importtime.
+    """
+    module_import_times = []
+    for line in output.splitlines():
+        if not line.startswith(_LINE_PREFIX):
+            continue
+        parts = line[len(_LINE_PREFIX) :].split("|")
+        if len(parts) != 3:
+            continue
+        self_time, cumulative_time, module = parts
+        try:
+            self_time = int(self_time)
+            cumulative_time = int(cumulative_time)
+        except ValueError:
+            # The header line
+            continue
+        # Module names are preceded by one space, and two more per nesting level
+        indent = len(module) - len(module.lstrip(" "))
+        module_import_times.append(
+            ModuleImportTime(
+                module=module.strip(),
+                self_time=self_time,
+                cumulative_time=cumulative_time,
+                depth=(indent - 1) // 2,
+            )
+        )
+    return module_import_times
+
+
+def run_importtime(statement: str) -> typing.List[ModuleImportTime]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+        check=True,
+    )
+    return parse_importtime_output(result.stderr)
+
+
+@dataclasses.dataclass
+class ScenarioReport:
+    name: str
+    statement: str
+    # The total import time of each run, in microseconds
+    totals: typing.List[int]
+    modules: typing.List[ModuleImportTime]
+
+    @property
+    def median_total(self) -> float:
+        return statistics.median(self.totals)
+
+    def to_json(self, top_modules: int = DEFAULT_TOP_MODULES) -> dict:
+        slowest_modules = sorted(
+            self.modules, key=lambda module: module.self_time, reverse=True
+        )[:top_modules]
+        return {
+            "name": self.name,
+            "statement": self.statement,
+            "median_total_us": self.median_total,
+            "totals_us": self.totals,
+            "num_modules": len(self.modules),
+            "slowest_modules": [
+                dataclasses.asdict(module) for module in slowest_modules
+            ],
+        }
+
+
+def measure_scenario(
+    name: str,
+    statement: str,
+    runs: int = DEFAULT_RUNS,
+    startup_modules: typing.Optional[typing.Set[str]] = None,
+) -> ScenarioReport:
+    """
+    Measure the import time of the statement, excluding interpreter startup.
+
+    The first run is discarded as it may include writing bytecode caches.
+    """
+    if startup_modules is None:
+        startup_modules = measure_startup_modules()
+    totals = []
+    modules = []
+    for i in range(runs + 1):
+        module_import_times = run_importtime(statement)
+        # A module imported at startup is never imported again by the statement, so
+        # removing the startup modules at depth 0 removes all of their subtrees.
+        modules = []
+        total = 0
+        excluded_subtree = False
+        for module_import_time in reversed(module_import_times):
+            # Parents are printed after their children
+            depth = module_import_time.depth
+            if depth == 0:
+                excluded_subtree = module_import_time.module in startup_modules
+            if excluded_subtree:
+                continue
+            modules.append(module_import_time)
+            if depth == 0:
+                total += module_import_time.cumulative_time
+        if i > 0:
+            totals.append(total)
+    return ScenarioReport(
+        name=name, statement=statement, totals=totals, modules=list(reversed(modules))
+    )
+
+
+def measure_startup_modules() -> typing.Set[str]:
+    return {
+        module_import_time.module
+        for module_import_time in run_importtime("pass")
+        if module_import_time.depth == 0
+    }
+
+
+def build_report(
+    scenarios: typing.Dict[str, str] = None, runs: int = DEFAULT_RUNS
+) -> typing.List[ScenarioReport]:
+    if scenarios is None:
+        scenarios = SCENARIOS
+    startup_modules = measure_startup_modules()
+    return [
+        measure_scenario(name, statement, runs, startup_modules)
+        for name, statement in scenarios.items()
+    ]
+
+
+def format_report(reports: typing.Iterable[ScenarioReport]) -> str:
+    lines = [
+        "{:<20} {:>18} {:>8} {:>12}".format(
+            "scenario", "import time (ms)", "modules", "pb2 modules"
+        )
+    ]
+    for report in reports:
+        lines.append(
+            "{:<20} {:>18.1f} {:>8} {:>12}".format(
+                report.name,
+                report.median_total / 1000,
+                len(report.modules),
+                sum(
+                    1
+                    for module in report.modules
+                    if module.module.startswith("transiter_ny_mta.proto.")
+                    and module.module.endswith("_pb2")
+                ),
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.importtime",
+        description="Report the import time of the transiter_ny_mta parsers.",
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help="scenarios to measure, out of {}; defaults to all of them".format(
+            ", ".join(SCENARIOS.keys())
+        ),
+    )
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--output", "-o", help="file to write the report to as JSON")
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    scenarios = {
+        name: statement
+        for name, statement in SCENARIOS.items()
+        if not args.scenarios or name in args.scenarios
+    }
+    reports = build_report(scenarios, args.runs)
+    print(format_report(reports))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump([report.to_json() for report in reports], f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Opt-in instrumentation of the parsers.
+
+Listeners registered using add_listener are called with a StageEvent each time a
+parser completes a stage of parsing a feed, for example decoding the content or
+converting the decoded message into trips. Each event contains the duration of the
+stage and counts of what it processed.
+
+When no listeners are registered, the parsers check for listeners once per load
+and otherwise run exactly as without instrumentation. When listeners are
+registered, the parsers run each stage to completion before yielding its results
+so that the stage can be timed; in particular, the getters return iterators over
+fully built lists instead of lazily building entities.
+
+Listeners are called synchronously in the thread that runs the parser, so they
+should be fast. Exceptions raised by listeners propagate to the caller of the
+parser.
+"""
+import contextlib
+import dataclasses
+import enum
+import time
+import typing
+
+
+class Stage(enum.Enum):
+    DECODE = "decode"
+    MOVE_EXTENSIONS = "move_extensions"
+    CONVERT = "convert"
+    CONVERT_VEHICLES = "convert_vehicles"
+    FIXUPS = "fixups"
+    FILTER = "filter"
+
+
+# Keys of the counts in stage events
+BYTES = "bytes"
+ENTITIES = "entities"
+TRIPS = "trips"
+TRIPS_DROPPED = "trips_dropped"
+ENTITIES_ROUTE_FILTERED = "entities_route_filtered"
+STOP_IDS_FLIPPED = "stop_ids_flipped"
+VEHICLES = "vehicles"
+ALERTS = "alerts"
+ALERTS_DROPPED = "alerts_dropped"
+ALERTS_ADDED = "alerts_added"
+ALERTS_UPDATED = "alerts_updated"
+ALERTS_REMOVED = "alerts_removed"
+DIRECTION_RULES = "direction_rules"
+ENTITY_CACHE_HITS = "entity_cache_hits"
+ENTITY_CACHE_MISSES = "entity_cache_misses"
+
+
+@dataclasses.dataclass
+class StageEvent:
+    parser: str
+    # The feed ID set using the feed_id parser option, if any
+    feed_id: typing.Optional[str]
+    stage: Stage
+    # In seconds
+    duration: float
+    counts: typing.Dict[str, int]
+
+
+Listener = typing.Callable[[StageEvent], None]
+
+# The listeners are replaced rather than mutated so that they can be read without
+# a lock.
+_listeners: typing.Tuple[Listener, ...] = ()
+
+
+def add_listener(listener: Listener) -> None:
+    global _listeners
+    _listeners = _listeners + (listener,)
+
+
+def remove_listener(listener: Listener) -> None:
+    global _listeners
+    listeners = list(_listeners)
+    listeners.remove(listener)
+    _listeners = tuple(listeners)
+
+
+def recorder(parser: str, feed_id: typing.Optional[str]) -> typing.Optional["Recorder"]:
+    """
+    Return a recorder for one load of a feed, or None if instrumentation is disabled.
+    """
+    if len(_listeners) == 0:
+        return None
+    return Recorder(parser, feed_id, _listeners)
+
+
+class Recorder:
+    def __init__(
+        self,
+        parser: str,
+        feed_id: typing.Optional[str],
+        listeners: typing.Tuple[Listener, ...],
+    ):
+        self._parser = parser
+        self._feed_id = feed_id
+        self._listeners = listeners
+
+    @contextlib.contextmanager
+    def stage(self, stage: Stage) -> typing.Iterator[typing.Dict[str, int]]:
+        """
+        Time the body of the with statement as the stage.
+
+        The context manager yields a dictionary that the body fills with counts.
+        No event is emitted if the body raises an exception.
+        """
+        counts = {}
+        start = time.perf_counter()
+        yield counts
+        duration = time.perf_counter() - start
+        event = StageEvent(
+            parser=self._parser,
+            feed_id=self._feed_id,
+            stage=stage,
+            duration=duration,
+            counts=counts,
+        )
+        for listener in self._listeners:
+            listener(event)
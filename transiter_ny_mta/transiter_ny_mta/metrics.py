@@ -0,0 +1,282 @@
+"""
+Prometheus metrics for feed parsing.
+
+A MetricsCollector is an instrumentation listener that aggregates the stage events
+of the parsers, per feed ID, into:
+
+- a histogram of the duration of each stage,
+- counters of the bytes parsed, the entities seen and built in each stage, and the
+  entities skipped because of their route ID, because of the route filter or
+  because they are not alerts,
+- counters of the M train stop IDs flipped and of entity cache hits and misses.
+
+The metrics are rendered in the Prometheus text exposition format by render, and
+can be served by the small HTTP server started with start_http_server:
+
+    collector = metrics.MetricsCollector()
+    instrumentation.add_listener(collector)
+    metrics.start_http_server(9100, collector)
+
+Recording an event does not take a lock: each thread aggregates into its own shard
+of the metrics, and the shards are summed when the metrics are rendered. Rendering
+may therefore miss events that are being recorded at the same time. When a thread
+exits, its shard is merged into the totals of the exited threads.
+"""
+import bisect
+import http.server
+import threading
+import typing
+import weakref
+
+from transiter_ny_mta import instrumentation
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_PREFIX = "transiter_ny_mta"
+_ENTITY_TYPES = {
+    instrumentation.ENTITIES: "feed_entity",
+    instrumentation.TRIPS: "trip",
+    instrumentation.VEHICLES: "vehicle",
+    instrumentation.ALERTS: "alert",
+    instrumentation.DIRECTION_RULES: "direction_rule",
+}
+_SKIP_REASONS = {
+    instrumentation.TRIPS_DROPPED: "route_id",
+    instrumentation.ENTITIES_ROUTE_FILTERED: "route_filter",
+    instrumentation.ALERTS_DROPPED: "non_alert",
+}
+_OTHER_COUNTERS = {
+    instrumentation.STOP_IDS_FLIPPED: "Stop IDs of M trains in Bushwick flipped.",
+    instrumentation.ENTITY_CACHE_HITS: "Entities found in the entity cache.",
+    instrumentation.ENTITY_CACHE_MISSES: "Entities not found in the entity cache.",
+    instrumentation.ALERTS_ADDED: "Alerts added since the previous load.",
+    instrumentation.ALERTS_UPDATED: "Alerts updated since the previous load.",
+    instrumentation.ALERTS_REMOVED: "Alerts removed since the previous load.",
+}
+
+
+class _Histogram:
+    __slots__ = ["bucket_counts", "sum"]
+
+    def __init__(self, num_buckets):
+        # The last bucket holds the observations above the largest bound
+        self.bucket_counts = [0] * (num_buckets + 1)
+        self.sum = 0.0
+
+
+class _Shard:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+
+class _ThreadToken:
+    """
+    Stored in the thread-local data next to a shard; it is released when the
+    thread exits.
+    """
+
+
+class MetricsCollector:
+    def __init__(self, buckets: typing.Iterable[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        # The sum of the shards of the threads that have exited
+        self._exited_threads_shard = _Shard()
+        self._shards_lock = threading.RLock()
+
+    def __call__(self, event: instrumentation.StageEvent) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._add_shard()
+        feed_id = event.feed_id or ""
+        stage = event.stage.value
+        key = (feed_id, event.parser, stage)
+        histogram = shard.histograms.get(key)
+        if histogram is None:
+            histogram = shard.histograms[key] = _Histogram(len(self._buckets))
+        histogram.bucket_counts[bisect.bisect_left(self._buckets, event.duration)] += 1
+        histogram.sum += event.duration
+        counters = shard.counters
+        for count_key, value in event.counts.items():
+            key = (feed_id, event.parser, stage, count_key)
+            counters[key] = counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        total = _Shard()
+        with self._shards_lock:
+            for shard in [self._exited_threads_shard] + self._shards:
+                self._merge(shard, total)
+        lines = []
+        self._render_histograms(total.histograms, lines)
+        _render_counters(total.counters, lines)
+        return "".join(line + "\n" for line in lines)
+
+    def _add_shard(self):
+        shard = self._local.shard = _Shard()
+        self._local.token = token = _ThreadToken()
+        with self._shards_lock:
+            self._shards.append(shard)
+        # The collector is referenced weakly, so that the finalizers of the threads
+        # that are still running do not keep it alive
+        weakref.finalize(token, _remove_shard, weakref.ref(self), shard)
+        return shard
+
+    def _remove_shard(self, shard):
+        with self._shards_lock:
+            self._shards.remove(shard)
+            self._merge(shard, self._exited_threads_shard)
+
+    def _merge(self, shard, total):
+        for key, histogram in list(shard.histograms.items()):
+            total_histogram = total.histograms.get(key)
+            if total_histogram is None:
+                total_histogram = total.histograms[key] = _Histogram(len(self._buckets))
+            for i, count in enumerate(histogram.bucket_counts):
+                total_histogram.bucket_counts[i] += count
+            total_histogram.sum += histogram.sum
+        for key, value in list(shard.counters.items()):
+            total.counters[key] = total.counters.get(key, 0) + value
+
+    def _render_histograms(self, histograms, lines):
+        name = f"{_PREFIX}_stage_duration_seconds"
+        lines.append(f"# HELP {name} Time spent in each stage of parsing a feed.")
+        lines.append(f"# TYPE {name} histogram")
+        bounds = [_format_value(bound) for bound in self._buckets] + ["+Inf"]
+        for (feed_id, parser, stage), histogram in sorted(histograms.items()):
+            labels = {"feed_id": feed_id, "parser": parser, "stage": stage}
+            cumulative_count = 0
+            for bound, count in zip(bounds, histogram.bucket_counts):
+                cumulative_count += count
+                bucket_labels = _format_labels({**labels, "le": bound})
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative_count}")
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}"
+            )
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative_count}")
+
+
+def _remove_shard(collector_ref, shard):
+    collector = collector_ref()
+    if collector is not None:
+        collector._remove_shard(shard)
+
+
+def _render_counters(counters, lines):
+    bytes_parsed = {}
+    entities = {}
+    skipped = {}
+    other_counters = {count_key: {} for count_key in _OTHER_COUNTERS}
+    for (feed_id, parser, stage, count_key), value in counters.items():
+        labels = (("feed_id", feed_id), ("parser", parser))
+        if count_key == instrumentation.BYTES:
+            _add(bytes_parsed, labels, value)
+        elif count_key in _ENTITY_TYPES:
+            labels += (("stage", stage), ("type", _ENTITY_TYPES[count_key]))
+            _add(entities, labels, value)
+        elif count_key in _SKIP_REASONS:
+            _add(skipped, labels + (("reason", _SKIP_REASONS[count_key]),), value)
+        elif count_key in other_counters:
+            _add(other_counters[count_key], labels, value)
+    _render_counter(
+        f"{_PREFIX}_parsed_bytes_total",
+        "Bytes of feed content parsed.",
+        bytes_parsed,
+        lines,
+    )
+    _render_counter(
+        f"{_PREFIX}_entities_total",
+        "Entities seen or built in each stage of parsing a feed.",
+        entities,
+        lines,
+    )
+    _render_counter(
+        f"{_PREFIX}_skipped_entities_total",
+        "Entities skipped while parsing a feed.",
+        skipped,
+        lines,
+    )
+    for count_key, help_text in _OTHER_COUNTERS.items():
+        _render_counter(
+            f"{_PREFIX}_{count_key}_total", help_text, other_counters[count_key], lines
+        )
+
+
+def _add(counter, labels, value):
+    counter[labels] = counter.get(labels, 0) + value
+
+
+def _render_counter(name, help_text, counter, lines):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in sorted(counter.items()):
+        lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+
+
+def _format_labels(labels: typing.Dict[str, str]) -> str:
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                key,
+                value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for key, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+def start_http_server(
+    port: int, collector: MetricsCollector, address: str = ""
+) -> http.server.ThreadingHTTPServer:
+    """
+    Serve the metrics at /metrics in a daemon thread, and return the server.
+
+    The server is stopped by calling its shutdown method.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = collector.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
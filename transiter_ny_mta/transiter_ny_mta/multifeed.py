@@ -0,0 +1,251 @@
+"""
+Parse the NYCT subway trip feeds concurrently in a pool of processes.
+
+The eight NYCT trip feeds are independent, but parsing them in threads does not
+help as protobuf decoding holds the GIL. A MultiFeedParser parses a batch of feed
+payloads in worker processes and returns, for each feed, the trips and vehicles
+along with timings:
+
+    with multifeed.MultiFeedParser() as parser:
+        feed_id_to_result = parser.parse({"123456": content_1, "ACE": content_2})
+
+The pool is kept for the lifetime of the MultiFeedParser so that the cost of
+starting the workers and importing the parsers is paid once. Each feed is always
+parsed by the same worker, which keeps one SubwayTripsParser per feed ID, so that
+parser options that carry state between loads (like the content and entity caches
+and the trip deltas) see every load of the feed in order. Instrumentation
+listeners registered in the parent process are not called for parses in the
+workers.
+
+Running this module compares parsing synthetic versions of all of the feeds
+serially and with the pool:
+
+    python -m transiter_ny_mta.multifeed [--workers 8] [--batches 5]
+"""
+import argparse
+import concurrent.futures
+import dataclasses
+import datetime
+import os
+import sys
+import time
+import traceback
+import typing
+
+from transiter import parse
+from transiter_ny_mta import subwaytripsparser
+from transiter_ny_mta import syntheticfeeds
+
+# The NYCT trip feeds, as in transiter_config_nyc_subway.yaml
+SUBWAY_FEED_IDS = ("123456", "ACE", "BDFM", "G", "JZ", "L", "NQRW", "SIR")
+DEFAULT_BATCHES = 5
+
+
+@dataclasses.dataclass
+class FeedResult:
+    feed_id: str
+    timestamp: typing.Optional[datetime.datetime] = None
+    trips: typing.List[parse.Trip] = dataclasses.field(default_factory=list)
+    vehicles: typing.List[parse.Vehicle] = dataclasses.field(default_factory=list)
+    # The time spent parsing in the worker, in seconds
+    parse_duration: float = 0.0
+    # The time from submitting the feed to receiving its result, in seconds; this
+    # includes waiting for a worker and transferring the content and the result
+    duration: float = 0.0
+    # The formatted exception, if parsing failed
+    error: typing.Optional[str] = None
+
+
+class MultiFeedParser:
+    """
+    Parses batches of subway feeds in a pool of worker processes.
+
+    options are the SubwayTripsParser options of every feed; the feed_id option is
+    set to the feed's ID. If include_vehicles is false, vehicles are not parsed.
+
+    Each worker is a single process pool, and a feed is assigned to a worker the
+    first time it is parsed, in the same way as the replay module's pool driver.
+    """
+
+    def __init__(
+        self,
+        max_workers: typing.Optional[int] = None,
+        options: typing.Optional[dict] = None,
+        include_vehicles: bool = True,
+    ):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self._executors = [
+            concurrent.futures.ProcessPoolExecutor(
+                1, initializer=_initialize_worker, initargs=(options,)
+            )
+            for _ in range(max_workers)
+        ]
+        self._feed_id_to_executor = {}
+        self._include_vehicles = include_vehicles
+
+    def parse(
+        self, feed_id_to_content: typing.Dict[str, bytes]
+    ) -> typing.Dict[str, FeedResult]:
+        """
+        Parse the feeds concurrently and return their results by feed ID.
+
+        A feed that fails to parse has a result with the error set; the other
+        feeds are unaffected.
+        """
+        feed_id_to_start = {}
+        future_to_feed_id = {}
+        # Larger feeds are submitted first so that they do not end up last in the
+        # queue, which would make the batch take longer, and so that they are
+        # spread over the workers when they are first assigned.
+        for feed_id, content in sorted(
+            feed_id_to_content.items(), key=lambda item: len(item[1]), reverse=True
+        ):
+            feed_id_to_start[feed_id] = time.perf_counter()
+            future = self._get_executor(feed_id).submit(
+                _parse_feed, feed_id, bytes(content), self._include_vehicles
+            )
+            future_to_feed_id[future] = feed_id
+        feed_id_to_result = {}
+        for future in concurrent.futures.as_completed(future_to_feed_id):
+            feed_id = future_to_feed_id[future]
+            try:
+                result = future.result()
+            except Exception:
+                # For example, the worker process died
+                result = FeedResult(feed_id=feed_id, error=traceback.format_exc())
+            result.duration = time.perf_counter() - feed_id_to_start[feed_id]
+            feed_id_to_result[feed_id] = result
+        return {feed_id: feed_id_to_result[feed_id] for feed_id in feed_id_to_content}
+
+    def close(self) -> None:
+        for executor in self._executors:
+            executor.shutdown()
+
+    def _get_executor(self, feed_id):
+        executor = self._feed_id_to_executor.get(feed_id)
+        if executor is None:
+            executor = self._executors[
+                len(self._feed_id_to_executor) % len(self._executors)
+            ]
+            self._feed_id_to_executor[feed_id] = executor
+        return executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parse_feeds(
+    feed_id_to_content: typing.Dict[str, bytes],
+    max_workers: typing.Optional[int] = None,
+    options: typing.Optional[dict] = None,
+) -> typing.Dict[str, FeedResult]:
+    """
+    Parse one batch of feeds using a new pool of worker processes.
+    """
+    with MultiFeedParser(max_workers, options) as parser:
+        return parser.parse(feed_id_to_content)
+
+
+# State of the worker processes
+_options = None
+_feed_id_to_parser = {}
+
+
+def _initialize_worker(options):
+    global _options
+    _options = options
+
+
+def _parse_feed(feed_id: str, content: bytes, include_vehicles: bool) -> FeedResult:
+    start = time.perf_counter()
+    result = FeedResult(feed_id=feed_id)
+    try:
+        parser = _get_parser(feed_id)
+        parser.load_content(content)
+        result.timestamp = parser.get_timestamp()
+        result.trips = list(parser.get_trips())
+        if include_vehicles:
+            result.vehicles = list(parser.get_vehicles())
+    except Exception:
+        result.error = traceback.format_exc()
+    result.parse_duration = time.perf_counter() - start
+    return result
+
+
+def _get_parser(feed_id):
+    parser = _feed_id_to_parser.get(feed_id)
+    if parser is None:
+        parser = subwaytripsparser.SubwayTripsParser()
+        parser.load_options({**(_options or {}), "feed_id": feed_id})
+        _feed_id_to_parser[feed_id] = parser
+    return parser
+
+
+def _build_synthetic_batches(num_batches):
+    generators = {
+        feed_id: syntheticfeeds.SubwayFeedGenerator(feed_id=feed_id)
+        for feed_id in SUBWAY_FEED_IDS
+    }
+    return [
+        {
+            feed_id: generator.next_snapshot()
+            for feed_id, generator in generators.items()
+        }
+        for _ in range(num_batches)
+    ]
+
+
+def _parse_serially(feed_id_to_content):
+    for feed_id, content in feed_id_to_content.items():
+        parser = subwaytripsparser.SubwayTripsParser()
+        parser.load_content(content)
+        list(parser.get_trips())
+        list(parser.get_vehicles())
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.multifeed",
+        description="Compare parsing all of the subway feeds serially and in a "
+        "process pool.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes; defaults to the number of CPUs",
+    )
+    parser.add_argument("--batches", type=int, default=DEFAULT_BATCHES)
+    args = parser.parse_args(argv)
+    batches = _build_synthetic_batches(args.batches)
+    serial_durations = []
+    for batch in batches:
+        start = time.perf_counter()
+        _parse_serially(batch)
+        serial_durations.append(time.perf_counter() - start)
+    parallel_durations = []
+    with MultiFeedParser(args.workers) as multi_feed_parser:
+        # The first batch starts the workers
+        multi_feed_parser.parse(batches[0])
+        for batch in batches:
+            start = time.perf_counter()
+            feed_id_to_result = multi_feed_parser.parse(batch)
+            parallel_durations.append(time.perf_counter() - start)
+            for result in feed_id_to_result.values():
+                if result.error is not None:
+                    print(f"{result.feed_id}: {result.error}", file=sys.stderr)
+                    return 1
+    serial = min(serial_durations)
+    parallel = min(parallel_durations)
+    print(f"CPUs: {os.cpu_count()}, workers: {args.workers or os.cpu_count()}")
+    print(f"serial:   {serial * 1000:.1f} ms per batch of {len(SUBWAY_FEED_IDS)} feeds")
+    print(f"parallel: {parallel * 1000:.1f} ms per batch ({serial / parallel:.2f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,115 @@
-SUBWAY_TRIPS_EXTENSION_ID = 1001
+"""
+The vendored GTFS Realtime protobuf packages, and diagnostics for the protobuf
+backend they run on.
+
+Depending on the protobuf version and how it was installed, messages are parsed by
+the pure Python implementation, the C++ implementation or upb. The pure Python
+implementation is an order of magnitude slower than the others. The active backend
+is logged at debug level when this package is imported; commands whose results
+depend on the backend, like the benchmarks, call warn_if_pure_python.
+"""
+import dataclasses
+import logging
+import os
+import subprocess
+import sys
+import typing
+
+import google.protobuf
+from google.protobuf.internal import api_implementation
+
+BACKEND_ENV_VARIABLE = "PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"
+PYTHON_BACKEND = "python"
+# The candidate backends; which of them are available depends on the installation
+BACKENDS = ("upb", "cpp", PYTHON_BACKEND)
+
+logger = logging.getLogger(__name__)
+
+_PROBE_SCRIPT = """
+from google.protobuf import descriptor_pb2
+from google.protobuf.internal import api_implementation
+descriptor_pb2.FileDescriptorProto(name="probe").SerializeToString()
+print(api_implementation.Type())
+"""
+
+
+@dataclasses.dataclass
+class BackendReport:
+    backend: str
+    protobuf_version: str
+    # The backend requested using the environment variable, if any
+    requested_backend: typing.Optional[str]
+    # Only populated if requested, as detecting the available backends requires
+    # starting a Python process for each candidate
+    available_backends: typing.Optional[typing.List[str]] = None
+
+    @property
+    def is_pure_python(self) -> bool:
+        return self.backend == PYTHON_BACKEND
+
+    def __str__(self):
+        lines = [
+            f"protobuf version: {self.protobuf_version}",
+            f"active backend: {self.backend}"
+            + (" (slow)" if self.is_pure_python else ""),
+            f"requested backend: {self.requested_backend or '(not set)'}",
+        ]
+        if self.available_backends is not None:
+            lines.append(
+                f"available backends: {', '.join(self.available_backends) or '(none)'}"
+            )
+        return "\n".join(lines)
+
+
+def backend_report(detect_available: bool = False) -> BackendReport:
+    """
+    Report on the protobuf backend in use in this process.
+
+    If detect_available is true, the report also contains the backends that can be
+    selected by setting the PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION environment
+    variable.
+    """
+    return BackendReport(
+        backend=api_implementation.Type(),
+        protobuf_version=google.protobuf.__version__,
+        requested_backend=os.environ.get(BACKEND_ENV_VARIABLE),
+        available_backends=available_backends() if detect_available else None,
+    )
+
+
+def available_backends() -> typing.List[str]:
+    return [backend for backend in BACKENDS if is_backend_available(backend)]
+
+
+def is_backend_available(backend: str) -> bool:
+    """
+    Return whether the backend is used when requested using the environment variable.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE_SCRIPT],
+        env={**os.environ, BACKEND_ENV_VARIABLE: backend},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    return result.returncode == 0 and result.stdout.strip() == backend
+
+
+def warn_if_pure_python() -> None:
+    if backend_report().is_pure_python:
+        logger.warning(
+            "Using the pure Python protobuf backend, which parses feeds about an "
+            "order of magnitude slower than the upb or C++ backends"
+        )
+
+
+def _log_backend():
+    report = backend_report()
+    logger.debug(
+        "Using the %s protobuf backend (protobuf %s)",
+        report.backend,
+        report.protobuf_version,
+    )
+
+
+_log_backend()
@@ -1,5 +1,12 @@
-from .transiter_ny_mta_alerts_gtfs_rt_base_pb2 import *
-from . import transiter_ny_mta_alerts_transiter_extension_pb2
-from . import transiter_ny_mta_alerts_mta_extension_pb2
+from .. import descriptorsets
 
 MTA_EXTENSION_ID = 1001
+
+if descriptorsets.has_descriptor_set(__file__):
+    __getattr__, __dir__ = descriptorsets.package_accessors(
+        __file__, "transiter-ny-mta-alerts-gtfs-rt-base.proto", globals()
+    )
+else:
+    from .transiter_ny_mta_alerts_gtfs_rt_base_pb2 import *
+    from . import transiter_ny_mta_alerts_transiter_extension_pb2
+    from . import transiter_ny_mta_alerts_mta_extension_pb2
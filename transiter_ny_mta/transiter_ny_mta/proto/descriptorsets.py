@@ -0,0 +1,157 @@
+"""
+Load a vendored GTFS Realtime package from a serialized FileDescriptorSet.
+
+Importing the Python modules generated by protoc builds the descriptors and message
+classes of every definition in the proto files. When the vendorizer is run with the
+descriptor set option, it additionally writes the FileDescriptorSet of each package,
+and the package's __init__.py uses this module to load it instead: the descriptor
+set is added to a descriptor pool of its own, and message classes are built when
+they are first accessed. If the descriptor set is missing, for example because the
+package data was not installed, the package imports the generated modules instead.
+
+Because each package has its own pool, the (package, definition) pairs of the
+vendored packages can never collide with those of google.transit.gtfs_realtime_pb2,
+or with the generated modules of the same package if they are imported too. The
+package names in the proto files are still rewritten by the vendorizer, so that
+the two approaches can be used interchangeably.
+"""
+import os
+import threading
+import typing
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import message_factory
+
+DESCRIPTOR_SET_FILENAME = "descriptor_set.pb"
+
+
+class DescriptorSetPackage:
+    """
+    The message classes of one vendored package, built from its descriptor set.
+
+    base_file_name is the name of the proto file whose messages are exposed as
+    attributes of the package, in the same way that the generated __init__.py
+    exposes the messages of the GTFS Realtime base proto file.
+    """
+
+    def __init__(self, descriptor_set_path: str, base_file_name: str):
+        self._descriptor_set_path = descriptor_set_path
+        self._base_file_name = base_file_name
+        self._lock = threading.RLock()
+        self._descriptor = None
+        self._factory = None
+        self._full_name_to_class = {}
+
+    @property
+    def descriptor(self):
+        if self._descriptor is None:
+            self._load()
+        return self._descriptor
+
+    def message_names(self) -> typing.List[str]:
+        return list(self.descriptor.message_types_by_name.keys())
+
+    def get(self, name: str):
+        """
+        Return the message class with the name in the base file, or the descriptor
+        of the base file if the name is DESCRIPTOR.
+        """
+        if name == "DESCRIPTOR":
+            return self.descriptor
+        message_descriptor = self.descriptor.message_types_by_name.get(name)
+        if message_descriptor is None:
+            raise AttributeError(name)
+        with self._lock:
+            return self._build_class(message_descriptor)
+
+    def _load(self):
+        with self._lock:
+            if self._descriptor is not None:
+                return
+            with open(self._descriptor_set_path, "rb") as f:
+                file_set = descriptor_pb2.FileDescriptorSet.FromString(f.read())
+            pool = descriptor_pool.DescriptorPool()
+            for file_proto in file_set.file:
+                pool.Add(file_proto)
+            self._factory = message_factory.MessageFactory(pool)
+            # As in MessageFactory.GetMessages, the extensions have to be registered
+            # with the classes they extend.
+            for file_proto in file_set.file:
+                file_descriptor = pool.FindFileByName(file_proto.name)
+                for extension in _iter_extensions(file_descriptor):
+                    extended_class = self._build_class(extension.containing_type)
+                    register_extension = getattr(
+                        extended_class, "RegisterExtension", None
+                    )
+                    if register_extension is not None:
+                        register_extension(extension)
+                    # Parsing an extension requires the class of its message type
+                    if extension.message_type is not None:
+                        self._build_class(extension.message_type)
+            self._descriptor = pool.FindFileByName(self._base_file_name)
+
+    def _build_class(self, message_descriptor):
+        full_name = message_descriptor.full_name
+        message_class = self._full_name_to_class.get(full_name)
+        if message_class is not None:
+            return message_class
+        get_message_class = getattr(message_factory, "GetMessageClass", None)
+        if get_message_class is not None:
+            message_class = get_message_class(message_descriptor)
+        else:
+            message_class = self._factory.GetPrototype(message_descriptor)
+        self._full_name_to_class[full_name] = message_class
+        # Nested messages are attributes of the generated classes, but not of the
+        # classes built by the message factory.
+        for nested_descriptor in message_descriptor.nested_types:
+            setattr(
+                message_class,
+                nested_descriptor.name,
+                self._build_class(nested_descriptor),
+            )
+        return message_class
+
+
+def _iter_extensions(file_descriptor):
+    yield from file_descriptor.extensions_by_name.values()
+    message_descriptors = list(file_descriptor.message_types_by_name.values())
+    while len(message_descriptors) > 0:
+        message_descriptor = message_descriptors.pop()
+        yield from message_descriptor.extensions
+        message_descriptors.extend(message_descriptor.nested_types)
+
+
+def has_descriptor_set(package_file: str) -> bool:
+    return os.path.exists(_descriptor_set_path(package_file))
+
+
+def _descriptor_set_path(package_file):
+    return os.path.join(os.path.dirname(package_file), DESCRIPTOR_SET_FILENAME)
+
+
+def package_accessors(
+    package_file: str, base_file_name: str, module_globals: typing.Dict[str, typing.Any]
+):
+    """
+    Return the module __getattr__ and __dir__ functions of a vendored package.
+
+    The descriptor set is read from the directory of package_file. Message classes
+    are cached in the module globals once built.
+    """
+    package = DescriptorSetPackage(_descriptor_set_path(package_file), base_file_name)
+
+    def __getattr__(name):
+        try:
+            value = package.get(name)
+        except AttributeError:
+            raise AttributeError(
+                f"module {module_globals['__name__']!r} has no attribute {name!r}"
+            ) from None
+        module_globals[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(module_globals.keys()) | set(package.message_names()))
+
+    return __getattr__, __dir__
@@ -19,13 +19,38 @@ file on disk relative to the current working directory. This vendorization scrip
 both cases - i.e., ensures that whichever way the package is determined it does not
 collide with the package of google.transit.gtfs_realtime_pb2. From trial and error,
 covering both cases seems to be necessary.
+
+With the descriptor set option, protoc also writes the serialized FileDescriptorSet
+of each package, and the package's __init__.py loads the message classes from it
+on demand using the descriptorsets module, rather than importing the generated
+modules. This is faster to import and uses less memory. The descriptor set is loaded
+into a descriptor pool of its own, so the namespacing above is preserved. The
+generated modules are still written, and the package imports them instead if the
+descriptor set is missing, for example when the package data was not installed.
+
+The vendorizer is run as a command:
+
+    python -m transiter_ny_mta.proto.gtfs_rt_vendorizer [--offline] [--force]
+
+The proto sources are downloaded into a local cache directory, and are only
+downloaded again when missing or if --refresh is passed; with --offline the build
+fails instead of downloading missing sources. A hash of the inputs of each package
+(the rewritten proto files, the protoc version and the templates below) is written
+to the package directory, and the package is only regenerated when the hash changes.
+The packages are generated in parallel. Each regenerated package is verified by
+importing it in a new Python process, checking that the MTA extension is
+registered, and timing the decoding of a synthetic feed built with it.
 """
 
+import argparse
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
 import os
-import requests
 import subprocess
-import importlib
-import dataclasses
+import sys
+import typing
 
 GTFS_RT_PROTO_URL = (
     "https://raw.githubusercontent.com/google/transit"
@@ -44,6 +69,58 @@ from . import {}
 MTA_EXTENSION_ID = {}
 
 """
+# The generated modules are the fallback if the descriptor set was not installed
+DESCRIPTOR_SET_INIT_PY_TEMPLATE = """
+from .. import descriptorsets
+
+MTA_EXTENSION_ID = {0}
+
+if descriptorsets.has_descriptor_set(__file__):
+    __getattr__, __dir__ = descriptorsets.package_accessors(
+        __file__, "{1}", globals()
+    )
+else:
+    from .{2} import *
+    from . import {3}
+    from . import {4}
+
+"""
+DESCRIPTOR_SET_FILENAME = "descriptor_set.pb"
+INPUTS_HASH_FILENAME = "inputs.sha256"
+CACHE_DIR_ENV_VARIABLE = "TRANSITER_NY_MTA_PROTO_CACHE"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "transiter-ny-mta", "proto-sources"
+)
+DEFAULT_VERIFY_ITERATIONS = 20
+
+# Run in a new Python process to verify a generated package. The package is
+# imported from its directory under its usual module name, so that the synthetic
+# feed generators build feeds with it.
+_VERIFY_SCRIPT = """
+import importlib.util
+import json
+import sys
+import time
+
+module_name = "transiter_ny_mta.proto.{directory}"
+spec = importlib.util.spec_from_file_location(
+    module_name, {init_path!r}, submodule_search_locations=[{package_path!r}]
+)
+package = importlib.util.module_from_spec(spec)
+sys.modules[module_name] = package
+spec.loader.exec_module(package)
+
+from transiter_ny_mta import syntheticfeeds
+
+assert {mta_extension_id} in package.FeedHeader._extensions_by_number
+content = syntheticfeeds.{feed_generator}().next_snapshot()
+feed_message = package.FeedMessage()
+start = time.perf_counter()
+for _ in range({iterations}):
+    feed_message.ParseFromString(content)
+duration = (time.perf_counter() - start) / {iterations}
+print(json.dumps({{"entities": len(feed_message.entity), "decode_seconds": duration}}))
+"""
 
 
 @dataclasses.dataclass
@@ -51,6 +128,8 @@ class Config:
     key: str
     mta_ext_proto_url: str
     mta_extension_id: int
+    # The name of the generator in the syntheticfeeds module used for verification
+    feed_generator: str
 
     @property
     def directory(self):
@@ -68,6 +147,14 @@ class Config:
     def transiter_filename(self):
         return self._build_proto_path("transiter-extension")
 
+    @property
+    def url_to_filename(self) -> typing.Dict[str, str]:
+        return {
+            GTFS_RT_PROTO_URL: self.gtfs_rt_filename,
+            TRANSITER_EXT_PROTO_URL: self.transiter_filename,
+            self.mta_ext_proto_url: self.mta_filename,
+        }
+
     def _build_proto_path(self, postfix):
         return f"transiter-ny-mta-{self.key}-{postfix}.proto"
 
@@ -80,6 +167,7 @@ alerts_config = Config(
         "gtfs-realtime-service-status.proto"
     ),
     mta_extension_id=1001,
+    feed_generator="AlertsFeedGenerator",
 )
 subway_trips_config = Config(
     key="subwaytrips",
@@ -89,38 +177,162 @@ subway_trips_config = Config(
         "gtfs-realtime-NYCT.proto"
     ),
     mta_extension_id=1001,
+    feed_generator="SubwayFeedGenerator",
 )
+CONFIGS = [alerts_config, subway_trips_config]
+
+
+class VendorizerError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class Verification:
+    entities: int
+    # The mean time to decode the synthetic feed, in seconds
+    decode_seconds: float
+
+
+def source_filename(url: str) -> str:
+    return url.rsplit("/", 1)[-1]
+
+
+def load_sources(
+    urls: typing.Iterable[str],
+    cache_dir: str,
+    offline: bool = False,
+    refresh: bool = False,
+) -> typing.Dict[str, str]:
+    """
+    Return the proto source at each URL, downloading it into the cache if needed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    url_to_source = {}
+    for url in urls:
+        path = os.path.join(cache_dir, source_filename(url))
+        if refresh or not os.path.exists(path):
+            if offline:
+                raise VendorizerError(
+                    f"{source_filename(url)} is not in the cache {cache_dir} and "
+                    f"cannot be downloaded offline"
+                )
+            print(f"Downloading {url}")
+            _write(path, _download(url))
+        with open(path) as f:
+            url_to_source[url] = f.read()
+    return url_to_source
+
+
+def _download(url):
+    # Imported here so that offline builds do not need requests
+    import requests
+
+    response = requests.get(url)
+    response.raise_for_status()
+    return response.text
+
+
+def protoc_version() -> str:
+    try:
+        result = subprocess.run(
+            ["protoc", "--version"],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+    except FileNotFoundError:
+        raise VendorizerError("protoc was not found on the PATH") from None
+    return result.stdout.strip()
+
+
+def build_protos(
+    config: Config, url_to_source: typing.Dict[str, str]
+) -> typing.Dict[str, str]:
+    """
+    Return the rewritten proto files of the package, by filename.
+    """
+    return {
+        filename: _substitute_package_settings(url_to_source[url], config)
+        for url, filename in config.url_to_filename.items()
+    }
+
 
+def inputs_hash(
+    config: Config,
+    protos: typing.Dict[str, str],
+    protoc_version: str,
+    descriptor_set: bool,
+) -> str:
+    inputs = {
+        "protos": protos,
+        "protoc_version": protoc_version,
+        "descriptor_set": descriptor_set,
+        "mta_extension_id": config.mta_extension_id,
+        "init_py_template": (
+            DESCRIPTOR_SET_INIT_PY_TEMPLATE if descriptor_set else INIT_PY_TEMPLATE
+        ),
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode("utf-8")
+    ).hexdigest()
 
-def run(config: Config):
-    directory = os.path.join(os.path.dirname(__file__), config.directory)
+
+def is_up_to_date(
+    config: Config, output_dir: str, expected_hash: str, descriptor_set: bool = False
+) -> bool:
+    directory = os.path.join(output_dir, config.directory)
+    try:
+        with open(os.path.join(directory, INPUTS_HASH_FILENAME)) as f:
+            if f.read().strip() != expected_hash:
+                return False
+    except FileNotFoundError:
+        return False
+    return all(
+        os.path.exists(os.path.join(directory, filename))
+        for filename in _output_filenames(config, descriptor_set)
+    )
+
+
+def _output_filenames(config: Config, descriptor_set: bool):
+    yield "__init__.py"
+    if descriptor_set:
+        yield DESCRIPTOR_SET_FILENAME
+    for filename in config.url_to_filename.values():
+        yield filename
+        yield _proto_to_pb2(filename) + ".py"
+
+
+def run(
+    config: Config,
+    protos: typing.Dict[str, str],
+    output_dir: str,
+    descriptor_set: bool = False,
+):
+    """
+    Generate the package of the config in the output directory.
+    """
+    directory = os.path.join(output_dir, config.directory)
     os.makedirs(directory, exist_ok=True)
 
-    for url, filename in [
-        (GTFS_RT_PROTO_URL, config.gtfs_rt_filename),
-        (TRANSITER_EXT_PROTO_URL, config.transiter_filename),
-        (config.mta_ext_proto_url, config.mta_filename),
-    ]:
+    for filename, proto in protos.items():
         print(f"[{config.key}] Generating {filename}")
-        response = requests.get(url)
-        response.raise_for_status()
-        raw_proto = response.text
-        proto = _substitute_package_settings(raw_proto, config)
-        with open(os.path.join(directory, filename), "w") as f:
-            f.write(proto)
+        _write(os.path.join(directory, filename), proto)
 
     print(f"[{config.key}] Compiling protobufs")
-    subprocess.run(
-        [
-            "protoc",
-            "--python_out=.",
-            "--proto_path=.",
-            config.gtfs_rt_filename,
-            config.transiter_filename,
-            config.mta_filename,
-        ],
+    protoc_args = ["protoc", "--python_out=.", "--proto_path=."]
+    if descriptor_set:
+        protoc_args.extend(
+            [f"--descriptor_set_out={DESCRIPTOR_SET_FILENAME}", "--include_imports"]
+        )
+    result = subprocess.run(
+        protoc_args
+        + [config.gtfs_rt_filename, config.transiter_filename, config.mta_filename],
         cwd=directory,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
     )
+    if result.returncode != 0:
+        raise VendorizerError(f"[{config.key}] protoc failed:\n{result.stderr}")
 
     for filename in [
         config.transiter_filename,
@@ -133,27 +345,91 @@ def run(config: Config):
         content = content.replace(
             "import transiter_ny_mta", "from . import transiter_ny_mta"
         )
-        with open(os.path.join(directory, filename), "w") as f:
-            f.write(content)
+        _write(os.path.join(directory, filename), content)
 
     print(f"[{config.key}] Writing __init__.py")
-    with open(os.path.join(directory, "__init__.py"), "w") as f:
-        f.write(
-            INIT_PY_TEMPLATE.format(
-                _proto_to_pb2(config.gtfs_rt_filename),
-                _proto_to_pb2(config.transiter_filename),
-                _proto_to_pb2(config.mta_filename),
-                config.mta_extension_id,
-            )
+    if descriptor_set:
+        init_py = DESCRIPTOR_SET_INIT_PY_TEMPLATE.format(
+            config.mta_extension_id,
+            config.gtfs_rt_filename,
+            _proto_to_pb2(config.gtfs_rt_filename),
+            _proto_to_pb2(config.transiter_filename),
+            _proto_to_pb2(config.mta_filename),
+        )
+    else:
+        init_py = INIT_PY_TEMPLATE.format(
+            _proto_to_pb2(config.gtfs_rt_filename),
+            _proto_to_pb2(config.transiter_filename),
+            _proto_to_pb2(config.mta_filename),
+            config.mta_extension_id,
         )
+    _write(os.path.join(directory, "__init__.py"), init_py)
+
+
+def verify(
+    config: Config, output_dir: str, iterations: int = DEFAULT_VERIFY_ITERATIONS
+) -> Verification:
+    """
+    Import the generated package in a new Python process and benchmark decoding.
+    """
+    package_path = os.path.abspath(os.path.join(output_dir, config.directory))
+    script = _VERIFY_SCRIPT.format(
+        directory=config.directory,
+        init_path=os.path.join(package_path, "__init__.py"),
+        package_path=package_path,
+        mta_extension_id=config.mta_extension_id,
+        feed_generator=config.feed_generator,
+        iterations=iterations,
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        raise VendorizerError(
+            f"[{config.key}] Failed to import the generated package:\n{result.stderr}"
+        )
+    return Verification(**json.loads(result.stdout))
 
-    print(f"[{config.key}] Attempting to import generated module...")
-    try:
-        importlib.import_module(".alerts_pb2", "transiter_ny_mta.proto")
-        print(f"[{config.key}] Success")
-    except Exception:
-        print(f"[{config.key}] Failed! Exiting with stack trace:")
-        raise
+
+def vendorize(
+    config: Config,
+    protos: typing.Dict[str, str],
+    output_dir: str,
+    protoc_version: str,
+    descriptor_set: bool = True,
+    force: bool = False,
+    verify_iterations: typing.Optional[int] = DEFAULT_VERIFY_ITERATIONS,
+) -> bool:
+    """
+    Generate and verify the package if its inputs changed; return whether it did.
+
+    The hash of the inputs is only written once the package has been verified. If
+    verify_iterations is None the package is not verified.
+    """
+    expected_hash = inputs_hash(config, protos, protoc_version, descriptor_set)
+    if not force and is_up_to_date(config, output_dir, expected_hash, descriptor_set):
+        print(f"[{config.key}] Up to date")
+        return False
+    run(config, protos, output_dir, descriptor_set)
+    if verify_iterations is not None:
+        print(f"[{config.key}] Verifying the generated package")
+        verification = verify(config, output_dir, verify_iterations)
+        print(
+            f"[{config.key}] Decoded a synthetic feed with {verification.entities} "
+            f"entities in {verification.decode_seconds * 1000:.2f} ms"
+        )
+    _write(
+        os.path.join(output_dir, config.directory, INPUTS_HASH_FILENAME), expected_hash
+    )
+    return True
+
+
+def _write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
 
 
 def _proto_to_pb2(filename):
@@ -176,5 +452,100 @@ def _substitute_package_settings(proto: str, config: Config):
     return "\n".join(output)
 
 
-run(alerts_config)
-run(subway_trips_config)
+def main(argv=None) -> int:
+    key_to_config = {config.key: config for config in CONFIGS}
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.proto.gtfs_rt_vendorizer",
+        description="Vendorize the GTFS Realtime protobuf packages.",
+    )
+    parser.add_argument(
+        "packages",
+        nargs="*",
+        help="packages to generate, out of {}; defaults to all of them".format(
+            ", ".join(key_to_config.keys())
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get(CACHE_DIR_ENV_VARIABLE, DEFAULT_CACHE_DIR),
+        help=f"directory of the proto source cache; defaults to the "
+        f"{CACHE_DIR_ENV_VARIABLE} environment variable or {DEFAULT_CACHE_DIR}",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.path.dirname(os.path.abspath(__file__)),
+        help="directory to generate the packages in; defaults to this directory",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="fail instead of downloading proto sources missing from the cache",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="download the proto sources even if they are in the cache",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate the packages even if their inputs are unchanged",
+    )
+    parser.add_argument(
+        "--no-descriptor-set",
+        dest="descriptor_set",
+        action="store_false",
+        help="import the generated modules in the package __init__.py instead of "
+        "loading the descriptor set",
+    )
+    parser.add_argument(
+        "--verify-iterations",
+        type=int,
+        default=DEFAULT_VERIFY_ITERATIONS,
+        help="number of times to decode the synthetic feed when verifying",
+    )
+    parser.add_argument(
+        "--no-verify",
+        dest="verify",
+        action="store_false",
+        help="skip verifying the generated packages",
+    )
+    args = parser.parse_args(argv)
+    for key in args.packages:
+        if key not in key_to_config:
+            parser.error(f"unknown package {key}")
+    configs = [
+        config for config in CONFIGS if not args.packages or config.key in args.packages
+    ]
+    urls = []
+    for config in configs:
+        for url in config.url_to_filename.keys():
+            if url not in urls:
+                urls.append(url)
+    try:
+        url_to_source = load_sources(urls, args.cache_dir, args.offline, args.refresh)
+        version = protoc_version()
+        with concurrent.futures.ThreadPoolExecutor(len(configs)) as executor:
+            futures = [
+                executor.submit(
+                    vendorize,
+                    config,
+                    build_protos(config, url_to_source),
+                    args.output_dir,
+                    version,
+                    args.descriptor_set,
+                    args.force,
+                    args.verify_iterations if args.verify else None,
+                )
+                for config in configs
+            ]
+            for future in futures:
+                future.result()
+    except VendorizerError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,522 @@
+"""
+Replay an archive of feed payloads through the parsers, for end to end throughput
+testing.
+
+Every snapshot in the archive (see the archive module) is loaded into a parser for
+its feed, a SubwayTripsParser or, for the alerts feeds, an AlertsParser, and the
+parser's output is fully materialized. One parser is kept per feed, as in Transiter,
+so that options that carry state between loads take effect. Snapshots are replayed
+in timestamp order, either as fast as possible or at a multiple of real time; the
+archive can be replayed several times in a row to simulate hours of operation from
+a shorter recording, with the timestamps shifted on each loop.
+
+With workers, each feed is assigned to one worker process so that its snapshots
+are still parsed in order by the same parser, and snapshots of different feeds are
+parsed concurrently.
+
+The report contains the sustained snapshots per second, the ratio of simulated time
+to wall time, the distribution of each feed's parse latency, how far the replay fell
+behind schedule when replaying at a multiple of real time, and samples of the
+resident set size (and, optionally, the memory traced by tracemalloc) taken as the
+replay progresses, from which the memory growth is computed. With workers, memory is
+measured in the workers and summed.
+
+Usage:
+
+    python -m transiter_ny_mta.replay feeds.archive --speed 10 --loops 100
+    python -m transiter_ny_mta.replay --synthetic 100 --poll-interval 2
+"""
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import traceback
+import typing
+
+from transiter_ny_mta import alertsparser
+from transiter_ny_mta import archive
+from transiter_ny_mta import benchmark
+from transiter_ny_mta import subwaytripsparser
+from transiter_ny_mta import syntheticfeeds
+
+ALERTS_FEED_IDS = ("gtfsrealtime-alerts",)
+DEFAULT_SAMPLE_EVERY = 100
+DEFAULT_POLL_INTERVAL = 2
+# The maximum number of snapshots waiting to be parsed per worker
+_MAX_PENDING_PER_WORKER = 4
+
+
+@dataclasses.dataclass
+class FeedStats:
+    feed_id: str
+    # The parse latency of each snapshot, in seconds
+    durations: typing.List[float] = dataclasses.field(default_factory=list)
+    errors: int = 0
+
+    def percentile(self, q: float) -> float:
+        return benchmark.percentile(self.durations, q)
+
+
+@dataclasses.dataclass
+class MemorySample:
+    # The number of snapshots replayed when the sample was taken
+    snapshots: int
+    rss: typing.Optional[int]
+    # None unless memory is traced
+    traced: typing.Optional[int] = None
+
+
+@dataclasses.dataclass
+class ReplayReport:
+    snapshots: int = 0
+    # In seconds
+    wall_duration: float = 0.0
+    # The time between the first and last snapshot replayed, in seconds
+    simulated_duration: float = 0.0
+    # How far behind schedule the latest snapshot finished parsing, in seconds; only
+    # set when replaying at a multiple of real time
+    max_lag: typing.Optional[float] = None
+    feed_id_to_stats: typing.Dict[str, FeedStats] = dataclasses.field(
+        default_factory=dict
+    )
+    memory_samples: typing.List[MemorySample] = dataclasses.field(default_factory=list)
+    # The first error of each feed that failed to parse
+    feed_id_to_error: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @property
+    def snapshots_per_second(self) -> float:
+        if self.wall_duration == 0:
+            return float("inf")
+        return self.snapshots / self.wall_duration
+
+    @property
+    def speedup(self) -> float:
+        """
+        The simulated time divided by the wall time.
+        """
+        if self.wall_duration == 0:
+            return float("inf")
+        return self.simulated_duration / self.wall_duration
+
+    @property
+    def rss_growth(self) -> typing.Optional[int]:
+        return self._growth("rss")
+
+    @property
+    def traced_growth(self) -> typing.Optional[int]:
+        return self._growth("traced")
+
+    def _growth(self, attribute):
+        values = [
+            getattr(sample, attribute)
+            for sample in self.memory_samples
+            if getattr(sample, attribute) is not None
+        ]
+        if len(values) < 2:
+            return None
+        return values[-1] - values[0]
+
+    def format(self) -> str:
+        lines = [
+            f"snapshots:    {self.snapshots} in {self.wall_duration:.1f} s "
+            f"({self.snapshots_per_second:.1f} snapshots/s)",
+            f"simulated:    {self.simulated_duration:.0f} s "
+            f"({self.speedup:.1f}x real time)",
+        ]
+        if self.max_lag is not None:
+            lines.append(f"max lag:      {self.max_lag * 1000:.1f} ms")
+        if self.rss_growth is not None:
+            lines.append(
+                f"RSS growth:   {self.rss_growth / 1024:.0f} KiB "
+                f"(last {self.memory_samples[-1].rss / 1024:.0f} KiB)"
+            )
+        if self.traced_growth is not None:
+            lines.append(f"traced growth: {self.traced_growth / 1024:.0f} KiB")
+        lines.append(
+            "{:<24} {:>9} {:>7} {:>10} {:>10} {:>10} {:>10}".format(
+                "feed",
+                "snapshots",
+                "errors",
+                "p50 (ms)",
+                "p90 (ms)",
+                "p99 (ms)",
+                "max (ms)",
+            )
+        )
+        for feed_id, stats in sorted(self.feed_id_to_stats.items()):
+            if len(stats.durations) == 0:
+                continue
+            lines.append(
+                "{:<24} {:>9} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    feed_id,
+                    len(stats.durations),
+                    stats.errors,
+                    stats.percentile(50) * 1000,
+                    stats.percentile(90) * 1000,
+                    stats.percentile(99) * 1000,
+                    max(stats.durations) * 1000,
+                )
+            )
+        for feed_id, error in sorted(self.feed_id_to_error.items()):
+            lines.append(f"{feed_id} failed: {error}")
+        return "\n".join(lines)
+
+
+class _Replayer:
+    """
+    Parses snapshots using one parser per feed.
+    """
+
+    def __init__(self, trips_options, alerts_options, alerts_feed_ids):
+        self._trips_options = trips_options
+        self._alerts_options = alerts_options
+        self._alerts_feed_ids = alerts_feed_ids
+        self._feed_id_to_parser = {}
+
+    def parse(self, feed_id, payload):
+        """
+        Return the parse duration, and the formatted exception if parsing failed.
+        """
+        start = time.perf_counter()
+        try:
+            parser = self._get_parser(feed_id)
+            parser.load_content(payload)
+            if isinstance(parser, alertsparser.AlertsParser):
+                list(parser.get_alerts())
+            else:
+                parser.get_timestamp()
+                list(parser.get_trips())
+                list(parser.get_vehicles())
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        return time.perf_counter() - start, error
+
+    def _get_parser(self, feed_id):
+        parser = self._feed_id_to_parser.get(feed_id)
+        if parser is not None:
+            return parser
+        if feed_id in self._alerts_feed_ids:
+            parser = alertsparser.AlertsParser()
+            parser.load_options(self._alerts_options)
+        else:
+            parser = subwaytripsparser.SubwayTripsParser()
+            parser.load_options({**(self._trips_options or {}), "feed_id": feed_id})
+        self._feed_id_to_parser[feed_id] = parser
+        return parser
+
+
+def replay(
+    archive_path: str,
+    speed: typing.Optional[float] = None,
+    workers: int = 0,
+    loops: int = 1,
+    feed_ids: typing.Optional[typing.Iterable[str]] = None,
+    trips_options: typing.Optional[dict] = None,
+    alerts_options: typing.Optional[dict] = None,
+    alerts_feed_ids: typing.Iterable[str] = ALERTS_FEED_IDS,
+    sample_every: int = DEFAULT_SAMPLE_EVERY,
+    trace_memory: bool = False,
+) -> ReplayReport:
+    """
+    Replay the archive and return the report.
+
+    If speed is None, snapshots are replayed as fast as possible; otherwise, at speed
+    times real time. If workers is 0, snapshots are parsed in this process. Memory is
+    sampled every sample_every snapshots and at the end of the replay.
+    """
+    alerts_feed_ids = frozenset(alerts_feed_ids)
+    if feed_ids is not None:
+        feed_ids = frozenset(feed_ids)
+    report = ReplayReport()
+    with archive.ArchiveReader(archive_path) as reader:
+        if feed_ids is None:
+            feed_ids = frozenset(reader.feed_ids())
+        time_range = reader.time_range()
+        if time_range is None:
+            return report
+        # Each loop starts one median poll interval after the previous one ends
+        loop_duration = time_range[1] - time_range[0] + _median_interval(reader)
+        if workers > 0:
+            driver = _PoolDriver(
+                workers, trips_options, alerts_options, alerts_feed_ids, trace_memory
+            )
+        else:
+            driver = _SerialDriver(
+                trips_options, alerts_options, alerts_feed_ids, trace_memory
+            )
+        if speed is not None:
+            report.max_lag = 0.0
+        start = time.perf_counter()
+
+        def on_parsed(feed_id, duration, error, scheduled):
+            stats = report.feed_id_to_stats.get(feed_id)
+            if stats is None:
+                stats = report.feed_id_to_stats[feed_id] = FeedStats(feed_id)
+            stats.durations.append(duration)
+            if error is not None:
+                stats.errors += 1
+                report.feed_id_to_error.setdefault(feed_id, error)
+            report.snapshots += 1
+            if scheduled is not None:
+                report.max_lag = max(
+                    report.max_lag, time.perf_counter() - start - scheduled
+                )
+            if report.snapshots % sample_every == 0:
+                report.memory_samples.append(driver.sample_memory(report.snapshots))
+
+        try:
+            for loop in range(loops):
+                for record in reader.records():
+                    if record.feed_id not in feed_ids:
+                        continue
+                    simulated = record.timestamp - time_range[0] + loop * loop_duration
+                    scheduled = None
+                    if speed is not None:
+                        scheduled = simulated / speed
+                        delay = scheduled - (time.perf_counter() - start)
+                        if delay > 0:
+                            time.sleep(delay)
+                    report.simulated_duration = simulated
+                    driver.submit(record.feed_id, record.payload, scheduled, on_parsed)
+                    if isinstance(record.payload, memoryview):
+                        record.payload.release()
+            driver.wait(on_parsed)
+            report.wall_duration = time.perf_counter() - start
+            report.memory_samples.append(driver.sample_memory(report.snapshots))
+        finally:
+            driver.close()
+    return report
+
+
+class _SerialDriver:
+    def __init__(self, trips_options, alerts_options, alerts_feed_ids, trace_memory):
+        self._replayer = _Replayer(trips_options, alerts_options, alerts_feed_ids)
+        self._trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+
+    def submit(self, feed_id, payload, scheduled, on_parsed):
+        duration, error = self._replayer.parse(feed_id, payload)
+        on_parsed(feed_id, duration, error, scheduled)
+
+    def wait(self, on_parsed):
+        pass
+
+    def sample_memory(self, snapshots):
+        traced = tracemalloc.get_traced_memory()[0] if self._trace_memory else None
+        return MemorySample(snapshots=snapshots, rss=_rss(), traced=traced)
+
+    def close(self):
+        if self._trace_memory:
+            tracemalloc.stop()
+
+
+class _PoolDriver:
+    """
+    Parses the snapshots of each feed in one single process pool, so that they are
+    parsed in order by one parser.
+    """
+
+    def __init__(
+        self, workers, trips_options, alerts_options, alerts_feed_ids, trace_memory
+    ):
+        self._executors = [
+            concurrent.futures.ProcessPoolExecutor(
+                1,
+                initializer=_initialize_worker,
+                initargs=(trips_options, alerts_options, alerts_feed_ids, trace_memory),
+            )
+            for _ in range(workers)
+        ]
+        self._feed_id_to_executor = {}
+        self._pending = collections.deque()
+        # The latest memory measurement of each worker
+        self._executor_to_memory = {}
+
+    def submit(self, feed_id, payload, scheduled, on_parsed):
+        executor = self._feed_id_to_executor.get(feed_id)
+        if executor is None:
+            executor = self._executors[
+                len(self._feed_id_to_executor) % len(self._executors)
+            ]
+            self._feed_id_to_executor[feed_id] = executor
+        future = executor.submit(_parse_in_worker, feed_id, bytes(payload))
+        self._pending.append((executor, feed_id, scheduled, future))
+        while len(self._pending) > _MAX_PENDING_PER_WORKER * len(self._executors):
+            self._complete_oldest(on_parsed)
+
+    def wait(self, on_parsed):
+        while self._pending:
+            self._complete_oldest(on_parsed)
+
+    def sample_memory(self, snapshots):
+        if len(self._executor_to_memory) == 0:
+            return MemorySample(snapshots=snapshots, rss=None)
+        rss_values = [rss for rss, _ in self._executor_to_memory.values()]
+        traced_values = [traced for _, traced in self._executor_to_memory.values()]
+        return MemorySample(
+            snapshots=snapshots,
+            rss=None if None in rss_values else sum(rss_values),
+            traced=None if None in traced_values else sum(traced_values),
+        )
+
+    def close(self):
+        # Executor.shutdown only supports cancel_futures from Python 3.9
+        for _, _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def _complete_oldest(self, on_parsed):
+        executor, feed_id, scheduled, future = self._pending.popleft()
+        try:
+            duration, error, rss, traced = future.result()
+            self._executor_to_memory[executor] = (rss, traced)
+        except Exception:
+            # For example, the worker process died
+            duration, error = 0.0, traceback.format_exc()
+        on_parsed(feed_id, duration, error, scheduled)
+
+
+# State of the worker processes
+_replayer = None
+_trace_memory = False
+
+
+def _initialize_worker(trips_options, alerts_options, alerts_feed_ids, trace_memory):
+    global _replayer, _trace_memory
+    _replayer = _Replayer(trips_options, alerts_options, alerts_feed_ids)
+    _trace_memory = trace_memory
+    if trace_memory:
+        tracemalloc.start()
+
+
+def _parse_in_worker(feed_id, payload):
+    duration, error = _replayer.parse(feed_id, payload)
+    traced = tracemalloc.get_traced_memory()[0] if _trace_memory else None
+    return duration, error, _rss(), traced
+
+
+def _rss() -> typing.Optional[int]:
+    """
+    Return the resident set size of this process in bytes, if it can be measured.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _median_interval(reader) -> float:
+    """
+    Return the median time between consecutive snapshots of the same feed.
+    """
+    intervals = []
+    for feed_id in reader.feed_ids():
+        timestamps = reader.timestamps(feed_id)
+        intervals.extend(
+            timestamp - previous
+            for previous, timestamp in zip(timestamps, timestamps[1:])
+        )
+    if len(intervals) == 0:
+        return 0.0
+    return benchmark.percentile(intervals, 50)
+
+
+def write_synthetic_archive(
+    path: str,
+    num_polls: int,
+    poll_interval: int = DEFAULT_POLL_INTERVAL,
+    scale: float = 1,
+    seed: int = 0,
+    compression: str = archive.NONE,
+) -> None:
+    """
+    Write an archive of num_polls polls of synthetic versions of all of the subway
+    trip feeds and the alerts feed.
+    """
+    feed_id_to_generator = {
+        feed_id: syntheticfeeds.SubwayFeedGenerator(
+            seed=seed, feed_id=feed_id, scale=scale, poll_interval=poll_interval
+        )
+        for feed_id in syntheticfeeds.FEED_ID_TO_NUM_TRIPS.keys()
+    }
+    for feed_id in ALERTS_FEED_IDS:
+        feed_id_to_generator[feed_id] = syntheticfeeds.AlertsFeedGenerator(
+            seed=seed, scale=scale, poll_interval=poll_interval
+        )
+    with archive.ArchiveWriter(path, compression) as writer:
+        for i in range(num_polls):
+            timestamp = syntheticfeeds.DEFAULT_START_TIME + i * poll_interval
+            for feed_id, generator in feed_id_to_generator.items():
+                writer.append(feed_id, timestamp, generator.next_snapshot())
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.replay",
+        description="Replay an archive of feed payloads through the parsers.",
+    )
+    parser.add_argument("archive", nargs="?")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="POLLS",
+        help="replay a temporary archive of this many polls of synthetic feeds",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=int,
+        default=DEFAULT_POLL_INTERVAL,
+        help="seconds between the polls of the synthetic archive",
+    )
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="multiple of real time to replay at; defaults to as fast as possible",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="number of worker processes; defaults to parsing in this process",
+    )
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--feeds", nargs="+", help="the feed IDs to replay")
+    parser.add_argument("--sample-every", type=int, default=DEFAULT_SAMPLE_EVERY)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args(argv)
+    if (args.archive is None) == (args.synthetic is None):
+        parser.error("pass either an archive or --synthetic")
+    kwargs = dict(
+        speed=args.speed,
+        workers=args.workers,
+        loops=args.loops,
+        feed_ids=args.feeds,
+        sample_every=args.sample_every,
+        trace_memory=args.trace_memory,
+    )
+    if args.archive is not None:
+        report = replay(args.archive, **kwargs)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "synthetic.archive")
+            write_synthetic_archive(
+                path, args.synthetic, args.poll_interval, args.scale
+            )
+            report = replay(path, **kwargs)
+    print(report.format())
+    return 1 if report.feed_id_to_error else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Filter of the entities of a serialized feed by route, applied before decoding.
+
+The route ID of each feed entity's trip update or vehicle is read from the wire
+format, and entities on routes that are not wanted are removed from the content
+without being decoded. An entity is kept if its trip update or its vehicle is on a
+wanted route. Entities with neither a trip update nor a vehicle, such as alerts,
+are always kept.
+
+Decisions are made once per distinct route ID in the feed and then looked up, so
+the cost per entity is reading its route ID.
+"""
+import typing
+
+from transiter_ny_mta import wireformat
+
+
+class RouteFilter:
+    """
+    Keeps the entities whose route is in include (if given) and not in exclude.
+
+    include and exclude contain route IDs as they appear after the parser's route
+    fixes. Route IDs in the feed are first mapped through aliases, and trip updates
+    whose route ID in the feed is in always_exclude are removed regardless of
+    include. Like the parser's route fixes, always_exclude does not apply to vehicles.
+    """
+
+    def __init__(
+        self,
+        include: typing.Optional[typing.Iterable[str]] = None,
+        exclude: typing.Optional[typing.Iterable[str]] = None,
+        aliases: typing.Optional[typing.Dict[str, str]] = None,
+        always_exclude: typing.Iterable[typing.Optional[str]] = (),
+    ):
+        self._include = None if include is None else frozenset(include)
+        self._exclude = frozenset(exclude or ())
+        self._aliases = dict(aliases or {})
+        self._always_exclude = frozenset(always_exclude)
+        self._route_id_to_keep = {}
+        self._vehicle_route_id_to_keep = {}
+
+    def keeps(self, route_id: typing.Optional[str], vehicle: bool = False) -> bool:
+        """
+        Return whether trip updates, or vehicles, with the route ID in the feed are
+        kept.
+        """
+        route_id_to_keep = (
+            self._vehicle_route_id_to_keep if vehicle else self._route_id_to_keep
+        )
+        try:
+            return route_id_to_keep[route_id]
+        except KeyError:
+            pass
+        if not vehicle and route_id in self._always_exclude:
+            keep = False
+        else:
+            fixed_route_id = self._aliases.get(route_id, route_id)
+            keep = (
+                self._include is None or fixed_route_id in self._include
+            ) and fixed_route_id not in self._exclude
+        route_id_to_keep[route_id] = keep
+        return keep
+
+    def filter_content(self, content: bytes) -> typing.Tuple[bytes, int, int]:
+        """
+        Return the content without the entities of excluded routes.
+
+        The number of entities in the content and the number removed are also
+        returned. If no entities are removed, the content is returned as is.
+        """
+        view = memoryview(content)
+        pieces = []
+        num_entities = 0
+        num_removed = 0
+        for field in wireformat.iter_fields(view):
+            if (
+                field.number == wireformat.FEED_MESSAGE_ENTITY
+                and field.wire_type == wireformat.LENGTH_DELIMITED
+            ):
+                num_entities += 1
+                number_to_route_id = wireformat.entity_route_ids(
+                    view, field.value_start, field.end
+                )
+                if len(number_to_route_id) > 0 and not any(
+                    self.keeps(route_id, number == wireformat.FEED_ENTITY_VEHICLE)
+                    for number, route_id in number_to_route_id.items()
+                ):
+                    num_removed += 1
+                    continue
+            pieces.append(view[field.start : field.end])
+        if num_removed == 0:
+            return content, num_entities, 0
+        return b"".join(pieces), num_entities, num_removed
@@ -0,0 +1,409 @@
+"""
+A local stand-in for the MTA API and the other feed URLs in the Transiter configs.
+
+The server serves feed payloads at the same paths as the URLs in the
+transiter_config_*.yaml files, so that fetching and parsing can be developed and
+load tested without the real API. The payloads of each feed are either:
+
+- a recorded sequence of snapshots, replayed at real time or faster,
+- snapshots from one of the synthetic feed generators, advanced as time passes, or
+- a fixed payload.
+
+The server's clock runs at a configurable speed, so that, for example, at speed 10
+a feed recorded every 5 seconds changes every half second. Paths under the MTA API
+require the X-API-KEY header if an API key is set. Responses carry an ETag and are
+gzip compressed if requested, and faults can be injected: latency, 5xx errors,
+bodies truncated part way and stale repeats of the previous payload.
+
+Usage:
+
+    python -m transiter_ny_mta.standinserver --synthetic --speed 10 --port 8080
+    python -m transiter_ny_mta.standinserver --recorded recordings/ --error-rate 0.1
+
+A recordings directory contains one file per snapshot at
+<system>/<feed ID>/<unix timestamp>.pb, where the systems and feed IDs are the keys
+of FEED_PATHS.
+"""
+import abc
+import argparse
+import bisect
+import dataclasses
+import gzip
+import hashlib
+import http.server
+import os
+import random
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+
+from transiter_ny_mta import fetcher
+from transiter_ny_mta import syntheticfeeds
+
+MTA_API_PREFIX = urllib.parse.urlsplit(fetcher.MTA_API_BASE_URL).path
+API_KEY_HEADER = fetcher.API_KEY_HEADER
+
+# The paths of the feed URLs in the Transiter configs, by (system, feed ID). The
+# system is the name of the config file without the transiter_config_ prefix.
+FEED_PATHS = {
+    ("nyc_subway", "gtfsstatic"): "/developers/data/nyct/subway/google_transit.zip",
+    ("nyc_subway", "DirectionRules"): "/developers/data/nyct/subway/Stations.csv",
+    **{
+        ("nyc_subway", feed_id): MTA_API_PREFIX + path
+        for feed_id, path in fetcher.SUBWAY_FEED_ID_TO_PATH.items()
+    },
+    ("long_island_railroad", "gtfsstatic"): (
+        "/developers/data/lirr/google_transit.zip"
+    ),
+    ("long_island_railroad", "gtfsrealtime-trips"): MTA_API_PREFIX + "lirr%2Fgtfs-lirr",
+    ("long_island_railroad", "gtfsrealtime-alerts"): MTA_API_PREFIX
+    + "camsys%2Flirr-alerts",
+    ("path_train", "gtfsstatic"): "/gtfs/path-nj-us/path-nj-us.zip",
+    ("path_train", "gtfsrealtime-trips"): "/gtfsrt",
+}
+RECORDING_EXTENSION = ".pb"
+
+
+class Feed(abc.ABC):
+    """
+    The payloads of a feed as a function of the time since the server started.
+    """
+
+    @abc.abstractmethod
+    def payload(self, elapsed: float) -> bytes:
+        pass
+
+
+class StaticFeed(Feed):
+    def __init__(self, content: bytes):
+        self._content = content
+
+    def payload(self, elapsed: float) -> bytes:
+        return self._content
+
+
+class ReplayFeed(Feed):
+    """
+    Replays snapshots given as (timestamp, payload) pairs, in timestamp order.
+
+    At an elapsed time t the payload is that of the last snapshot at most t seconds
+    after the first. If loop is true, the sequence restarts after the last snapshot
+    has been served for the mean interval between snapshots.
+    """
+
+    def __init__(
+        self, snapshots: typing.Sequence[typing.Tuple[float, bytes]], loop: bool = False
+    ):
+        if len(snapshots) == 0:
+            raise ValueError("At least one snapshot is needed")
+        snapshots = sorted(snapshots, key=lambda snapshot: snapshot[0])
+        first_timestamp = snapshots[0][0]
+        self._offsets = [timestamp - first_timestamp for timestamp, _ in snapshots]
+        self._payloads = [payload for _, payload in snapshots]
+        if len(snapshots) > 1:
+            self._period = self._offsets[-1] * len(snapshots) / (len(snapshots) - 1)
+        else:
+            self._period = 0
+        self._loop = loop and self._period > 0
+
+    def payload(self, elapsed: float) -> bytes:
+        if self._loop:
+            elapsed %= self._period
+        return self._payloads[max(0, bisect.bisect_right(self._offsets, elapsed) - 1)]
+
+
+class GeneratorFeed(Feed):
+    """
+    Serves the snapshots of a synthetic feed generator, advancing it by its poll
+    interval whenever that much time has passed.
+    """
+
+    def __init__(self, generator):
+        self._generator = generator
+        self._lock = threading.Lock()
+        self._start_time = generator.time
+        self._content = generator.next_snapshot()
+
+    def payload(self, elapsed: float) -> bytes:
+        with self._lock:
+            while self._generator.time <= self._start_time + elapsed:
+                self._content = self._generator.next_snapshot()
+            return self._content
+
+
+@dataclasses.dataclass
+class Faults:
+    # Added to every response, in seconds
+    latency: float = 0.0
+    # The probability of responding with error_status
+    error_rate: float = 0.0
+    error_status: int = 503
+    # The probability of closing the connection after half of the body
+    truncate_rate: float = 0.0
+    # The probability of serving the previous payload of the feed again
+    stale_rate: float = 0.0
+    seed: typing.Optional[int] = None
+
+
+@dataclasses.dataclass
+class ServerStats:
+    requests: int = 0
+    # Responses by status; truncated responses are counted as status 200
+    statuses: typing.Dict[int, int] = dataclasses.field(default_factory=dict)
+    truncated: int = 0
+    stale: int = 0
+    not_modified: int = 0
+
+
+class StandInServer:
+    """
+    Serves feeds by path in a background thread.
+
+    speed is the rate of the server's clock relative to real time.
+    """
+
+    def __init__(
+        self,
+        path_to_feed: typing.Dict[str, Feed],
+        api_key: typing.Optional[str] = None,
+        faults: typing.Optional[Faults] = None,
+        speed: float = 1.0,
+        address: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self._path_to_feed = dict(path_to_feed)
+        self._api_key = api_key
+        self._faults = faults or Faults()
+        self._rng = random.Random(self._faults.seed)
+        self._rng_lock = threading.Lock()
+        self._speed = speed
+        self._address = address
+        self._port = port
+        self._path_to_previous_payload = {}
+        self._start = None
+        self._server = None
+        self.stats = ServerStats()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def elapsed(self) -> float:
+        """
+        The time since the server started on its clock, in seconds.
+        """
+        return (time.monotonic() - self._start) * self._speed
+
+    def start(self) -> "StandInServer":
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients closing connections part way is expected
+                pass
+
+        self._server = Server((self._address, self._port), Handler)
+        self._start = time.monotonic()
+        threading.Thread(
+            target=self._server.serve_forever, args=(0.1,), daemon=True
+        ).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _handle(self, handler):
+        faults = self._faults
+        path = handler.path.split("?", 1)[0]
+        with self._stats_lock:
+            self.stats.requests += 1
+        if faults.latency > 0:
+            time.sleep(faults.latency)
+        feed = self._path_to_feed.get(path)
+        if feed is None:
+            self._send(handler, 404, b"Not found")
+            return
+        if (
+            self._api_key is not None
+            and path.startswith(MTA_API_PREFIX)
+            and handler.headers.get(API_KEY_HEADER) != self._api_key
+        ):
+            self._send(handler, 403, b"Forbidden")
+            return
+        if faults.error_rate > 0 and self._random() < faults.error_rate:
+            self._send(handler, faults.error_status, b"Injected error")
+            return
+        payload = feed.payload(self.elapsed())
+        previous_payload = self._path_to_previous_payload.get(path)
+        if (
+            faults.stale_rate > 0
+            and previous_payload is not None
+            and self._random() < faults.stale_rate
+        ):
+            payload = previous_payload
+            with self._stats_lock:
+                self.stats.stale += 1
+        else:
+            self._path_to_previous_payload[path] = payload
+        etag = '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+        if handler.headers.get("If-None-Match") == etag:
+            with self._stats_lock:
+                self.stats.not_modified += 1
+            self._send(handler, 304, b"", {"ETag": etag})
+            return
+        headers = {"ETag": etag, "Content-Type": "application/octet-stream"}
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            payload = gzip.compress(payload, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        truncate = faults.truncate_rate > 0 and self._random() < faults.truncate_rate
+        if truncate:
+            with self._stats_lock:
+                self.stats.truncated += 1
+        self._send(handler, 200, payload, headers, truncate)
+
+    def _send(self, handler, status, body, headers=None, truncate=False):
+        with self._stats_lock:
+            self.stats.statuses[status] = self.stats.statuses.get(status, 0) + 1
+        handler.send_response(status)
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        if status != 304:
+            handler.send_header("Content-Length", str(len(body)))
+        if truncate:
+            handler.send_header("Connection", "close")
+            handler.close_connection = True
+        handler.end_headers()
+        handler.wfile.write(body[: len(body) // 2] if truncate else body)
+
+
+def build_synthetic_feeds(seed: int = 0, scale: float = 1) -> typing.Dict[str, Feed]:
+    """
+    Return synthetic feeds at the paths of the NYC subway feeds.
+    """
+    path_to_feed = {
+        FEED_PATHS[("nyc_subway", "DirectionRules")]: StaticFeed(
+            syntheticfeeds.build_stations_csv(seed=seed, scale=scale)
+        ),
+        FEED_PATHS[("nyc_subway", "gtfsrealtime-alerts")]: GeneratorFeed(
+            syntheticfeeds.AlertsFeedGenerator(seed=seed, scale=scale)
+        ),
+    }
+    for feed_id in syntheticfeeds.FEED_ID_TO_NUM_TRIPS.keys():
+        path_to_feed[FEED_PATHS[("nyc_subway", feed_id)]] = GeneratorFeed(
+            syntheticfeeds.SubwayFeedGenerator(seed=seed, feed_id=feed_id, scale=scale)
+        )
+    return path_to_feed
+
+
+def load_recorded_feeds(directory: str, loop: bool = True) -> typing.Dict[str, Feed]:
+    """
+    Return replays of the recordings in the directory; see the module docstring.
+    """
+    path_to_feed = {}
+    for (system, feed_id), path in FEED_PATHS.items():
+        feed_directory = os.path.join(directory, system, feed_id)
+        if not os.path.isdir(feed_directory):
+            continue
+        snapshots = []
+        for filename in os.listdir(feed_directory):
+            if not filename.endswith(RECORDING_EXTENSION):
+                continue
+            with open(os.path.join(feed_directory, filename), "rb") as f:
+                snapshots.append(
+                    (float(filename[: -len(RECORDING_EXTENSION)]), f.read())
+                )
+        if len(snapshots) > 0:
+            path_to_feed[path] = ReplayFeed(snapshots, loop=loop)
+    return path_to_feed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m transiter_ny_mta.standinserver",
+        description="Serve recorded or synthetic feeds at the paths of the MTA API.",
+    )
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--recorded", help="directory of recorded snapshots")
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="serve synthetic subway feeds for the feeds that are not recorded",
+    )
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="speed of the clock relative to real time",
+    )
+    parser.add_argument("--api-key", help="require this X-API-KEY for the MTA API")
+    parser.add_argument("--latency", type=float, default=0, help="in seconds")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--truncate-rate", type=float, default=0)
+    parser.add_argument("--stale-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+    path_to_feed = {}
+    if args.synthetic:
+        path_to_feed.update(build_synthetic_feeds(args.seed, args.scale))
+    if args.recorded is not None:
+        path_to_feed.update(load_recorded_feeds(args.recorded))
+    if len(path_to_feed) == 0:
+        parser.error("no feeds to serve; pass --recorded or --synthetic")
+    server = StandInServer(
+        path_to_feed,
+        api_key=args.api_key,
+        faults=Faults(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            truncate_rate=args.truncate_rate,
+            stale_rate=args.stale_rate,
+            seed=args.seed,
+        ),
+        speed=args.speed,
+        address=args.address,
+        port=args.port,
+    )
+    server.start()
+    print(f"Serving {len(path_to_feed)} feeds at {server.url}")
+    for path in sorted(path_to_feed):
+        print(f"  {path}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,9 @@ import typing
 
 from transiter import parse
 
+from . import contentcache
+from . import instrumentation
+
 # Some stops in the system can be broken up into two directions by using
 # the track field that is provided in the MTA's GTFS Realtime feed. The following
 # custom data defines these directions. Other directions come automatically from
@@ -30,10 +33,48 @@ D26N,A2,Franklin Avenue,{MANHATTAN}
 
 
 class StationsCsvParser(parse.TransiterParser):
+    def __init__(self):
+        super().__init__()
+        self._feed_id = None
+        self._recorder = None
+        self._content_cache = None
+
+    def load_options(self, options_blob: typing.Optional[dict]) -> None:
+        if options_blob is None:
+            return
+        self._feed_id = options_blob.get("feed_id", self._feed_id)
+        if options_blob.get("content_cache", False):
+            self._content_cache = contentcache.ContentCache()
+
+    @property
+    def content_cache(self) -> typing.Optional[contentcache.ContentCache]:
+        return self._content_cache
+
     def load_content(self, content: bytes) -> None:
+        if self._content_cache is not None and self._content_cache.check(content):
+            return
+        self._recorder = instrumentation.recorder(type(self).__name__, self._feed_id)
         self._content = content
+        if self._content_cache is not None:
+            self._content_cache.commit()
 
     def get_direction_rules(self) -> typing.Iterable[parse.DirectionRule]:
+        if self._content_cache is not None:
+            return iter(
+                self._content_cache.get("direction_rules", self._get_direction_rules)
+            )
+        return self._get_direction_rules()
+
+    def _get_direction_rules(self) -> typing.Iterable[parse.DirectionRule]:
+        if self._recorder is None:
+            return self._build_direction_rules()
+        with self._recorder.stage(instrumentation.Stage.CONVERT) as counts:
+            direction_rules = list(self._build_direction_rules())
+            counts[instrumentation.BYTES] = len(self._content)
+            counts[instrumentation.DIRECTION_RULES] = len(direction_rules)
+        return iter(direction_rules)
+
+    def _build_direction_rules(self) -> typing.Iterable[parse.DirectionRule]:
         priority = 0
         special_stop_id_to_basic_name = {}
 
@@ -0,0 +1,139 @@
+"""
+Fan out the trips of a feed to subscriptions on subsets of routes and stops.
+
+A subscription selects trips by route and direction, and stop times by stop ID
+prefix. A trip matches a subscription if its route and direction match and, if
+the subscription has stop ID prefixes, at least one of its stop times is at a
+subscribed stop; the trip delivered to the subscription then contains only the
+stop times at subscribed stops.
+
+The subscriptions are compiled into lookup tables: the candidate subscriptions of
+each route and direction, and the subscriptions matching each stop ID. The latter
+is built lazily as stop IDs are seen and kept across feeds, so matching a stop time
+against every subscription costs one dictionary lookup. All subscriptions are
+matched in a single pass over the trips.
+
+Trips delivered to a subscription without stop ID prefixes are the parser's trips;
+trimmed trips are shallow copies sharing the stop times with the parser's trips.
+"""
+import dataclasses
+import typing
+
+from transiter import parse
+
+
+@dataclasses.dataclass(frozen=True)
+class Subscription:
+    name: str
+    # If None, all routes are subscribed
+    route_ids: typing.Optional[typing.FrozenSet[str]] = None
+    # If None, all stops are subscribed
+    stop_id_prefixes: typing.Optional[typing.Tuple[str, ...]] = None
+    # If None, both directions are subscribed
+    direction_id: typing.Optional[bool] = None
+
+    @classmethod
+    def from_dict(cls, subscription_blob: dict) -> "Subscription":
+        """
+        Build a subscription from its parser options representation.
+        """
+        route_ids = subscription_blob.get("routes")
+        stop_id_prefixes = subscription_blob.get("stop_id_prefixes")
+        return cls(
+            name=subscription_blob["name"],
+            route_ids=None if route_ids is None else frozenset(route_ids),
+            stop_id_prefixes=None
+            if stop_id_prefixes is None
+            else tuple(stop_id_prefixes),
+            direction_id=subscription_blob.get("direction_id"),
+        )
+
+
+class SubscriptionSet:
+    def __init__(self, subscriptions: typing.Iterable[Subscription]):
+        self._subscriptions = list(subscriptions)
+        names = [subscription.name for subscription in self._subscriptions]
+        if len(set(names)) != len(names):
+            raise ValueError("Subscription names must be unique")
+        self._route_and_direction_to_candidates = {}
+        self._stop_id_to_matches = {}
+
+    @property
+    def subscriptions(self) -> typing.List[Subscription]:
+        return list(self._subscriptions)
+
+    def fan_out(
+        self, trips: typing.Iterable[parse.Trip]
+    ) -> typing.Dict[str, typing.List[parse.Trip]]:
+        """
+        Return the trips matching each subscription, by subscription name.
+        """
+        name_to_trips = {subscription.name: [] for subscription in self._subscriptions}
+        subscription_lists = [
+            name_to_trips[subscription.name] for subscription in self._subscriptions
+        ]
+        for trip in trips:
+            candidates, stop_filtered_candidates = self._candidates(
+                trip.route_id, trip.direction_id
+            )
+            for i in candidates:
+                subscription_lists[i].append(trip)
+            if len(stop_filtered_candidates) == 0:
+                continue
+            i_to_stop_times = {}
+            for stop_time in trip.stop_times:
+                for i in self._matches(stop_time.stop_id):
+                    if i in stop_filtered_candidates:
+                        i_to_stop_times.setdefault(i, []).append(stop_time)
+            for i, stop_times in i_to_stop_times.items():
+                subscription_lists[i].append(
+                    dataclasses.replace(trip, stop_times=stop_times)
+                )
+        return name_to_trips
+
+    def _candidates(self, route_id, direction_id):
+        """
+        Return the indices of the subscriptions matching the route and direction,
+        split into those without and those with stop ID prefixes.
+        """
+        key = (route_id, direction_id)
+        candidates = self._route_and_direction_to_candidates.get(key)
+        if candidates is not None:
+            return candidates
+        unfiltered = []
+        stop_filtered = set()
+        for i, subscription in enumerate(self._subscriptions):
+            if (
+                subscription.route_ids is not None
+                and route_id not in subscription.route_ids
+            ):
+                continue
+            if (
+                subscription.direction_id is not None
+                and direction_id != subscription.direction_id
+            ):
+                continue
+            if subscription.stop_id_prefixes is None:
+                unfiltered.append(i)
+            else:
+                stop_filtered.add(i)
+        candidates = (tuple(unfiltered), frozenset(stop_filtered))
+        self._route_and_direction_to_candidates[key] = candidates
+        return candidates
+
+    def _matches(self, stop_id) -> typing.Tuple[int, ...]:
+        """
+        Return the indices of the subscriptions with a prefix of the stop ID.
+        """
+        matches = self._stop_id_to_matches.get(stop_id)
+        if matches is not None:
+            return matches
+        matches = tuple(
+            i
+            for i, subscription in enumerate(self._subscriptions)
+            if subscription.stop_id_prefixes is not None
+            and stop_id is not None
+            and stop_id.startswith(subscription.stop_id_prefixes)
+        )
+        self._stop_id_to_matches[stop_id] = matches
+        return matches
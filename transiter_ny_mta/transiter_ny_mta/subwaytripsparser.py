@@ -1,26 +1,350 @@
+import datetime
 import enum
 import sys
 import typing
 
 from transiter import parse
+from transiter.parse import gtfsrealtime
 from transiter.parse.gtfsrealtime import TRANSITER_EXTENSION_ID
+from transiter_ny_mta import contentcache
+from transiter_ny_mta import entitycache
+from transiter_ny_mta import instrumentation
+from transiter_ny_mta import routefilter
+from transiter_ny_mta import subscriptions
+from transiter_ny_mta import tripdeltas
+from transiter_ny_mta import wireformat
+from transiter_ny_mta.proto import extensions
 from transiter_ny_mta.proto import subwaytrips_pb2 as gtfs_rt_pb2
+from transiter_ny_mta.instrumentation import Stage
+from transiter_ny_mta.proto.extensions import FieldCopy
+
+
+class Engine(enum.Enum):
+    """
+    The engine used to convert the decoded feed into Transiter types.
+
+    The default engine moves the NYCT extension data into the GTFS Realtime message
+    and then relies on Transiter's GTFS Realtime parser, fixing up the resulting
+    trips afterwards. The fused engine reads the NYCT extensions directly and builds
+    the final Transiter types in a single traversal of the feed, without writing
+    to the decoded message.
+    """
+
+    DEFAULT = "default"
+    FUSED = "fused"
 
 
 class SubwayTripsParser(parse.GtfsRealtimeParser):
 
     GTFS_REALTIME_PB2_MODULE = gtfs_rt_pb2
 
+    def __init__(self):
+        super().__init__()
+        self._engine = Engine.DEFAULT
+        self._feed_id = None
+        self._recorder = None
+        self._content_cache = None
+        self._entity_cache = None
+        self._route_filter = None
+        self._subscription_set = None
+        self._undecoded_content = None
+        self._serialized_header = None
+        self._entity_cache_trips = None
+        self._previous_trips = {}
+
+    def load_options(self, options_blob: typing.Optional[dict]) -> None:
+        if options_blob is None:
+            return
+        # Options that are absent keep their current values
+        self._engine = Engine(options_blob.get("engine", self._engine.value))
+        self._feed_id = options_blob.get("feed_id", self._feed_id)
+        if options_blob.get("content_cache", False):
+            self._content_cache = contentcache.ContentCache()
+        entity_cache_size = options_blob.get("entity_cache_size")
+        if entity_cache_size is not None:
+            self._entity_cache = entitycache.EntityCache(int(entity_cache_size))
+        include_routes = options_blob.get("include_routes")
+        exclude_routes = options_blob.get("exclude_routes")
+        if include_routes is not None or exclude_routes is not None:
+            self._route_filter = routefilter.RouteFilter(
+                include=include_routes,
+                exclude=exclude_routes,
+                aliases=_ROUTE_ID_ALIASES,
+                always_exclude=_DROPPED_ROUTE_IDS,
+            )
+        subscription_blobs = options_blob.get("subscriptions")
+        if subscription_blobs is not None:
+            self._subscription_set = subscriptions.SubscriptionSet(
+                subscriptions.Subscription.from_dict(subscription_blob)
+                for subscription_blob in subscription_blobs
+            )
+
+    @property
+    def content_cache(self) -> typing.Optional[contentcache.ContentCache]:
+        return self._content_cache
+
+    @property
+    def entity_cache(self) -> typing.Optional[entitycache.EntityCache]:
+        return self._entity_cache
+
+    def load_content(self, content: bytes) -> None:
+        if self._content_cache is not None and self._content_cache.check(content):
+            return
+        self._load_content(content)
+        if self._content_cache is not None:
+            self._content_cache.commit()
+
+    def _load_content(self, content: bytes) -> None:
+        self._recorder = instrumentation.recorder(type(self).__name__, self._feed_id)
+        if self._route_filter is not None:
+            content = self._filter_routes(content)
+        if self._entity_cache is not None:
+            if self._recorder is not None:
+                self._load_content_with_entity_cache_instrumented(content)
+                return
+            self._load_content_with_entity_cache(content)
+            return
+        self._decode(content)
+
+    def _filter_routes(self, content: bytes) -> bytes:
+        if self._recorder is None:
+            content, _, _ = self._route_filter.filter_content(content)
+            return content
+        with self._recorder.stage(Stage.FILTER) as counts:
+            content, num_entities, num_removed = self._route_filter.filter_content(
+                content
+            )
+            counts[instrumentation.ENTITIES] = num_entities
+            counts[instrumentation.ENTITIES_ROUTE_FILTERED] = num_removed
+        return content
+
+    def _decode(self, content: bytes) -> None:
+        if self._recorder is not None:
+            self._decode_instrumented(content)
+            return
+        if self._engine is Engine.DEFAULT:
+            super().load_content(content)
+            return
+        self._gtfs_feed_message = gtfs_rt_pb2.FeedMessage()
+        self._gtfs_feed_message.ParseFromString(content)
+
+    def _decode_instrumented(self, content: bytes) -> None:
+        with self._recorder.stage(Stage.DECODE) as counts:
+            self._gtfs_feed_message = gtfs_rt_pb2.FeedMessage()
+            self._gtfs_feed_message.ParseFromString(content)
+            counts[instrumentation.BYTES] = len(content)
+            counts[instrumentation.ENTITIES] = len(self._gtfs_feed_message.entity)
+        if self._engine is Engine.DEFAULT:
+            with self._recorder.stage(Stage.MOVE_EXTENSIONS):
+                self.post_process_feed_message(self._gtfs_feed_message)
+
+    def _load_content_with_entity_cache_instrumented(self, content: bytes) -> None:
+        stats = self._entity_cache.stats
+        hits = stats.hits
+        misses = stats.misses
+        with self._recorder.stage(Stage.CONVERT) as counts:
+            self._load_content_with_entity_cache(content)
+            # Every trip update is either a hit or a miss
+            num_trip_updates = stats.hits - hits + stats.misses - misses
+            counts[instrumentation.BYTES] = len(content)
+            counts[instrumentation.ENTITIES] = num_trip_updates
+            counts[instrumentation.ENTITY_CACHE_HITS] = stats.hits - hits
+            counts[instrumentation.ENTITY_CACHE_MISSES] = stats.misses - misses
+            counts[instrumentation.TRIPS] = len(self._entity_cache_trips)
+            counts[instrumentation.TRIPS_DROPPED] = num_trip_updates - len(
+                self._entity_cache_trips
+            )
+            counts[instrumentation.STOP_IDS_FLIPPED] = _count_bushwick_m_stop_times(
+                self._entity_cache_trips
+            )
+
+    def _load_content_with_entity_cache(self, content: bytes) -> None:
+        # Trip updates are converted one at a time using the fused engine, which
+        # gives the same trips as the default engine. The full message is only
+        # decoded if it is needed by one of the other getters.
+        #
+        # The fingerprint covers the trip update only and not the entity ID, as the
+        # NYCT feeds number entities by their position in the feed.
+        header, serialized_entities = wireformat.split_feed_message(content)
+        fingerprints = set()
+        trips = []
+        for serialized_entity in serialized_entities:
+            fields = wireformat.find_fields(
+                serialized_entity, wireformat.FEED_ENTITY_TRIP_UPDATE
+            )
+            if len(fields) == 0:
+                continue
+            # The decoder merges repeated occurrences of a message field, which is
+            # equivalent to concatenating their payloads.
+            serialized_trip_update = b"".join(
+                serialized_entity[field.value_start : field.end] for field in fields
+            )
+            fingerprint = self._entity_cache.fingerprint(serialized_trip_update)
+            fingerprints.add(fingerprint)
+            trip = self._entity_cache.get(
+                fingerprint,
+                lambda: _build_trip_fused(
+                    gtfs_rt_pb2.TripUpdate.FromString(serialized_trip_update)
+                ),
+            )
+            if trip is not None:
+                trips.append(trip)
+        self._entity_cache.retain(fingerprints)
+        self._gtfs_feed_message = None
+        self._undecoded_content = content
+        self._serialized_header = header
+        self._entity_cache_trips = trips
+
+    def _decode_if_needed(self) -> None:
+        if self._gtfs_feed_message is None and self._undecoded_content is not None:
+            self._decode(self._undecoded_content)
+
     @staticmethod
     def post_process_feed_message(feed_message):
         _move_data_between_extensions(feed_message)
 
+    def get_timestamp(self) -> typing.Optional[datetime.datetime]:
+        if self._gtfs_feed_message is None and self._serialized_header is not None:
+            header = gtfs_rt_pb2.FeedHeader.FromString(bytes(self._serialized_header))
+            return gtfsrealtime._timestamp_to_datetime(header.timestamp)
+        return super().get_timestamp()
+
     def get_trips(self) -> typing.Iterable[parse.Trip]:
+        if self._content_cache is not None:
+            return iter(self._content_cache.get("trips", self._get_trips))
+        return self._get_trips()
+
+    def _get_trips(self) -> typing.Iterable[parse.Trip]:
+        if self._recorder is not None:
+            yield from self._get_trips_instrumented()
+            return
+        if self._entity_cache is not None:
+            yield from self._entity_cache_trips
+            return
+        if self._engine is Engine.FUSED:
+            yield from _parse_trips_fused(self._gtfs_feed_message)
+            return
         for trip in super().get_trips():
             _invert_m_train_direction_in_bushwick(trip)
             if _fix_route_ids(trip):
                 yield trip
 
+    def _get_trips_instrumented(self) -> typing.List[parse.Trip]:
+        # For the entity cache, the trips are built and recorded in load_content
+        if self._entity_cache is not None:
+            return self._entity_cache_trips
+        recorder = self._recorder
+        if self._engine is Engine.FUSED:
+            with recorder.stage(Stage.CONVERT) as counts:
+                trips = list(_parse_trips_fused(self._gtfs_feed_message))
+                num_trip_updates = _count_trip_updates(self._gtfs_feed_message)
+                counts[instrumentation.ENTITIES] = num_trip_updates
+                counts[instrumentation.TRIPS] = len(trips)
+                counts[instrumentation.TRIPS_DROPPED] = num_trip_updates - len(trips)
+                counts[instrumentation.STOP_IDS_FLIPPED] = _count_bushwick_m_stop_times(
+                    trips
+                )
+            return trips
+        with recorder.stage(Stage.CONVERT) as counts:
+            converted_trips = list(super().get_trips())
+            counts[instrumentation.ENTITIES] = _count_trip_updates(
+                self._gtfs_feed_message
+            )
+            counts[instrumentation.TRIPS] = len(converted_trips)
+        with recorder.stage(Stage.FIXUPS) as counts:
+            trips = []
+            for trip in converted_trips:
+                _invert_m_train_direction_in_bushwick(trip)
+                if _fix_route_ids(trip):
+                    trips.append(trip)
+            counts[instrumentation.TRIPS] = len(trips)
+            counts[instrumentation.TRIPS_DROPPED] = len(converted_trips) - len(trips)
+            counts[instrumentation.STOP_IDS_FLIPPED] = _count_bushwick_m_stop_times(
+                trips
+            )
+        return trips
+
+    def get_subscribed_trips(
+        self, subscription_set: typing.Optional[subscriptions.SubscriptionSet] = None
+    ) -> typing.Dict[str, typing.List[parse.Trip]]:
+        """
+        Return the trips matching each subscription, by subscription name.
+
+        The subscriptions default to those in the subscriptions option.
+        """
+        if subscription_set is None:
+            subscription_set = self._subscription_set
+        if subscription_set is None:
+            raise ValueError("No subscriptions were given or set in the options")
+        return subscription_set.fan_out(self.get_trips())
+
+    def get_trip_deltas(self) -> typing.Iterable[tripdeltas.TripDelta]:
+        """
+        Return the deltas between the trips in the previous load and this load.
+
+        The parser keeps the trips of the previous call to this method, so on the
+        first call every trip is added.
+        """
+        new_trips = tripdeltas.build_snapshot(self.get_trips())
+        deltas = list(tripdeltas.diff(self._previous_trips, new_trips))
+        self._previous_trips = new_trips
+        return deltas
+
+    def get_vehicles(self) -> typing.Iterable[parse.Vehicle]:
+        if self._content_cache is not None:
+            return iter(self._content_cache.get("vehicles", self._get_vehicles))
+        return self._get_vehicles()
+
+    def _get_vehicles(self) -> typing.Iterable[parse.Vehicle]:
+        self._decode_if_needed()
+        if self._recorder is not None:
+            with self._recorder.stage(Stage.CONVERT_VEHICLES) as counts:
+                vehicles = list(self._get_vehicles_uninstrumented())
+                counts[instrumentation.VEHICLES] = len(vehicles)
+            yield from vehicles
+            return
+        yield from self._get_vehicles_uninstrumented()
+
+    def _get_vehicles_uninstrumented(self) -> typing.Iterable[parse.Vehicle]:
+        if self._engine is Engine.FUSED:
+            yield from _parse_vehicles_fused(self._gtfs_feed_message)
+            return
+        yield from super().get_vehicles()
+
+    def print(self):
+        self._decode_if_needed()
+        super().print()
+
+
+_EXTENSIONS = extensions.PackageExtensions(gtfs_rt_pb2)
+_nyct_trip_descriptor = _EXTENSIONS.accessor(
+    gtfs_rt_pb2.TripDescriptor, gtfs_rt_pb2.MTA_EXTENSION_ID
+)
+_nyct_stop_time_update = _EXTENSIONS.accessor(
+    gtfs_rt_pb2.TripUpdate.StopTimeUpdate, gtfs_rt_pb2.MTA_EXTENSION_ID
+)
+_transiter_stop_time_update = _EXTENSIONS.accessor(
+    gtfs_rt_pb2.TripUpdate.StopTimeUpdate, TRANSITER_EXTENSION_ID
+)
+# The actual track takes precedence over the scheduled track.
+_copy_track = _EXTENSIONS.compile_copies(
+    gtfs_rt_pb2.TripUpdate.StopTimeUpdate,
+    [
+        FieldCopy(
+            gtfs_rt_pb2.MTA_EXTENSION_ID,
+            "scheduled_track",
+            TRANSITER_EXTENSION_ID,
+            "track",
+        ),
+        FieldCopy(
+            gtfs_rt_pb2.MTA_EXTENSION_ID,
+            "actual_track",
+            TRANSITER_EXTENSION_ID,
+            "track",
+        ),
+    ],
+)
+
 
 class _MtaDirection(enum.Enum):
     NORTH = 1
@@ -36,75 +360,278 @@ def _move_data_between_extensions(feed_message):
                 continue
             sub_entity = getattr(entity, key)
 
-            mta_ext = sub_entity.trip.Extensions[
-                sub_entity.trip._extensions_by_number[gtfs_rt_pb2.MTA_EXTENSION_ID]
-            ]
+            mta_ext = _nyct_trip_descriptor(sub_entity.trip)
 
-            # Map the MTA's direction onto the GTFS direction ID
             if not sub_entity.trip.HasField("direction_id"):
-                if mta_ext.HasField("direction"):
-                    direction_id = (
-                        _MtaDirection(mta_ext.direction) == _MtaDirection.SOUTH
-                    )
-                else:
-                    # NOTE: it seems the NYCT direction is NORTH if it's missing.
-                    # It may be more robust to infer it from the trip ID, but this has
-                    # apparently worked for multiple years...
-                    direction_id = False
-                sub_entity.trip.direction_id = direction_id
-
-            # Map the MTA's train ID onto the GTFS vehicle ID.
-            # Only do this if the trip has a train assigned
-            if mta_ext.HasField("is_assigned"):
-                is_assigned = mta_ext.is_assigned
-            else:
-                is_assigned = False
-            if not sub_entity.HasField("vehicle") and is_assigned:
-                if mta_ext.HasField("train_id"):
-                    vehicle_id = mta_ext.train_id
-                else:
-                    vehicle_id = "vehicle_" + sub_entity.trip.trip_id
-                sub_entity.vehicle.id = vehicle_id
+                sub_entity.trip.direction_id = _get_direction_id(mta_ext)
+
+            if not sub_entity.HasField("vehicle"):
+                vehicle_id = _get_vehicle_id(sub_entity.trip, mta_ext)
+                if vehicle_id is not None:
+                    sub_entity.vehicle.id = vehicle_id
 
         if not entity.HasField("trip_update"):
             continue
         for stop_time in entity.trip_update.stop_time_update:
-            mta_ext = stop_time.Extensions[
-                stop_time._extensions_by_number[gtfs_rt_pb2.MTA_EXTENSION_ID]
-            ]
-            if mta_ext.HasField("actual_track"):
-                track = mta_ext.actual_track
-            elif mta_ext.HasField("scheduled_track"):
-                track = mta_ext.scheduled_track
-            else:
-                track = None
+            _copy_track(stop_time)
 
-            if track is None:
-                continue
-            transiter_ext = stop_time.Extensions[
-                stop_time._extensions_by_number[TRANSITER_EXTENSION_ID]
-            ]
-            transiter_ext.track = track
+
+def _get_direction_id(mta_ext) -> bool:
+    # Map the MTA's direction onto the GTFS direction ID
+    if mta_ext.HasField("direction"):
+        return _MtaDirection(mta_ext.direction) == _MtaDirection.SOUTH
+    # NOTE: it seems the NYCT direction is NORTH if it's missing.
+    # It may be more robust to infer it from the trip ID, but this has
+    # apparently worked for multiple years...
+    return False
+
+
+def _get_vehicle_id(trip_desc, mta_ext) -> typing.Optional[str]:
+    # Map the MTA's train ID onto the GTFS vehicle ID.
+    # Only do this if the trip has a train assigned
+    if not mta_ext.HasField("is_assigned") or not mta_ext.is_assigned:
+        return None
+    if mta_ext.HasField("train_id"):
+        return mta_ext.train_id
+    return "vehicle_" + trip_desc.trip_id
+
+
+def _get_track(mta_ext) -> typing.Optional[str]:
+    if mta_ext.HasField("actual_track"):
+        return mta_ext.actual_track
+    if mta_ext.HasField("scheduled_track"):
+        return mta_ext.scheduled_track
+    return None
+
+
+_ROUTE_ID_ALIASES = {"5X": "5"}
+_DROPPED_ROUTE_IDS = {"", "SS"}
 
 
 def _fix_route_ids(trip: parse.Trip):
-    if trip.route_id == "5X":
-        trip.route_id = "5"
-    if trip.route_id == "" or trip.route_id == "SS":
+    route_id = trip.route_id
+    if route_id in _DROPPED_ROUTE_IDS:
         return False
+    trip.route_id = _ROUTE_ID_ALIASES.get(route_id, route_id)
     return True
 
 
+_BUSHWICK_STOP_IDS = {"M11", "M12", "M13", "M14", "M16", "M18"}
+_FLIPPED_DIRECTIONS = {"N": "S", "S": "N"}
+
+
 def _invert_m_train_direction_in_bushwick(trip: parse.Trip):
     route_id = trip.route_id
     if route_id != "M":
         return True
-    flipper = {"N": "S", "S": "N"}
     for stop_time in trip.stop_times:
-        stop_id = stop_time.stop_id
-        if stop_id[:3] not in {"M11", "M12", "M13", "M14", "M16", "M18"}:
+        stop_time.stop_id = _invert_bushwick_stop_id(stop_time.stop_id)
+
+
+def _invert_bushwick_stop_id(stop_id: str) -> str:
+    if stop_id[:3] not in _BUSHWICK_STOP_IDS:
+        return stop_id
+    return stop_id[:3] + _FLIPPED_DIRECTIONS[stop_id[3]]
+
+
+def _count_bushwick_m_stop_times(trips) -> int:
+    # Every stop time of an M train in Bushwick has its stop ID flipped
+    return sum(
+        1
+        for trip in trips
+        if trip.route_id == "M"
+        for stop_time in trip.stop_times
+        if stop_time.stop_id[:3] in _BUSHWICK_STOP_IDS
+    )
+
+
+def _count_trip_updates(feed_message) -> int:
+    return sum(1 for entity in feed_message.entity if entity.HasField("trip_update"))
+
+
+def _parse_trips_fused(feed_message):
+    for entity in feed_message.entity:
+        if not entity.HasField("trip_update"):
             continue
-        stop_time.stop_id = stop_id[:3] + flipper[stop_id[3]]
+        trip = _build_trip_fused(entity.trip_update)
+        if trip is not None:
+            yield trip
+
+
+def _build_trip_fused(trip_update) -> typing.Optional[parse.Trip]:
+    trip_desc = trip_update.trip
+
+    # The route ID fixes are applied first so that dropped trips cost nothing more.
+    route_id = _get_nullable_field(trip_desc, "route_id")
+    if route_id in _DROPPED_ROUTE_IDS:
+        return None
+    route_id = _ROUTE_ID_ALIASES.get(route_id, route_id)
+
+    if trip_desc.HasField("direction_id"):
+        direction_id = trip_desc.direction_id
+    else:
+        direction_id = _get_direction_id(_nyct_trip_descriptor(trip_desc))
+
+    invert_stop_ids = route_id == "M"
+    stop_times = []
+    for stop_time_update in trip_update.stop_time_update:
+        stop_time = _build_stop_time_fused(stop_time_update)
+        if invert_stop_ids:
+            stop_time.stop_id = _invert_bushwick_stop_id(stop_time.stop_id)
+        stop_times.append(stop_time)
+
+    return parse.Trip(
+        id=trip_desc.trip_id,
+        route_id=route_id,
+        direction_id=direction_id,
+        schedule_relationship=parse.Trip.ScheduleRelationship(
+            trip_desc.schedule_relationship
+        )
+        if trip_desc.HasField("schedule_relationship")
+        else parse.Trip.ScheduleRelationship.UNKNOWN,
+        start_time=_get_start_time(trip_desc),
+        updated_at=gtfsrealtime._timestamp_to_datetime(trip_update.timestamp),
+        delay=_get_nullable_field(trip_update, "delay"),
+        stop_times=stop_times,
+    )
+
+
+def _get_start_time(trip_desc) -> typing.Optional[datetime.datetime]:
+    if not trip_desc.HasField("start_time"):
+        return None
+    if trip_desc.HasField("start_date"):
+        start_date_string = trip_desc.start_date
+        base = datetime.datetime(
+            year=int(start_date_string[:4]),
+            month=int(start_date_string[4:6]),
+            day=int(start_date_string[6:8]),
+        )
+    else:
+        # This mirrors Transiter's GTFS Realtime parser, including its bug: the
+        # server's current day may not be equal to the day in New York.
+        base = datetime.datetime.now()
+    start_time_string = trip_desc.start_time
+    return base.replace(
+        hour=int(start_time_string[:2]),
+        minute=int(start_time_string[3:5]),
+        second=int(start_time_string[6:8]),
+        microsecond=0,
+    )
+
+
+def _build_stop_time_fused(stop_time_update) -> parse.TripStopTime:
+    track = _get_track(_nyct_stop_time_update(stop_time_update))
+    if track is None:
+        track = _get_nullable_field(
+            _transiter_stop_time_update(stop_time_update), "track"
+        )
+    arrival = stop_time_update.arrival
+    departure = stop_time_update.departure
+    return parse.TripStopTime(
+        stop_sequence=_get_nullable_field(stop_time_update, "stop_sequence"),
+        stop_id=stop_time_update.stop_id,
+        schedule_relationship=parse.TripStopTime.ScheduleRelationship(
+            stop_time_update.schedule_relationship
+        ),
+        arrival_time=gtfsrealtime._timestamp_to_datetime(arrival.time),
+        arrival_delay=_get_nullable_field(arrival, "delay"),
+        arrival_uncertainty=_get_nullable_field(arrival, "uncertainty"),
+        departure_time=gtfsrealtime._timestamp_to_datetime(departure.time),
+        departure_delay=_get_nullable_field(departure, "delay"),
+        departure_uncertainty=_get_nullable_field(departure, "uncertainty"),
+        track=track,
+    )
+
+
+# A trip with an assigned train but no vehicle descriptor is linked to a vehicle
+# descriptor that carries only the vehicle ID. Such a descriptor contributes no data
+# to the vehicle, so a shared empty descriptor stands in for it.
+_EMPTY_VEHICLE_DESCRIPTOR = gtfs_rt_pb2.VehicleDescriptor()
+
+
+def _parse_vehicles_fused(feed_message):
+    # This follows Transiter's GTFS Realtime vehicle parser, but reads the NYCT
+    # vehicle ID from the extension instead of from the (rewritten) message.
+    all_trips_ids = set()
+    all_vehicle_ids = set()
+    all_links = set()
+
+    trip_id_to_descriptors = {}
+    trip_id_to_position = {}
+
+    vehicle_id_to_descriptors = {}
+    vehicle_id_to_position = {}
+
+    for entity in feed_message.entity:
+        for sub_entity_key in ("vehicle", "trip_update"):
+            if not entity.HasField(sub_entity_key):
+                continue
+            sub_entity = getattr(entity, sub_entity_key)
+
+            trip_id = None
+            vehicle_id = None
+            if sub_entity.HasField("vehicle"):
+                vehicle_descriptor = sub_entity.vehicle
+                if vehicle_descriptor.HasField("id"):
+                    vehicle_id = vehicle_descriptor.id
+            else:
+                trip_desc = sub_entity.trip
+                vehicle_id = _get_vehicle_id(
+                    trip_desc, _nyct_trip_descriptor(trip_desc)
+                )
+                vehicle_descriptor = (
+                    None if vehicle_id is None else _EMPTY_VEHICLE_DESCRIPTOR
+                )
+            if vehicle_id is not None:
+                all_vehicle_ids.add(vehicle_id)
+            if sub_entity.HasField("trip") and sub_entity.trip.HasField("trip_id"):
+                trip_id = sub_entity.trip.trip_id
+                all_trips_ids.add(trip_id)
+
+            if trip_id is None and vehicle_id is None:
+                continue
+            if trip_id is not None and vehicle_id is not None:
+                all_links.add(
+                    gtfsrealtime._TripVehicleLink(
+                        trip_id=trip_id, vehicle_id=vehicle_id
+                    )
+                )
+
+            if vehicle_descriptor is not None:
+                if trip_id is not None:
+                    trip_id_to_descriptors.setdefault(trip_id, []).append(
+                        vehicle_descriptor
+                    )
+                if vehicle_id is not None:
+                    vehicle_id_to_descriptors.setdefault(vehicle_id, []).append(
+                        vehicle_descriptor
+                    )
+            if sub_entity_key == "vehicle":
+                if trip_id is not None:
+                    trip_id_to_position[trip_id] = sub_entity
+                if vehicle_id is not None:
+                    vehicle_id_to_position[vehicle_id] = sub_entity
+
+    for trip_id, vehicle_id in gtfsrealtime._trip_id_vehicle_id_tuples(
+        all_trips_ids, all_vehicle_ids, all_links
+    ):
+        descriptors = trip_id_to_descriptors.get(
+            trip_id, []
+        ) + vehicle_id_to_descriptors.get(vehicle_id, [])
+        vehicle_position = vehicle_id_to_position.get(vehicle_id)
+        if vehicle_position is None:
+            vehicle_position = trip_id_to_position.get(trip_id)
+        if len(descriptors) == 0 and vehicle_position is None:
+            continue
+        yield gtfsrealtime._build_vehicle(
+            vehicle_id, trip_id, descriptors, vehicle_position
+        )
+
+
+def _get_nullable_field(entity, field_name, default=None):
+    if not entity.HasField(field_name):
+        return default
+    return getattr(entity, field_name)
 
 
 if __name__ == "__main__":
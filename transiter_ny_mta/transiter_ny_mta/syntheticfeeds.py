@@ -0,0 +1,473 @@
+"""
+Generators of realistic synthetic NYCT subway trip feeds and Mercury alert feeds.
+
+The feeds mirror the structure of the real MTA feeds: trip updates with NYCT trip
+descriptor and stop time update extensions (including tracks), vehicle entities for
+assigned trains, trip replacement periods in the header, and alerts with Mercury
+extensions, multi-language translations and informed entities. There is also a
+generator of the MTA's stations CSV. They are used to drive tests and benchmarks
+offline.
+
+Generators are deterministic given a seed. Each call to next_snapshot returns the
+feed at the current time and then advances the time by the poll interval, during
+which trains pass stops and a fraction of the trips or alerts (the churn rate)
+change. The size of a feed can be multiplied using the scale argument.
+"""
+import dataclasses
+import random
+import typing
+
+from transiter_ny_mta.proto import alerts_pb2
+from transiter_ny_mta.proto import extensions
+from transiter_ny_mta.proto import subwaytrips_pb2
+
+# Approximate number of trips in each of the real NYCT feeds during the day
+FEED_ID_TO_NUM_TRIPS = {
+    "123456": 250,
+    "ACE": 170,
+    "BDFM": 200,
+    "G": 30,
+    "JZ": 40,
+    "L": 40,
+    "NQRW": 170,
+    "SIR": 10,
+}
+FEED_ID_TO_ROUTE_IDS = {
+    "123456": ["1", "2", "3", "4", "5", "5X", "6", "6X", "GS"],
+    "ACE": ["A", "C", "E", "H"],
+    "BDFM": ["B", "D", "F", "FX", "M"],
+    "G": ["G"],
+    "JZ": ["J", "Z"],
+    "L": ["L"],
+    "NQRW": ["N", "Q", "R", "W"],
+    "SIR": ["SI", "SS"],
+}
+DEFAULT_NUM_ALERTS = 150
+DEFAULT_NUM_STATIONS = 496
+DEFAULT_START_TIME = 1600000000
+DEFAULT_POLL_INTERVAL = 5
+
+_NORTH = 1
+_SOUTH = 3
+_TRACKS = ["1", "2", "3", "4", "A1", "A3", "B1", "E2"]
+_WORDS = (
+    "trains are running with delays in both directions while we address "
+    "a signal problem near station platform service express local uptown "
+    "downtown bound shuttle buses replace between and customers may take "
+    "transfer instead travel time allow additional this weekend overnight"
+).split()
+
+_SUBWAY_EXTENSIONS = extensions.PackageExtensions(subwaytrips_pb2)
+_nyct_feed_header = _SUBWAY_EXTENSIONS.accessor(
+    subwaytrips_pb2.FeedHeader, subwaytrips_pb2.MTA_EXTENSION_ID
+)
+_nyct_trip_descriptor = _SUBWAY_EXTENSIONS.accessor(
+    subwaytrips_pb2.TripDescriptor, subwaytrips_pb2.MTA_EXTENSION_ID
+)
+_nyct_stop_time_update = _SUBWAY_EXTENSIONS.accessor(
+    subwaytrips_pb2.TripUpdate.StopTimeUpdate, subwaytrips_pb2.MTA_EXTENSION_ID
+)
+_ALERTS_EXTENSIONS = extensions.PackageExtensions(alerts_pb2)
+_mercury_feed_header = _ALERTS_EXTENSIONS.accessor(
+    alerts_pb2.FeedHeader, alerts_pb2.MTA_EXTENSION_ID
+)
+_mercury_alert = _ALERTS_EXTENSIONS.accessor(
+    alerts_pb2.Alert, alerts_pb2.MTA_EXTENSION_ID
+)
+_mercury_entity_selector = _ALERTS_EXTENSIONS.accessor(
+    alerts_pb2.EntitySelector, alerts_pb2.MTA_EXTENSION_ID
+)
+
+_STATIONS_CSV_HEADER = (
+    "Station ID,Complex ID,GTFS Stop ID,Division,Line,Stop Name,Borough,"
+    "Daytime Routes,Structure,GTFS Latitude,GTFS Longitude,"
+    "North Direction Label,South Direction Label"
+)
+_DIRECTION_LABELS = [
+    "Manhattan",
+    "Uptown & The Bronx",
+    "Downtown & Brooklyn",
+    "Queens",
+    "Coney Island",
+    "Ditmars Blvd",
+    "",
+]
+
+
+def build_stations_csv(
+    seed: int = 0, num_stations: int = DEFAULT_NUM_STATIONS, scale: float = 1
+) -> bytes:
+    """
+    Return a stations CSV in the format published by the MTA.
+    """
+    rng = random.Random(seed)
+    lines = [_STATIONS_CSV_HEADER]
+    for i in range(max(1, int(num_stations * scale))):
+        stop_name = " ".join(rng.choice(_WORDS).title() for _ in range(2))
+        lines.append(
+            ",".join(
+                [
+                    str(i + 1),
+                    str(i + 1),
+                    f"{chr(ord('A') + i // 100 % 26)}{i % 100:02}",
+                    "IRT",
+                    "Synthetic",
+                    stop_name,
+                    "M",
+                    "1 2 3",
+                    "Subway",
+                    f"{40.7 + rng.random() / 10:.6f}",
+                    f"{-74.0 + rng.random() / 10:.6f}",
+                    rng.choice(_DIRECTION_LABELS),
+                    rng.choice(_DIRECTION_LABELS),
+                ]
+            )
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+@dataclasses.dataclass
+class _StopTime:
+    stop_id: str
+    arrival: int
+    departure: int
+    scheduled_track: str
+    actual_track: typing.Optional[str] = None
+
+
+@dataclasses.dataclass
+class _Trip:
+    trip_id: str
+    route_id: str
+    direction: int
+    start_date: str
+    start_time: str
+    train_id: str
+    is_assigned: bool
+    stop_times: typing.List[_StopTime]
+
+
+class SubwayFeedGenerator:
+    def __init__(
+        self,
+        seed: int = 0,
+        feed_id: str = "123456",
+        num_trips: int = None,
+        scale: float = 1,
+        churn: float = 0.1,
+        poll_interval: int = DEFAULT_POLL_INTERVAL,
+        start_time: int = DEFAULT_START_TIME,
+    ):
+        self._rng = random.Random(seed)
+        self._route_ids = FEED_ID_TO_ROUTE_IDS[feed_id]
+        if num_trips is None:
+            num_trips = FEED_ID_TO_NUM_TRIPS[feed_id]
+        self.num_trips = max(1, int(num_trips * scale))
+        self.churn = churn
+        self.poll_interval = poll_interval
+        self.time = start_time
+        self._next_trip_number = 0
+        self._trips = [
+            self._build_trip(self.time - self._rng.randint(0, 3600))
+            for _ in range(self.num_trips)
+        ]
+        self._remove_passed_stop_times()
+
+    def next_snapshot(self) -> bytes:
+        """
+        Return the serialized feed at the current time, and advance the time.
+        """
+        content = self.build_feed_message().SerializeToString()
+        self._advance()
+        return content
+
+    def snapshots(self, count: int) -> typing.Iterator[bytes]:
+        for _ in range(count):
+            yield self.next_snapshot()
+
+    def build_feed_message(self) -> subwaytrips_pb2.FeedMessage:
+        feed_message = subwaytrips_pb2.FeedMessage()
+        header = feed_message.header
+        header.gtfs_realtime_version = "1.0"
+        header.incrementality = subwaytrips_pb2.FeedHeader.FULL_DATASET
+        header.timestamp = self.time
+        nyct_header = _nyct_feed_header(header)
+        nyct_header.nyct_subway_version = "1.0"
+        for route_id in self._route_ids:
+            period = nyct_header.trip_replacement_period.add()
+            period.route_id = route_id
+            period.replacement_period.end = self.time + 1800
+        for trip in self._trips:
+            entity = feed_message.entity.add()
+            entity.id = f"{len(feed_message.entity):06}"
+            trip_update = entity.trip_update
+            self._fill_trip_descriptor(trip, trip_update.trip)
+            for stop_time in trip.stop_times:
+                stop_time_update = trip_update.stop_time_update.add()
+                stop_time_update.stop_id = stop_time.stop_id
+                stop_time_update.arrival.time = stop_time.arrival
+                stop_time_update.departure.time = stop_time.departure
+                nyct_stop_time_update = _nyct_stop_time_update(stop_time_update)
+                nyct_stop_time_update.scheduled_track = stop_time.scheduled_track
+                if stop_time.actual_track is not None:
+                    nyct_stop_time_update.actual_track = stop_time.actual_track
+            if not trip.is_assigned or len(trip.stop_times) == 0:
+                continue
+            entity = feed_message.entity.add()
+            entity.id = f"{len(feed_message.entity):06}"
+            vehicle = entity.vehicle
+            self._fill_trip_descriptor(trip, vehicle.trip)
+            vehicle.current_stop_sequence = 1
+            vehicle.stop_id = trip.stop_times[0].stop_id
+            vehicle.timestamp = self.time
+            if trip.stop_times[0].arrival <= self.time + 30:
+                vehicle.current_status = subwaytrips_pb2.VehiclePosition.STOPPED_AT
+            else:
+                vehicle.current_status = subwaytrips_pb2.VehiclePosition.IN_TRANSIT_TO
+        return feed_message
+
+    @staticmethod
+    def _fill_trip_descriptor(trip: _Trip, trip_descriptor):
+        trip_descriptor.trip_id = trip.trip_id
+        trip_descriptor.route_id = trip.route_id
+        trip_descriptor.start_date = trip.start_date
+        trip_descriptor.start_time = trip.start_time
+        nyct_trip_descriptor = _nyct_trip_descriptor(trip_descriptor)
+        nyct_trip_descriptor.train_id = trip.train_id
+        nyct_trip_descriptor.is_assigned = trip.is_assigned
+        nyct_trip_descriptor.direction = trip.direction
+
+    def _build_trip(self, start_time: int) -> _Trip:
+        rng = self._rng
+        route_id = rng.choice(self._route_ids)
+        direction = rng.choice([_NORTH, _SOUTH])
+        direction_letter = "N" if direction == _NORTH else "S"
+        num_stops = rng.randint(20, 40)
+        first_stop = rng.randint(0, 40 - num_stops)
+        seconds_since_midnight = start_time % 86400
+        self._next_trip_number += 1
+        stop_times = []
+        time = start_time
+        for i in range(first_stop, first_stop + num_stops):
+            arrival = time
+            departure = arrival + rng.choice([0, 15, 30])
+            stop_times.append(
+                _StopTime(
+                    stop_id=f"{route_id[0]}{i:02}{direction_letter}",
+                    arrival=arrival,
+                    departure=departure,
+                    scheduled_track=rng.choice(_TRACKS),
+                )
+            )
+            time = departure + rng.randint(60, 150)
+        return _Trip(
+            trip_id=(
+                f"{seconds_since_midnight * 100 // 60:06}_{route_id}"
+                f"..{direction_letter}{self._next_trip_number % 100:02}R"
+            ),
+            route_id=route_id,
+            direction=direction,
+            start_date="20200913",
+            start_time="{:02}:{:02}:{:02}".format(
+                seconds_since_midnight // 3600,
+                seconds_since_midnight // 60 % 60,
+                seconds_since_midnight % 60,
+            ),
+            train_id=f"0{route_id} {self._next_trip_number:04}+ PEL/BBR",
+            is_assigned=rng.random() < 0.8,
+            stop_times=stop_times,
+        )
+
+    def _advance(self) -> None:
+        rng = self._rng
+        self.time += self.poll_interval
+        for trip in self._trips:
+            if rng.random() >= self.churn:
+                continue
+            delay = rng.randint(-20, 90)
+            for stop_time in trip.stop_times:
+                stop_time.arrival += delay
+                stop_time.departure += delay
+            if trip.stop_times and rng.random() < 0.2:
+                trip.stop_times[-1].actual_track = rng.choice(_TRACKS)
+        self._remove_passed_stop_times()
+
+    def _remove_passed_stop_times(self) -> None:
+        trips = []
+        for trip in self._trips:
+            trip.stop_times = [
+                stop_time
+                for stop_time in trip.stop_times
+                if stop_time.departure >= self.time
+            ]
+            if len(trip.stop_times) == 0:
+                trip = self._build_trip(self.time + self._rng.randint(0, 600))
+            trips.append(trip)
+        self._trips = trips
+
+
+@dataclasses.dataclass
+class _InformedEntity:
+    route_id: typing.Optional[str]
+    stop_id: typing.Optional[str]
+    sort_order: str
+
+
+@dataclasses.dataclass
+class _Alert:
+    alert_id: str
+    alert_type: str
+    created_at: int
+    updated_at: int
+    header: str
+    description: str
+    active_periods: typing.List[typing.Tuple[int, typing.Optional[int]]]
+    informed_entities: typing.List[_InformedEntity]
+
+
+class AlertsFeedGenerator:
+    def __init__(
+        self,
+        seed: int = 0,
+        num_alerts: int = DEFAULT_NUM_ALERTS,
+        scale: float = 1,
+        churn: float = 0.05,
+        non_alert_fraction: float = 0.2,
+        poll_interval: int = DEFAULT_POLL_INTERVAL,
+        start_time: int = DEFAULT_START_TIME,
+    ):
+        self._rng = random.Random(seed)
+        self.num_alerts = max(1, int(num_alerts * scale))
+        self.churn = churn
+        self.non_alert_fraction = non_alert_fraction
+        self.poll_interval = poll_interval
+        self.time = start_time
+        self._next_alert_number = 0
+        self._alerts = [self._build_alert() for _ in range(self.num_alerts)]
+
+    def next_snapshot(self) -> bytes:
+        """
+        Return the serialized feed at the current time, and advance the time.
+        """
+        content = self.build_feed_message().SerializeToString()
+        self._advance()
+        return content
+
+    def snapshots(self, count: int) -> typing.Iterator[bytes]:
+        for _ in range(count):
+            yield self.next_snapshot()
+
+    def build_feed_message(self) -> alerts_pb2.FeedMessage:
+        feed_message = alerts_pb2.FeedMessage()
+        header = feed_message.header
+        header.gtfs_realtime_version = "1.0"
+        header.incrementality = alerts_pb2.FeedHeader.FULL_DATASET
+        header.timestamp = self.time
+        _mercury_feed_header(header).mercury_version = "1.0"
+        for alert in self._alerts:
+            entity = feed_message.entity.add()
+            entity.id = alert.alert_id
+            alert_message = entity.alert
+            for start, end in alert.active_periods:
+                active_period = alert_message.active_period.add()
+                active_period.start = start
+                if end is not None:
+                    active_period.end = end
+            for informed_entity in alert.informed_entities:
+                entity_selector = alert_message.informed_entity.add()
+                entity_selector.agency_id = "MTASBWY"
+                if informed_entity.route_id is not None:
+                    entity_selector.route_id = informed_entity.route_id
+                if informed_entity.stop_id is not None:
+                    entity_selector.stop_id = informed_entity.stop_id
+                _mercury_entity_selector(
+                    entity_selector
+                ).sort_order = informed_entity.sort_order
+            for field_name, text in [
+                ("header_text", alert.header),
+                ("description_text", alert.description),
+            ]:
+                translated_string = getattr(alert_message, field_name)
+                for language, template in [("en", "{}"), ("en-html", "<p>{}</p>")]:
+                    translation = translated_string.translation.add()
+                    translation.text = template.format(text)
+                    translation.language = language
+            mercury_alert = _mercury_alert(alert_message)
+            mercury_alert.created_at = alert.created_at
+            mercury_alert.updated_at = alert.updated_at
+            mercury_alert.alert_type = alert.alert_type
+        return feed_message
+
+    def _build_alert(self) -> _Alert:
+        rng = self._rng
+        self._next_alert_number += 1
+        route_ids = sorted(
+            rng.sample(
+                sorted(
+                    {
+                        route_id
+                        for route_ids in FEED_ID_TO_ROUTE_IDS.values()
+                        for route_id in route_ids
+                    }
+                ),
+                rng.randint(1, 4),
+            )
+        )
+        priority = rng.randint(1, 22)
+        informed_entities = [
+            _InformedEntity(
+                route_id=route_id,
+                stop_id=None,
+                sort_order=f"MTA NYCT:{route_id}:{priority}",
+            )
+            for route_id in route_ids
+        ]
+        for _ in range(rng.randint(0, 3)):
+            route_id = rng.choice(route_ids)
+            informed_entities.append(
+                _InformedEntity(
+                    route_id=None,
+                    stop_id=f"{route_id[0]}{rng.randint(0, 39):02}",
+                    sort_order=f"MTA NYCT:{route_id}:{priority}",
+                )
+            )
+        if rng.random() < self.non_alert_fraction:
+            header = rng.choice(["Weekend Service", "Weekday Service"])
+            alert_type = "Weekend Service"
+        else:
+            header = f"[{route_ids[0]}] " + self._build_text(8, 20)
+            alert_type = rng.choice(["Delays", "Planned Work", "Station Notice"])
+        active_periods = []
+        start = self.time - rng.randint(0, 7 * 86400)
+        for _ in range(rng.randint(1, 4)):
+            end = start + rng.randint(3600, 3 * 86400)
+            active_periods.append((start, None if rng.random() < 0.1 else end))
+            start = end + rng.randint(3600, 5 * 86400)
+        return _Alert(
+            alert_id=f"lmm:planned_work:{self._next_alert_number}",
+            alert_type=alert_type,
+            created_at=self.time - rng.randint(0, 14 * 86400),
+            updated_at=self.time - rng.randint(0, 86400),
+            header=header,
+            description=self._build_text(80, 400),
+            active_periods=active_periods,
+            informed_entities=informed_entities,
+        )
+
+    def _build_text(self, min_words: int, max_words: int) -> str:
+        num_words = self._rng.randint(min_words, max_words)
+        return " ".join(self._rng.choice(_WORDS) for _ in range(num_words))
+
+    def _advance(self) -> None:
+        rng = self._rng
+        self.time += self.poll_interval
+        alerts = []
+        for alert in self._alerts:
+            if rng.random() < self.churn:
+                if rng.random() < 0.2:
+                    alert = self._build_alert()
+                else:
+                    alert.updated_at = self.time
+                    alert.description = self._build_text(80, 400)
+            alerts.append(alert)
+        self._alerts = alerts
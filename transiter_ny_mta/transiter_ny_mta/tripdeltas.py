@@ -0,0 +1,87 @@
+"""
+Deltas between two consecutive snapshots of the trips in a feed.
+
+Trips are identified by their trip ID and stop times within a trip by their stop ID
+(together with the number of earlier stop times at the same stop, so that trips
+visiting a stop twice are handled). A trip is changed if any of its fields differ
+between the snapshots; for changed trips the delta contains only the stop times
+that are new or differ (for example, in their arrival time, departure time or track)
+and the stop IDs of the stop times that were removed.
+
+Diffing is exactly equivalent to comparing the two snapshots in full; it is just
+a compact representation of the result.
+"""
+import dataclasses
+import enum
+import typing
+
+from transiter import parse
+
+
+@dataclasses.dataclass
+class TripDelta:
+    class Type(enum.Enum):
+        ADDED = 1
+        REMOVED = 2
+        CHANGED = 3
+
+    type: Type
+    trip_id: str
+    # The new trip, or for removed trips the trip in the previous snapshot
+    trip: parse.Trip
+    stop_times: typing.List[parse.TripStopTime] = dataclasses.field(
+        default_factory=list
+    )
+    removed_stop_ids: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+def diff(
+    old_trips: typing.Dict[str, parse.Trip], new_trips: typing.Dict[str, parse.Trip]
+) -> typing.Iterator[TripDelta]:
+    """
+    Yield the deltas that transform one snapshot, keyed by trip ID, into another.
+    """
+    for trip_id, new_trip in new_trips.items():
+        old_trip = old_trips.get(trip_id)
+        if old_trip is None:
+            yield TripDelta(
+                type=TripDelta.Type.ADDED,
+                trip_id=trip_id,
+                trip=new_trip,
+                stop_times=list(new_trip.stop_times),
+            )
+            continue
+        # Trips built from unchanged content may be the very same object
+        if old_trip is new_trip or old_trip == new_trip:
+            continue
+        key_to_old_stop_time = dict(_key_stop_times(old_trip.stop_times))
+        stop_times = []
+        for key, new_stop_time in _key_stop_times(new_trip.stop_times):
+            old_stop_time = key_to_old_stop_time.pop(key, None)
+            if old_stop_time != new_stop_time:
+                stop_times.append(new_stop_time)
+        yield TripDelta(
+            type=TripDelta.Type.CHANGED,
+            trip_id=trip_id,
+            trip=new_trip,
+            stop_times=stop_times,
+            removed_stop_ids=[stop_id for stop_id, _ in key_to_old_stop_time.keys()],
+        )
+    for trip_id, old_trip in old_trips.items():
+        if trip_id not in new_trips:
+            yield TripDelta(type=TripDelta.Type.REMOVED, trip_id=trip_id, trip=old_trip)
+
+
+def build_snapshot(trips: typing.Iterable[parse.Trip]) -> typing.Dict[str, parse.Trip]:
+    """
+    Key trips by trip ID; if a trip ID is repeated, the last trip is kept.
+    """
+    return {trip.id: trip for trip in trips}
+
+
+def _key_stop_times(stop_times):
+    stop_id_to_count = {}
+    for stop_time in stop_times:
+        count = stop_id_to_count.get(stop_time.stop_id, 0)
+        stop_id_to_count[stop_time.stop_id] = count + 1
+        yield (stop_time.stop_id, count), stop_time
@@ -0,0 +1,215 @@
+"""
+A minimal reader for the protobuf wire format.
+
+This is used to work with the entities of a serialized GTFS Realtime feed message
+without decoding the whole message. The reference for the format is here:
+https://developers.google.com/protocol-buffers/docs/encoding
+"""
+import typing
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+FEED_MESSAGE_HEADER = 1
+FEED_MESSAGE_ENTITY = 2
+FEED_ENTITY_ID = 1
+FEED_ENTITY_TRIP_UPDATE = 3
+FEED_ENTITY_VEHICLE = 4
+FEED_ENTITY_ALERT = 5
+# The trip descriptor is field 1 of both TripUpdate and VehiclePosition
+TRIP_DESCRIPTOR = 1
+TRIP_DESCRIPTOR_ROUTE_ID = 5
+ALERT_HEADER_TEXT = 10
+TRANSLATED_STRING_TRANSLATION = 1
+TRANSLATION_TEXT = 1
+TRANSLATION_LANGUAGE = 2
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+class Field(typing.NamedTuple):
+    """
+    A field in a serialized message.
+
+    The field occupies buffer[start:end], and its value (the varint or fixed bytes,
+    or for a length delimited field the payload) occupies buffer[value_start:end].
+    """
+
+    number: int
+    wire_type: int
+    start: int
+    value_start: int
+    end: int
+
+
+def read_varint(buffer, position: int) -> typing.Tuple[int, int]:
+    """
+    Read a varint starting at the position and return it with the position after it.
+    """
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = buffer[position]
+        except IndexError:
+            raise WireFormatError("Truncated varint")
+        result |= (byte & 0x7F) << shift
+        position += 1
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+        if shift >= 64:
+            raise WireFormatError("Varint too long")
+
+
+def iter_fields(buffer, start: int = 0, end: int = None) -> typing.Iterator[Field]:
+    """
+    Iterate over the fields of the message serialized in buffer[start:end].
+    """
+    if end is None:
+        end = len(buffer)
+    position = start
+    while position < end:
+        field_start = position
+        tag, position = read_varint(buffer, position)
+        number = tag >> 3
+        wire_type = tag & 0x7
+        value_start = position
+        if wire_type == VARINT:
+            _, position = read_varint(buffer, position)
+        elif wire_type == LENGTH_DELIMITED:
+            length, value_start = read_varint(buffer, position)
+            position = value_start + length
+        elif wire_type == FIXED64:
+            position += 8
+        elif wire_type == FIXED32:
+            position += 4
+        else:
+            # Groups (wire types 3 and 4) are deprecated and not used in GTFS Realtime
+            raise WireFormatError(f"Unsupported wire type {wire_type}")
+        if position > end:
+            raise WireFormatError("Truncated field")
+        yield Field(number, wire_type, field_start, value_start, position)
+
+
+def find_fields(buffer, number: int, start: int = 0, end: int = None):
+    """
+    Return the fields with the given number in the message serialized in buffer.
+    """
+    return [
+        field for field in iter_fields(buffer, start, end) if field.number == number
+    ]
+
+
+def split_feed_message(
+    content,
+) -> typing.Tuple[typing.Optional[memoryview], typing.List[memoryview]]:
+    """
+    Split a serialized FeedMessage into its serialized header and entities.
+
+    The returned memoryviews reference the content without copying it.
+    """
+    view = memoryview(content)
+    header = None
+    entities = []
+    for field in iter_fields(view):
+        if field.wire_type != LENGTH_DELIMITED:
+            continue
+        if field.number == FEED_MESSAGE_ENTITY:
+            entities.append(view[field.value_start : field.end])
+        elif field.number == FEED_MESSAGE_HEADER:
+            header = view[field.value_start : field.end]
+    return header, entities
+
+
+def entity_route_ids(
+    buffer, start: int = 0, end: int = None
+) -> typing.Dict[int, typing.Optional[str]]:
+    """
+    Return the route IDs of a serialized FeedEntity keyed by field number.
+
+    The keys are FEED_ENTITY_TRIP_UPDATE and FEED_ENTITY_VEHICLE, for each of the
+    fields that is present. As in the decoder, repeated occurrences of a message
+    field are merged and the last value of a scalar field wins.
+    """
+    number_to_route_id = {}
+    for field in iter_fields(buffer, start, end):
+        if field.wire_type != LENGTH_DELIMITED or (
+            field.number != FEED_ENTITY_TRIP_UPDATE
+            and field.number != FEED_ENTITY_VEHICLE
+        ):
+            continue
+        route_id = number_to_route_id.get(field.number)
+        for trip_field in iter_fields(buffer, field.value_start, field.end):
+            if (
+                trip_field.number != TRIP_DESCRIPTOR
+                or trip_field.wire_type != LENGTH_DELIMITED
+            ):
+                continue
+            for route_field in iter_fields(
+                buffer, trip_field.value_start, trip_field.end
+            ):
+                if (
+                    route_field.number == TRIP_DESCRIPTOR_ROUTE_ID
+                    and route_field.wire_type == LENGTH_DELIMITED
+                ):
+                    route_id = str(
+                        buffer[route_field.value_start : route_field.end], "utf-8"
+                    )
+        number_to_route_id[field.number] = route_id
+    return number_to_route_id
+
+
+def alert_header_translations(
+    buffer, start: int = 0, end: int = None
+) -> typing.Optional[typing.List[typing.Tuple[typing.Optional[str], str]]]:
+    """
+    Return the (language, text) pairs of the alert header of a serialized FeedEntity.
+
+    Returns None if the entity has no alert. The language is None if it is not set,
+    and, as in the decoder, the translations of repeated occurrences of the alert
+    and header fields are concatenated.
+    """
+    translations = None
+    for field in iter_fields(buffer, start, end):
+        if field.number != FEED_ENTITY_ALERT or field.wire_type != LENGTH_DELIMITED:
+            continue
+        if translations is None:
+            translations = []
+        for header_field in iter_fields(buffer, field.value_start, field.end):
+            if (
+                header_field.number != ALERT_HEADER_TEXT
+                or header_field.wire_type != LENGTH_DELIMITED
+            ):
+                continue
+            for translation_field in iter_fields(
+                buffer, header_field.value_start, header_field.end
+            ):
+                if (
+                    translation_field.number != TRANSLATED_STRING_TRANSLATION
+                    or translation_field.wire_type != LENGTH_DELIMITED
+                ):
+                    continue
+                language = None
+                text = ""
+                for string_field in iter_fields(
+                    buffer, translation_field.value_start, translation_field.end
+                ):
+                    if string_field.wire_type != LENGTH_DELIMITED:
+                        continue
+                    if string_field.number == TRANSLATION_TEXT:
+                        text = str(
+                            buffer[string_field.value_start : string_field.end],
+                            "utf-8",
+                        )
+                    elif string_field.number == TRANSLATION_LANGUAGE:
+                        language = str(
+                            buffer[string_field.value_start : string_field.end],
+                            "utf-8",
+                        )
+                translations.append((language, text))
+    return translations